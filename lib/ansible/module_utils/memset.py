@@ -25,34 +25,729 @@
 # LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
 # USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-from ansible.module_utils.six.moves.urllib.parse import urlencode
-from ansible.module_utils.urls import open_url, urllib_error
+import codecs
+import errno
+import hashlib
+import math
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+
+from ansible.module_utils.parsing.convert_bool import boolean
+from ansible.module_utils.six import string_types
+from ansible.module_utils.six.moves.queue import Empty, Queue
+from ansible.module_utils.six.moves.urllib import error as urllib_error
+from ansible.module_utils.six.moves.urllib.parse import urlencode, urlparse
 from ansible.module_utils.basic import json
 
+MEMSET_API_URL = 'https://api.memset.com/v1/json/'
+
+# connection pools are kept for the lifetime of the module's process and
+# are keyed by the API host, so every call a module makes reuses them.
+_POOLS = dict()
+_POOLS_LOCK = threading.Lock()
+
+# list responses which may be served from the on-disk cache, and the
+# method suffixes which change account state and so invalidate it.
+CACHEABLE_METHODS = ['dns.zone_domain_list', 'dns.zone_list', 'dns.zone_record_list']
+MUTATING_SUFFIXES = ('_create', '_update', '_delete')
+
+# transient failures are retried with capped exponential backoff and full
+# jitter. Only methods which read state are retried on server errors and
+# dropped connections; anything else is only retried when the API says
+# the request was not processed (429) or the connection was refused.
+RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 30
+IDEMPOTENT_SUFFIXES = ('_list', '_info', '.list', '.info', '.status')
+
+_RETRY_STATS = dict(retries=0, backoff_seconds=0.0)
+_RETRY_STATS_LOCK = threading.Lock()
+
+# every API call made by the module is recorded so that the module can
+# report where its time went. Setting MEMSET_API_TRACE to a file path
+# additionally appends one JSON line per call to that file.
+_API_CALLS = []
+_API_CALLS_LOCK = threading.Lock()
+
+# optional features live in their own module_utils files (memset_broker,
+# memset_single_flight and memset_journal), so that a module only carries
+# those it imports. Importing one registers it with memset_api_call: a
+# router may make a call in place of the direct request, and an observer
+# is told about every call once it has been made.
+_ROUTERS = []
+_OBSERVERS = []
+
+API_HEADERS = {'Content-Type': 'application/x-www-form-urlencoded'}
+
+# error responses which aren't JSON are quoted in the error message up
+# to this many characters.
+ERROR_BODY_LENGTH = 500
+
+# list responses which are parsed incrementally are read in chunks of
+# this many bytes.
+STREAM_CHUNK_SIZE = 65536
+
+# a zone's records can be fetched on their own with dns.zone_info, or
+# with every other record in the account with dns.zone_record_list. One
+# call per zone is only worth it when a run touches a few zones of a
+# larger account, so it is used for up to this many zones, and at most
+# this fraction of the account's zones.
+FETCH_STRATEGIES = ['auto', 'zone_info', 'record_list']
+ZONE_INFO_MAX_ZONES = 32
+ZONE_INFO_MAX_FRACTION = 0.25
+
+RECORD_TYPES = ['A', 'AAAA', 'CNAME', 'MX', 'NS', 'SRV', 'TXT']
+TTL_CHOICES = [0, 300, 600, 900, 1800, 3600, 7200, 10800, 21600, 43200, 86400]
+RECORD_ALIASES = dict(ip='address', data='address')
+
 
 class Response(object):
     '''
-    Create a response object to mimic that of requests.
+    Create a response object to mimic that of requests. The body is
+    parsed the first time json() is called and the result is kept, so
+    callers can call it as often as they like.
     '''
 
     def __init__(self):
-        self.content = None
         self.status_code = None
+        # for filtered list responses, the number of items in the list
+        # before it was filtered.
+        self.item_count = None
+        self._content = None
+        self._json = None
+        self._parsed = False
+
+    @property
+    def content(self):
+        return self._content
+
+    @content.setter
+    def content(self, content):
+        self._content = content
+        self._json = None
+        self._parsed = False
 
     def json(self):
-        return json.loads(self.content)
+        if not self._parsed:
+            self._json = json.loads(self._content)
+            self._parsed = True
+        return self._json
+
+    def set_json(self, data):
+        '''
+        Replace the body with already parsed data, dropping the raw body.
+        '''
+        self._content = None
+        self._json = data
+        self._parsed = True
+
+
+def project_fields(data, fields):
+    '''
+    Keep only the given keys of a dict, or of each dict in a list.
+    '''
+    if isinstance(data, dict):
+        return(dict([(key, data[key]) for key in fields if key in data]))
+    if isinstance(data, list):
+        return([project_fields(item, fields) for item in data])
+    return(data)
+
+
+def iter_json_list(chunks):
+    '''
+    Incrementally parse a JSON list from an iterable of text chunks,
+    yielding each item as soon as it is complete. Only one item (plus
+    one chunk) is held in memory at a time, regardless of the size of
+    the list.
+    '''
+    decoder = json.JSONDecoder()
+    whitespace = ' \t\r\n'
+    chunks = iter(chunks)
+    buf, pos = '', 0
+    started, eof = False, False
+
+    while True:
+        while pos < len(buf) and (buf[pos] in whitespace or (started and buf[pos] == ',')):
+            pos += 1
+
+        if pos < len(buf):
+            if not started:
+                if buf[pos] != '[':
+                    raise ValueError('Expected a JSON list')
+                started = True
+                pos += 1
+                continue
+            if buf[pos] == ']':
+                return
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                if eof:
+                    raise
+            else:
+                # a scalar may have been cut short at the end of the buffer
+                # (e.g. 12 of 123), so an item only counts once it is
+                # followed by a comma or the end of the list.
+                following = end
+                while following < len(buf) and buf[following] in whitespace:
+                    following += 1
+                if following < len(buf) and buf[following] in ',]':
+                    yield item
+                    pos = following
+                    continue
+                if eof:
+                    raise ValueError('Expected , or ] after item in JSON list')
+        elif eof:
+            raise ValueError('Unexpected end of JSON list')
+
+        try:
+            chunk = next(chunks)
+        except StopIteration:
+            eof = True
+            continue
+        buf = buf[pos:] + chunk
+        pos = 0
+
+
+class JSONListFilter(object):
+    '''
+    Reads a JSON list response body in chunks and keeps only the items
+    for which predicate returns true, so the memory used depends on the
+    number of matches rather than the size of the response. After the
+    body has been read, items holds the matches, item_count the number
+    of items in the whole list and bytes_read the size of the body. If
+    fields is given, only those keys of each match are kept.
+    '''
+
+    def __init__(self, predicate=None, fields=None):
+        self.predicate = predicate
+        self.fields = fields
+        self.items = None
+        self.item_count = 0
+        self.bytes_read = 0
+
+    def _chunks(self, fileobj):
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        while True:
+            chunk = fileobj.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            self.bytes_read += len(chunk)
+            yield decoder.decode(chunk)
+        yield decoder.decode(b'', final=True)
+
+    def filter(self, chunks):
+        items = []
+        self.item_count = 0
+        for item in iter_json_list(chunks):
+            self.item_count += 1
+            if self.predicate is None or self.predicate(item):
+                items.append(item if self.fields is None else project_fields(item, self.fields))
+        return(items)
+
+    def __call__(self, fileobj):
+        # a retried request starts again from scratch.
+        self.bytes_read = 0
+        self.items = self.filter(self._chunks(fileobj))
+        return(b'')
+
+
+def _http_client():
+    '''
+    The HTTP transport (and ssl, and open_url's dependencies) is only
+    imported once a module calls the API, so modules which fail argument
+    validation, and check mode runs served from a plan, don't pay for it.
+    '''
+    from ansible.module_utils.six.moves import http_client
+    return(http_client)
+
+
+def _has_sslcontext():
+    try:
+        import ssl
+    except ImportError:
+        return(False)
+    return(hasattr(ssl, 'create_default_context'))
+
+
+def _import_transport():
+    '''
+    Import everything needed to make API calls up front, for processes
+    (the broker) which outlive the files they were imported from.
+    '''
+    _http_client()
+    _has_sslcontext()
+    from email.utils import parsedate_tz  # noqa: F401
+    from ansible.module_utils.urls import open_url  # noqa: F401
+
+
+def _is_stale_connection_error(error):
+    '''
+    Returns true if the error shows that a kept-alive connection had
+    been closed by the server before the request was sent: the server
+    hung up without a response, or the connection was reset or broken.
+    A timeout never counts, as the API may still be handling the call.
+    '''
+    if isinstance(error, socket.timeout):
+        return(False)
+    http_client = _http_client()
+    remote_disconnected = getattr(http_client, 'RemoteDisconnected', None)
+    if remote_disconnected is not None and isinstance(error, remote_disconnected):
+        return(True)
+    # python 2 reports a connection closed without a status line as an
+    # empty one.
+    if isinstance(error, http_client.BadStatusLine) and getattr(error, 'line', None) in ('', "''"):
+        return(True)
+    return(getattr(error, 'errno', None) in (errno.EPIPE, errno.ECONNRESET, errno.ECONNABORTED))
+
+
+class ConnectionPool(object):
+    '''
+    Keeps HTTPS connections to the Memset API alive so they can be
+    reused by every call a module makes, rather than paying for a new
+    TCP and TLS handshake per call. Connections are handed out one per
+    request, so the pool is safe to share between threads.
+    '''
+
+    def __init__(self, host, port=443, scheme='https', maxsize=8, timeout=10):
+        self.host = host
+        self.port = port
+        self.scheme = scheme
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.connections_opened = 0
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _new_connection(self):
+        with self._lock:
+            self.connections_opened += 1
+        http_client = _http_client()
+        if self.scheme == 'http':
+            return(http_client.HTTPConnection(self.host, self.port, timeout=self.timeout))
+        import ssl
+        context = ssl.create_default_context()
+        return(http_client.HTTPSConnection(self.host, self.port, timeout=self.timeout, context=context))
+
+    def _get_connection(self):
+        with self._lock:
+            if self._idle:
+                return(self._idle.pop(), True)
+        return(self._new_connection(), False)
+
+    def _put_connection(self, conn):
+        with self._lock:
+            if len(self._idle) < self.maxsize:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def request(self, path, body, headers, reader=None):
+        '''
+        POST the body to the given path and return the status code, raw
+        response body and (lower-cased) response headers. A kept-alive connection may have been closed
+        by the server while idle, in which case the request is retried
+        once on a fresh connection. Any other failure (a timeout above
+        all) may have reached the API, so is raised rather than sending
+        the request again. If a reader is given, successful
+        response bodies are passed to it as a file object instead of
+        being read into memory, and its return value is used as the body.
+        '''
+        conn, reused = self._get_connection()
+        try:
+            conn.request('POST', path, body=body, headers=headers)
+            resp = conn.getresponse()
+        except (_http_client().HTTPException, socket.error) as e:
+            conn.close()
+            if not reused or not _is_stale_connection_error(e):
+                raise
+            conn, reused = self._new_connection(), False
+            conn.request('POST', path, body=body, headers=headers)
+            resp = conn.getresponse()
+
+        try:
+            if reader is not None and resp.status == 200:
+                content = reader(resp)
+            else:
+                content = resp.read()
+        except Exception:
+            conn.close()
+            raise
+        resp_headers = dict((key.lower(), value) for key, value in resp.getheaders())
+        if resp.will_close:
+            conn.close()
+        else:
+            self._put_connection(conn)
+
+        return(resp.status, content, resp_headers)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+def get_connection_pool(api_uri):
+    '''
+    Returns the shared connection pool for the host in the given URI,
+    creating it on first use.
+    '''
+    parsed = urlparse(api_uri)
+    with _POOLS_LOCK:
+        if parsed.netloc not in _POOLS:
+            default_port = 80 if parsed.scheme == 'http' else 443
+            _POOLS[parsed.netloc] = ConnectionPool(host=parsed.hostname, port=parsed.port or default_port, scheme=parsed.scheme)
+        return(_POOLS[parsed.netloc])
+
+
+def close_connection_pools():
+    '''
+    Closes all idle connections held by the shared pools.
+    '''
+    with _POOLS_LOCK:
+        for pool in _POOLS.values():
+            pool.close()
+
+
+def _use_proxy():
+    for var in ['https_proxy', 'HTTPS_PROXY', 'all_proxy', 'ALL_PROXY']:
+        if os.environ.get(var):
+            return(True)
+    return(False)
+
+
+def _keepalive_request(api_uri, data, headers, reader=None):
+    '''
+    Send the request over a pooled keep-alive connection.
+    '''
+    pool = get_connection_pool(api_uri)
+    return(pool.request(urlparse(api_uri).path, data, headers, reader=reader))
+
+
+def _open_url_request(api_uri, data, headers, reader=None):
+    '''
+    Send the request with open_url, which opens a new connection for
+    every call but understands proxies.
+    '''
+    from ansible.module_utils.urls import open_url
+    try:
+        resp = open_url(api_uri, data=data, headers=headers, method="POST")
+        resp_headers = dict((key.lower(), value) for key, value in resp.info().items())
+        if reader is not None and resp.getcode() == 200:
+            return(resp.getcode(), reader(resp), resp_headers)
+        return(resp.getcode(), resp.read(), resp_headers)
+    except urllib_error.HTTPError as e:
+        try:
+            errorcode = e.code
+        except AttributeError:
+            errorcode = None
+        resp_headers = dict((key.lower(), value) for key, value in e.info().items())
+        return(errorcode, e.read(), resp_headers)
+
+
+def _api_request(api_uri, data, headers, reader=None):
+    '''
+    Pick a transport for the request; pooled connections are used unless
+    a proxy is configured or the SSL module is too old to support them.
+    '''
+    if _has_sslcontext() and not _use_proxy():
+        return(_keepalive_request(api_uri, data, headers, reader=reader))
+    return(_open_url_request(api_uri, data, headers, reader=reader))
+
+
+def is_idempotent_method(api_method):
+    '''
+    Returns true if the API method only reads state, so can safely be
+    repeated.
+    '''
+    return(api_method.endswith(IDEMPOTENT_SUFFIXES))
+
+
+def _retry_after(resp_headers):
+    '''
+    Returns the delay in seconds requested by a Retry-After header, which
+    may be given as seconds or an HTTP date, or None if there isn't one.
+    '''
+    value = resp_headers.get('retry-after')
+    if not value:
+        return(None)
+    try:
+        return(max(0.0, float(value)))
+    except ValueError:
+        from email.utils import mktime_tz, parsedate_tz
+        parsed = parsedate_tz(value)
+        if parsed is None:
+            return(None)
+        return(max(0.0, mktime_tz(parsed) - time.time()))
+
+
+def _api_request_with_retries(api_method, api_uri, data, headers, reader=None, retry_stats=None):
+    '''
+    Make the request, retrying transient failures with capped exponential
+    backoff and full jitter (or the delay the API asked for). Returns the
+    status code, raw body and number of retries made; if the API could
+    not be reached at all the status code is None and the body describes
+    the connection error. Retries are counted in retry_stats as well as
+    the module's totals if it is given.
+    '''
+    try:
+        max_retries = int(os.environ.get('MEMSET_API_RETRIES', 3))
+    except ValueError:
+        max_retries = 3
+    idempotent = is_idempotent_method(api_method)
+    attempt = 0
+
+    while True:
+        retry_after, error = None, None
+        try:
+            status_code, content, resp_headers = _api_request(api_uri, data, headers, reader=reader)
+            retry_after = _retry_after(resp_headers)
+            retryable = status_code == 429 or (idempotent and status_code in RETRY_STATUS_CODES)
+        except (_http_client().HTTPException, socket.error, urllib_error.URLError) as e:
+            error = e
+            reason = getattr(e, 'reason', e)
+            refused = getattr(reason, 'errno', None) == errno.ECONNREFUSED
+            retryable = idempotent or refused
+
+        if not retryable or attempt >= max_retries:
+            break
+
+        delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+        if retry_after is not None:
+            delay = min(RETRY_MAX_DELAY, retry_after)
+        with _RETRY_STATS_LOCK:
+            _RETRY_STATS['retries'] += 1
+            _RETRY_STATS['backoff_seconds'] += delay
+            if retry_stats is not None:
+                retry_stats['retries'] += 1
+                retry_stats['backoff_seconds'] += delay
+        time.sleep(delay)
+        attempt += 1
+
+    if error is not None:
+        content = json.dumps(dict(error_type='ConnectionError', error=str(error))).encode('utf-8')
+        return(None, content, attempt)
+
+    return(status_code, content, attempt)
+
+
+def memset_api_retry_stats():
+    '''
+    Returns how many API calls have been retried so far and the total
+    time spent backing off, for inclusion in module results.
+    '''
+    with _RETRY_STATS_LOCK:
+        return(dict(retries=_RETRY_STATS['retries'], backoff_seconds=round(_RETRY_STATS['backoff_seconds'], 3)))
+
+
+def _percentile(values, percent):
+    '''
+    Nearest-rank percentile of a list of numbers.
+    '''
+    ordered = sorted(values)
+    rank = max(1, int(math.ceil(percent / 100.0 * len(ordered))))
+    return(ordered[rank - 1])
+
+
+def _record_api_call(api_method, status_code, latency, request_bytes, response_bytes, retries, cached):
+    '''
+    Record the outcome of a single API call, and append it to the trace
+    file if one has been configured. Failing to write the trace never
+    fails the call.
+    '''
+    call = dict(method=api_method, status=status_code, latency=round(latency, 6), request_bytes=request_bytes,
+                response_bytes=response_bytes, retries=retries, cached=cached)
+    with _API_CALLS_LOCK:
+        _API_CALLS.append(call)
+
+    trace_path = os.environ.get('MEMSET_API_TRACE')
+    if not trace_path:
+        return
+    line = dict(call)
+    line['time'] = round(time.time(), 6)
+    line['pid'] = os.getpid()
+    try:
+        with _API_CALLS_LOCK:
+            with open(os.path.expanduser(trace_path), 'a') as f:
+                f.write(json.dumps(line, sort_keys=True) + '\n')
+    except (IOError, OSError):
+        pass
+
+
+def memset_api_stats():
+    '''
+    Returns the number of API calls made so far and their total and 95th
+    percentile latency in seconds, overall and per API method, for
+    inclusion in module results.
+    '''
+    with _API_CALLS_LOCK:
+        api_calls = list(_API_CALLS)
 
+    def summarise(calls):
+        latencies = [call['latency'] for call in calls]
+        return(dict(calls=len(calls),
+                    latency_total=round(sum(latencies), 3),
+                    latency_p95=round(_percentile(latencies, 95), 3) if latencies else 0.0,
+                    request_bytes=sum([call['request_bytes'] for call in calls]),
+                    response_bytes=sum([call['response_bytes'] for call in calls]),
+                    retries=sum([call['retries'] for call in calls])))
 
-def memset_api_call(api_key, api_method, payload=None):
+    by_method = dict()
+    for call in api_calls:
+        by_method.setdefault(call['method'], []).append(call)
+
+    stats = summarise(api_calls)
+    stats['methods'] = dict([(api_method, summarise(calls)) for api_method, calls in by_method.items()])
+
+    return(stats)
+
+
+def is_mutating_method(api_method):
+    '''
+    Returns true if the API method changes account state.
+    '''
+    return(api_method.endswith(MUTATING_SUFFIXES))
+
+
+def is_dns_change(api_method):
+    '''
+    Returns true if the API method changes a zone, domain or record, and
+    so needs a DNS reload to be published.
+    '''
+    return(api_method.startswith('dns.') and is_mutating_method(api_method))
+
+
+class ResponseCache(object):
+    '''
+    An on-disk cache of list responses which is shared between tasks on
+    the controller. Entries are stored per account (a hash of the API
+    key) and per method, expire after the TTL and are dropped for the
+    whole account whenever a mutating call is made with that key.
+
+    The cache is opt-in and is enabled by setting MEMSET_CACHE_DIR; the
+    TTL in seconds is read from MEMSET_CACHE_TTL.
+    '''
+
+    def __init__(self, path, ttl=60):
+        self.path = path
+        self.ttl = ttl
+
+    @classmethod
+    def from_environment(cls):
+        path = os.environ.get('MEMSET_CACHE_DIR')
+        if not path:
+            return(None)
+        try:
+            ttl = int(os.environ.get('MEMSET_CACHE_TTL', 60))
+        except ValueError:
+            ttl = 60
+        return(cls(path=os.path.expanduser(path), ttl=ttl))
+
+    def _account_dir(self, api_key):
+        key_hash = hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+        return(os.path.join(self.path, key_hash))
+
+    def _entry_path(self, api_key, api_method):
+        method_hash = hashlib.sha256(api_method.encode('utf-8')).hexdigest()
+        return(os.path.join(self._account_dir(api_key), method_hash))
+
+    def get(self, api_key, api_method):
+        '''
+        Returns the cached (status_code, content) for the method, or None
+        if there is no entry or it has expired.
+        '''
+        entry = self._entry_path(api_key, api_method)
+        try:
+            if time.time() - os.path.getmtime(entry) > self.ttl:
+                return(None)
+            with open(entry, 'r') as f:
+                cached = json.load(f)
+        except (IOError, OSError, ValueError):
+            return(None)
+
+        return(cached['status_code'], cached['content'])
+
+    def set(self, api_key, api_method, status_code, content):
+        account_dir = self._account_dir(api_key)
+        try:
+            if not os.path.isdir(account_dir):
+                os.makedirs(account_dir, 0o700)
+            # write to a temporary file and rename it into place so that
+            # concurrent readers never see a partial entry.
+            fd, tmp_path = tempfile.mkstemp(dir=account_dir)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(dict(status_code=status_code, content=content), f)
+            os.rename(tmp_path, self._entry_path(api_key, api_method))
+        except (IOError, OSError):
+            pass
+
+    def invalidate(self, api_key):
+        account_dir = self._account_dir(api_key)
+        try:
+            entries = os.listdir(account_dir)
+        except OSError:
+            return
+        for entry in entries:
+            try:
+                os.remove(os.path.join(account_dir, entry))
+            except OSError:
+                pass
+
+
+def register_router(router, first=False):
+    '''
+    Have memset_api_call offer its calls to router(api_key, api_method,
+    payload, api_uri, data, fetch, reader), which returns the status code,
+    raw body, number of retries and whether the result was shared, or None
+    to leave the call to the next router (or a direct request). Routers
+    are tried in the order they were registered, unless first is set.
+    '''
+    if router in _ROUTERS:
+        return
+    if first:
+        _ROUTERS.insert(0, router)
+    else:
+        _ROUTERS.append(router)
+
+
+def register_observer(observer):
+    '''
+    Have memset_api_call call observer(api_key, api_method, payload,
+    status_code, cached) after every call it makes.
+    '''
+    if observer not in _OBSERVERS:
+        _OBSERVERS.append(observer)
+
+
+def memset_api_call(api_key, api_method, payload=None, item_filter=None, fields=None):
     '''
     Generic function which returns results back to calling function.
 
     Requires an API key and an API method to assemble the API URL.
     Returns response text to be analysed.
+
+    For list methods, item_filter may be a function which is passed each
+    item of the list; the response is then parsed as it is read and only
+    the items for which it returns true are kept.
+
+    fields may be a list of keys to keep from the response (or from each
+    item of a list response); everything else, including the raw body,
+    is dropped as soon as the response has been parsed.
     '''
     # instantiate a response object
     response = Response()
 
+    # list responses can be served from the opt-in cache, which must be
+    # dropped for the account on any call that changes it.
+    cache = ResponseCache.from_environment()
+    cacheable = cache is not None and api_method in CACHEABLE_METHODS and not payload
+    mutating = cache is not None and is_mutating_method(api_method)
+
     # if we've already started preloading the payload then copy it
     # and use that, otherwise we need to isntantiate it.
     if payload is None:
@@ -66,28 +761,92 @@ def memset_api_call(api_key, api_method, payload=None):
     msg = None
 
     data = urlencode(payload)
-    headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-    api_uri_base = 'https://api.memset.com/v1/json/'
-    api_uri = '{0}{1}/' . format(api_uri_base, api_method)
+    api_uri = '{0}{1}/' . format(MEMSET_API_URL, api_method)
 
-    try:
-        resp = open_url(api_uri, data=data, headers=headers, method="POST")
-        response.content = resp.read().decode('utf-8')
-        response.status_code = resp.getcode()
-    except urllib_error.HTTPError as e:
-        try:
-            errorcode = e.code
-        except AttributeError:
-            errorcode = None
+    # a response which will be cached has to be read in full, so it is
+    # filtered after it has been stored rather than as it is read.
+    reader = None
+    if item_filter is not None and not cacheable:
+        reader = JSONListFilter(item_filter, fields=fields)
+
+    cached = None
+    shared = False
+    retries = 0
+    start = time.time()
+    if cacheable:
+        cached = cache.get(api_key, api_method)
+
+    if cached is not None:
+        status_code, response.content = cached
+        response_bytes = len(response.content)
+    else:
+        if mutating:
+            cache.invalidate(api_key)
 
+        def fetch(reader):
+            return(_api_request_with_retries(api_method, api_uri, data, API_HEADERS, reader=reader))
+
+        routed = None
+        for router in _ROUTERS:
+            routed = router(api_key, api_method, payload, api_uri, data, fetch, reader)
+            if routed is not None:
+                break
+
+        if routed is not None:
+            status_code, content, retries, shared = routed
+        else:
+            status_code, content, retries = fetch(reader)
+        if reader is not None and status_code == 200:
+            response.set_json(reader.items)
+            response.item_count = reader.item_count
+            response_bytes = reader.bytes_read
+        else:
+            response_bytes = len(content)
+            response.content = content.decode('utf-8')
+        if cacheable and status_code == 200:
+            cache.set(api_key, api_method, status_code, response.content)
+        if mutating:
+            # invalidate again in case a concurrent task cached a list
+            # response while this call was in flight.
+            cache.invalidate(api_key)
+
+    for observer in _OBSERVERS:
+        observer(api_key, api_method, payload, status_code, cached is not None)
+
+    # the request body includes the API key, so only its size is recorded.
+    # a result shared with another process's call, or served from the
+    # broker's memory, counts as cached.
+    _record_api_call(api_method, status_code, time.time() - start, len(data), response_bytes, retries,
+                     cached is not None or shared)
+
+    response.status_code = status_code
+
+    if status_code == 200 and response.content is not None:
+        if item_filter is not None:
+            content = response.content
+            chunks = (content[idx:idx + STREAM_CHUNK_SIZE] for idx in range(0, len(content), STREAM_CHUNK_SIZE))
+            list_filter = JSONListFilter(item_filter, fields=fields)
+            response.set_json(list_filter.filter(chunks))
+            response.item_count = list_filter.item_count
+        elif fields is not None:
+            response.set_json(project_fields(response.json(), fields))
+
+    if status_code is None or status_code >= 400:
         has_failed = True
-        response.content = e.read().decode('utf8')
-        response.status_code = errorcode
 
-        if response.status_code is not None:
-            msg = "Memset API returned a {0} response ({1}, {2})." . format(response.status_code, response.json()['error_type'], response.json()['error'])
+        # errors which don't come from the API itself (e.g. a proxy's 502
+        # page) aren't JSON, so are reported as they are.
+        try:
+            error_type, error = response.json()['error_type'], response.json()['error']
+        except (ValueError, TypeError, KeyError):
+            error_type, error = None, None
+
+        if error_type is None:
+            msg = "Memset API returned a {0} response: {1}" . format(response.status_code, (response.content or '').strip()[:ERROR_BODY_LENGTH])
+        elif response.status_code is not None:
+            msg = "Memset API returned a {0} response ({1}, {2})." . format(response.status_code, error_type, error)
         else:
-            msg = "Memset API returned an error ({0}, {1})." . format(response.json()['error_type'], response.json()['error'])
+            msg = "Memset API returned an error ({0}, {1})." . format(error_type, error)
 
     del payload['api_key']
 
@@ -97,6 +856,259 @@ def memset_api_call(api_key, api_method, payload=None):
     return(has_failed, msg, response)
 
 
+def memset_api_calls(api_key, calls, max_concurrency=1):
+    '''
+    Make a batch of independent API calls through a bounded pool of
+    worker threads. Calls is a list of (api_method, payload) tuples and
+    the (has_failed, msg, response) result of each call is returned in
+    the same order, so callers can report success or failure per item.
+    '''
+    results = [None] * len(calls)
+    workers = max(1, min(max_concurrency, len(calls)))
+
+    # make sure the connection pool can keep one connection per worker alive.
+    pool = get_connection_pool(MEMSET_API_URL)
+    pool.maxsize = max(pool.maxsize, workers)
+
+    queue = Queue()
+    for idx, call in enumerate(calls):
+        queue.put((idx, call))
+
+    def worker():
+        while True:
+            try:
+                idx, (api_method, payload) = queue.get_nowait()
+            except Empty:
+                return
+            try:
+                results[idx] = memset_api_call(api_key=api_key, api_method=api_method, payload=payload)
+            except Exception as e:
+                # an exception in one call (e.g. a connection error) should
+                # only fail that item rather than the whole batch.
+                msg = "Memset API call {0} failed ({1})." . format(api_method, e)
+                results[idx] = (True, msg, Response())
+
+    if workers == 1:
+        worker()
+    else:
+        threads = [threading.Thread(target=worker) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    return(results)
+
+
+def wait_for_jobs(api_key, job_ids, interval=0.5, max_interval=5, timeout=30, submitted=None, max_concurrency=4):
+    '''
+    Poll job.status for each of job_ids until every job has finished or
+    timeout seconds have passed since submitted (default now). Each job
+    is first checked after interval seconds, and its wait doubles after
+    every check which finds it unfinished, up to max_interval, so quick
+    jobs are seen to finish quickly without polling slow ones hard. The
+    checks which fall due together are made concurrently, and one last
+    check of every unfinished job is made at the deadline.
+
+    Returns a dict per job, in the order of job_ids, with the job's id,
+    its last status from the API (job, None if it was never fetched),
+    whether it finished, how many checks were made, the seconds from
+    submission to seeing it finish (latency, None if it didn't) and the
+    error if polling it failed (msg).
+    '''
+    if submitted is None:
+        submitted = time.time()
+    deadline = submitted + timeout
+
+    results, intervals, next_check = dict(), dict(), dict()
+    order = []
+    for job_id in job_ids:
+        if job_id in results:
+            continue
+        order.append(job_id)
+        results[job_id] = dict(id=job_id, job=None, finished=False, checks=0, latency=None, msg=None)
+        intervals[job_id] = interval
+        next_check[job_id] = time.time() + interval
+
+    while next_check:
+        # never sleep past the deadline; make one last check at it instead.
+        time.sleep(max(0, min(min(next_check.values()), deadline) - time.time()))
+        now = time.time()
+        final = now >= deadline
+        due = [job_id for job_id in order if job_id in next_check and (final or next_check[job_id] <= now)]
+
+        calls = [('job.status', dict(id=job_id)) for job_id in due]
+        responses = memset_api_calls(api_key=api_key, calls=calls, max_concurrency=max_concurrency)
+        for job_id, (has_failed, msg, response) in zip(due, responses):
+            result = results[job_id]
+            result['checks'] += 1
+            if has_failed:
+                result['msg'] = msg
+                del next_check[job_id]
+                continue
+
+            result['job'] = response.json()
+            if result['job'].get('finished'):
+                result['finished'] = True
+                result['latency'] = round(time.time() - submitted, 3)
+                del next_check[job_id]
+            else:
+                intervals[job_id] = min(intervals[job_id] * 2, max_interval)
+                next_check[job_id] = time.time() + intervals[job_id]
+
+        if final:
+            break
+
+    return([results[job_id] for job_id in order])
+
+
+def choose_fetch_strategy(zones_touched, zone_count=None, strategy='auto', cached=False):
+    '''
+    Decide how to fetch the records of zones_touched zones in an account
+    of zone_count zones (None if not known). Returns 'zone_info' or
+    'record_list'; any strategy other than 'auto' is returned as is.
+    If cached is set, responses may come from the ResponseCache.
+    '''
+    if strategy != 'auto':
+        return(strategy)
+
+    # only the account-wide list can be served from the cache, so a warm
+    # run makes no read calls at all.
+    if cached:
+        return('record_list')
+
+    # a single zone is never more data than the whole account.
+    if zones_touched <= 1:
+        return('zone_info')
+    if zone_count and zones_touched <= min(ZONE_INFO_MAX_ZONES, zone_count * ZONE_INFO_MAX_FRACTION):
+        return('zone_info')
+
+    return('record_list')
+
+
+def fetch_zone_records(api_key, zone_ids, zone_count=None, strategy='auto', item_filter=None, max_concurrency=1):
+    '''
+    Fetch the records of the given zones, either with one dns.zone_info
+    call per zone (made concurrently) or from the account-wide
+    dns.zone_record_list, as chosen by choose_fetch_strategy. Only the
+    records for which item_filter returns true are kept. Returns
+    (has_failed, msg, records).
+    '''
+    zone_ids = set(zone_ids)
+    strategy = choose_fetch_strategy(len(zone_ids), zone_count=zone_count, strategy=strategy,
+                                     cached=ResponseCache.from_environment() is not None)
+
+    def matching(zone_record):
+        return(zone_record['zone_id'] in zone_ids and (item_filter is None or item_filter(zone_record)))
+
+    if strategy == 'record_list':
+        has_failed, msg, response = memset_api_call(api_key=api_key, api_method='dns.zone_record_list', item_filter=matching)
+        if has_failed:
+            return(has_failed, msg, None)
+        return(False, None, response.json())
+
+    records = []
+    calls = [('dns.zone_info', dict(id=zone_id)) for zone_id in sorted(zone_ids)]
+    for has_failed, msg, response in memset_api_calls(api_key=api_key, calls=calls, max_concurrency=max_concurrency):
+        if has_failed:
+            return(has_failed, msg, None)
+        records.extend([zone_record for zone_record in response.json()['records'] if matching(zone_record)])
+
+    return(False, None, records)
+
+
+class AccountIndex(object):
+    '''
+    Dict indexes over an account's zones, zone domains and zone records,
+    built once from the API's list responses so that every later lookup
+    is a constant-time dict access rather than a walk of the full list.
+
+    Zones are indexed by id and by nickname (nicknames are not unique,
+    so each maps to a list), domains by name and records by (zone_id,
+    record, type).
+    '''
+
+    def __init__(self, zones=None, domains=None, records=None):
+        self.zones_by_id = dict()
+        self.zones_by_nickname = dict()
+        self.domains_by_name = dict()
+        self.records_by_key = dict()
+
+        for zone in zones or []:
+            self.add_zone(zone)
+        for zone_domain in domains or []:
+            self.add_domain(zone_domain)
+        for zone_record in records or []:
+            self.add_record(zone_record)
+
+    def add_zone(self, zone):
+        self.zones_by_id[zone['id']] = zone
+        self.zones_by_nickname.setdefault(zone['nickname'], []).append(zone)
+
+    def add_domain(self, zone_domain):
+        self.domains_by_name[zone_domain['domain']] = zone_domain
+
+    def remove_domain(self, domain):
+        self.domains_by_name.pop(domain, None)
+
+    def add_record(self, zone_record):
+        key = (zone_record['zone_id'], zone_record['record'], zone_record['type'])
+        self.records_by_key.setdefault(key, []).append(zone_record)
+
+    def update_record(self, zone_record):
+        '''
+        Replace the record with the same id, keeping its place.
+        '''
+        key = (zone_record['zone_id'], zone_record['record'], zone_record['type'])
+        matches = self.records_by_key.get(key, [])
+        self.records_by_key[key] = [zone_record if match['id'] == zone_record['id'] else match for match in matches]
+
+    def remove_record(self, zone_record):
+        key = (zone_record['zone_id'], zone_record['record'], zone_record['type'])
+        matches = self.records_by_key.get(key, [])
+        self.records_by_key[key] = [match for match in matches if match['id'] != zone_record['id']]
+
+    def zones(self, nickname):
+        '''
+        Returns all zones with the given nickname.
+        '''
+        return(self.zones_by_nickname.get(nickname, []))
+
+    def zone(self, zone_id):
+        return(self.zones_by_id.get(zone_id))
+
+    def get_zone_id(self, zone_name):
+        '''
+        Returns the zone's id if it exists and is unique, in the same form
+        as the get_zone_id function.
+        '''
+        zone_exists = False
+        zone_id, msg = None, None
+        counter = len(self.zones(zone_name))
+
+        if counter == 0:
+            msg = 'No matching zone found'
+        elif counter == 1:
+            zone_id = self.zones(zone_name)[0]['id']
+            zone_exists = True
+        elif counter > 1:
+            msg = 'Zone ID could not be returned as duplicate zone names were detected'
+
+        return(zone_exists, msg, counter, zone_id)
+
+    def has_domain(self, domain):
+        return(domain in self.domains_by_name)
+
+    def domain(self, domain):
+        return(self.domains_by_name.get(domain))
+
+    def records(self, zone_id, record, record_type):
+        '''
+        Returns all records in the zone with the given name and type.
+        '''
+        return(self.records_by_key.get((zone_id, record, record_type), []))
+
+
 def check_zone_domain(data, domain):
     '''
     Returns true if domain already exists, and false if not.
@@ -104,9 +1116,7 @@ def check_zone_domain(data, domain):
     exists = False
 
     if data.status_code in [201, 200]:
-        for zone_domain in data.json():
-            if zone_domain['domain'] == domain:
-                exists = True
+        exists = AccountIndex(domains=data.json()).has_domain(domain)
 
     return(exists)
 
@@ -119,9 +1129,7 @@ def check_zone(data, name):
     exists = False
 
     if data.status_code in [201, 200]:
-        for zone in data.json():
-            if zone['nickname'] == name:
-                counter += 1
+        counter = len(AccountIndex(zones=data.json()).zones(name))
         if counter == 1:
             exists = True
 
@@ -132,23 +1140,88 @@ def get_zone_id(zone_name, current_zones):
     '''
     Returns the zone's id if it exists and is unique
     '''
-    zone_exists = False
-    zone_id, msg = None, None
-    zone_list = []
+    return(AccountIndex(zones=current_zones).get_zone_id(zone_name))
+
+
+def validate_record(record):
+    '''
+    Checks a single record against the limits enforced by Memset's API
+    (see: https://www.memset.com/apidocs/methods_dns.html#dns.zone_record_create),
+    returning an error message or None if the record is valid.
+    '''
+    error = None
+
+    # priority can only be integer 0 > 999
+    if not 0 <= record['priority'] <= 999:
+        error = 'Priority must be in the range 0 > 999 (inclusive).'
+    # data value must be max 250 chars
+    if len(record['address']) > 250:
+        error = "Address must be less than 250 characters in length."
+    # record value must be max 250 chars
+    if record['record']:
+        if len(record['record']) > 63:
+            error = "Record must be less than 63 characters in length."
+    # relative isn't used for all record types
+    if record['relative']:
+        if record['type'] not in ['CNAME', 'MX', 'NS', 'SRV']:
+            error = "Relative is only valid for CNAME, MX, NS and SRV record types."
+
+    return(error)
+
+
+def normalize_records(items, defaults, required, choices=None):
+    '''
+    Fill in defaults for each record dict in a list option, coerce the
+    values to the types the equivalent module options would have and
+    validate them. Returns the usable records and a list of errors for
+    any items which are not.
+    '''
+    records, errors = [], []
+    choices = choices or dict()
 
-    for zone in current_zones:
-        if zone['nickname'] == zone_name:
-            zone_list.append(zone['id'])
+    for idx, item in enumerate(items):
+        prefix = 'records[{0}]' . format(idx)
+        if not isinstance(item, dict):
+            errors.append('{0}: each record must be a dict.' . format(prefix))
+            continue
 
-    counter = len(zone_list)
+        record = dict(defaults)
+        unknown = []
+        for key, value in item.items():
+            key = RECORD_ALIASES.get(key, key)
+            if key not in defaults:
+                unknown.append(key)
+            elif value is not None:
+                record[key] = value
+        if unknown:
+            errors.append('{0}: unsupported keys {1}.' . format(prefix, ', ' . join(sorted(unknown))))
+            continue
 
-    if counter == 0:
-        msg = 'No matching zone found'
-    elif counter == 1:
-        zone_id = zone_list[0]
-        zone_exists = True
-    elif counter > 1:
-        zone_id = None
-        msg = 'Zone ID could not be returned as duplicate zone names were detected'
+        missing = [key for key in required if record[key] is None]
+        if missing:
+            errors.append('{0}: missing required keys {1}.' . format(prefix, ', ' . join(missing)))
+            continue
+
+        try:
+            for key in ['ttl', 'priority']:
+                record[key] = int(record[key])
+            record['relative'] = boolean(record['relative'])
+        except (TypeError, ValueError) as e:
+            errors.append('{0}: {1}' . format(prefix, e))
+            continue
+        for key in ['zone', 'address', 'record']:
+            if record.get(key) is not None and not isinstance(record[key], string_types):
+                record[key] = str(record[key])
+
+        error = None
+        for key in sorted(choices):
+            if record[key] not in choices[key]:
+                error = '{0} must be one of {1}.' . format(key, ', ' . join([str(choice) for choice in choices[key]]))
+                break
+        error = error or validate_record(record)
+        if error:
+            errors.append('{0}: {1}' . format(prefix, error))
+        else:
+            records.append(record)
 
-    return(zone_exists, msg, counter, zone_id)
+    return(records, errors)
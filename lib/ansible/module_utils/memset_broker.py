@@ -0,0 +1,305 @@
+# This code is part of Ansible, but is an independent component.
+# This particular file snippet, and this file snippet only, is BSD licensed.
+# Modules you write using this snippet, which is embedded dynamically by Ansible
+# still belong to the author of the module, and may assign their own license
+# to the complete work.
+#
+# Copyright (c) 2018, Simon Weald <ansible@simonweald.com>
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import contextlib
+import fcntl
+import hashlib
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from ansible.module_utils.basic import json
+from ansible.module_utils.memset import API_HEADERS, CACHEABLE_METHODS
+from ansible.module_utils.memset import _RETRY_STATS, _RETRY_STATS_LOCK
+from ansible.module_utils.memset import _api_request_with_retries, _import_transport
+from ansible.module_utils.memset import is_idempotent_method, is_mutating_method, register_router
+
+# every module run on a host can share one set of API connections and
+# list responses through a broker process listening on a Unix socket.
+# The broker is opt-in (MEMSET_BROKER_SOCKET), is started by the first
+# call which finds it missing and exits once it has been idle for
+# MEMSET_BROKER_IDLE_TIMEOUT seconds. Waiting for a new broker to
+# accept is given up on after BROKER_START_TIMEOUT seconds, and an
+# idle broker keeps serving connections already made to it for
+# BROKER_DRAIN_TIME seconds after removing its socket.
+BROKER_IDLE_TIMEOUT = 300
+BROKER_START_TIMEOUT = 5
+BROKER_DRAIN_TIME = 1
+BROKER_BOOTSTRAP = '''
+import sys
+from ansible.module_utils.memset_broker import serve_broker
+serve_broker(sys.argv[1], idle_timeout=float(sys.argv[2]))
+'''
+
+
+class BrokerClient(object):
+    '''
+    Sends API calls to the broker, starting it if it isn't running. Each
+    call is a connection to the broker's socket: the request is a line
+    of JSON, and the reply a line of JSON (the status code, retries and
+    whether the result was cached) followed by the raw response body,
+    which is read as it arrives.
+    '''
+
+    def __init__(self, path, idle_timeout=BROKER_IDLE_TIMEOUT):
+        self.path = path
+        self.idle_timeout = idle_timeout
+
+    @classmethod
+    def from_environment(cls):
+        path = os.environ.get('MEMSET_BROKER_SOCKET')
+        if not path:
+            return(None)
+        try:
+            idle_timeout = float(os.environ.get('MEMSET_BROKER_IDLE_TIMEOUT', BROKER_IDLE_TIMEOUT))
+        except ValueError:
+            idle_timeout = BROKER_IDLE_TIMEOUT
+        return(cls(path=os.path.expanduser(path), idle_timeout=idle_timeout))
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+        except socket.error:
+            sock.close()
+            return(None)
+        return(sock)
+
+    def _start(self):
+        '''
+        Start the broker and wait for it to accept a connection. Callers
+        starting it at the same time are serialised by a lock file, so
+        only the first one does. Returns a connected socket, or None if
+        the broker didn't start in time.
+        '''
+        broker_dir = os.path.dirname(self.path)
+        if broker_dir and not os.path.isdir(broker_dir):
+            os.makedirs(broker_dir, 0o700)
+        with open(self.path + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                sock = self._connect()
+                if sock is not None:
+                    return(sock)
+                # the broker imports this file from wherever the module did.
+                env = dict(os.environ, PYTHONPATH=os.pathsep.join([path for path in sys.path if path]))
+                with open(os.devnull, 'r+b') as devnull:
+                    subprocess.Popen([sys.executable, '-c', BROKER_BOOTSTRAP, self.path, str(self.idle_timeout)],
+                                     stdin=devnull, stdout=devnull, stderr=devnull, env=env, close_fds=True,
+                                     preexec_fn=os.setsid)
+                deadline = time.time() + BROKER_START_TIMEOUT
+                while time.time() < deadline:
+                    sock = self._connect()
+                    if sock is not None:
+                        return(sock)
+                    time.sleep(0.05)
+                return(None)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def call(self, api_key, api_method, api_uri, data, reader=None):
+        '''
+        Returns the status code, raw body, number of retries and whether
+        the broker answered from its cache, or None if the broker can't
+        be used and the caller should make the call itself. A call which
+        changes state is never made twice, so if the broker goes away
+        during one it fails like a dropped connection would.
+        '''
+        try:
+            sock = self._connect() or self._start()
+        except (IOError, OSError):
+            return(None)
+        if sock is None:
+            return(None)
+
+        request = dict(api_key=api_key, method=api_method, uri=api_uri, data=data)
+        try:
+            with contextlib.closing(sock):
+                sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+                sock.shutdown(socket.SHUT_WR)
+                with contextlib.closing(sock.makefile('rb')) as fileobj:
+                    reply = json.loads(fileobj.readline().decode('utf-8'))
+                    if reader is not None and reply['status_code'] == 200:
+                        content = reader(fileobj)
+                    else:
+                        content = fileobj.read()
+        except (socket.error, ValueError, KeyError) as e:
+            if is_idempotent_method(api_method):
+                return(None)
+            error = 'Lost the connection to the Memset broker ({0}).' . format(e)
+            return(None, json.dumps(dict(error_type='ConnectionError', error=error)).encode('utf-8'), 0, False)
+
+        with _RETRY_STATS_LOCK:
+            _RETRY_STATS['retries'] += reply['retries']
+            _RETRY_STATS['backoff_seconds'] += reply['backoff_seconds']
+        return(reply['status_code'], content, reply['retries'], reply['cached'])
+
+
+class Broker(object):
+    '''
+    The broker's state: API connections (the usual connection pools, as
+    they live in this process), and list responses kept in memory per
+    account (a hash of the API key) for MEMSET_CACHE_TTL seconds.
+    Identical list calls arriving while one is in flight wait for it and
+    share its response. Every call which changes an account goes through
+    the broker too, and drops the account's responses when it completes;
+    a response fetched while that call was in flight is not kept.
+    '''
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.responses = dict()
+        self.generations = dict()
+        self.flights = dict()
+        self.active = 0
+        self.last_request = time.time()
+
+    def idle_for(self):
+        with self.lock:
+            if self.active:
+                return(0.0)
+            return(time.time() - self.last_request)
+
+    def _fetch(self, api_method, api_uri, data):
+        retry_stats = dict(retries=0, backoff_seconds=0.0)
+        status_code, content, retries = _api_request_with_retries(api_method, api_uri, data, API_HEADERS,
+                                                                  retry_stats=retry_stats)
+        return(status_code, content, retries, retry_stats['backoff_seconds'], False)
+
+    def request(self, api_key, api_method, api_uri, data):
+        '''
+        Returns the status code, raw body, number of retries, time spent
+        backing off and whether the response came from memory.
+        '''
+        account = hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+        if api_method not in CACHEABLE_METHODS:
+            result = self._fetch(api_method, api_uri, data)
+            if is_mutating_method(api_method):
+                with self.lock:
+                    self.generations[account] = self.generations.get(account, 0) + 1
+                    self.responses.pop(account, None)
+            return(result)
+
+        key = (api_uri, data)
+        with self.lock:
+            flight = self.flights.setdefault((account, key), threading.Lock())
+        with flight:
+            with self.lock:
+                cached = self.responses.get(account, dict()).get(key)
+                generation = self.generations.get(account, 0)
+            if cached is not None and time.time() - cached[0] <= self.ttl:
+                return(cached[1], cached[2], 0, 0.0, True)
+
+            result = self._fetch(api_method, api_uri, data)
+            if result[0] == 200:
+                with self.lock:
+                    if self.generations.get(account, 0) == generation:
+                        self.responses.setdefault(account, dict())[key] = (time.time(), result[0], result[1])
+            return(result)
+
+    def handle(self, rfile, wfile):
+        with self.lock:
+            self.active += 1
+        try:
+            request = json.loads(rfile.readline().decode('utf-8'))
+            status_code, content, retries, backoff_seconds, cached = self.request(
+                request['api_key'], request['method'], request['uri'], request['data'])
+            reply = dict(status_code=status_code, retries=retries, backoff_seconds=backoff_seconds, cached=cached)
+            wfile.write(json.dumps(reply).encode('utf-8') + b'\n')
+            wfile.write(content)
+        finally:
+            with self.lock:
+                self.active -= 1
+                self.last_request = time.time()
+
+
+def _broker_server(path, broker):
+    from ansible.module_utils.six.moves import socketserver
+
+    class BrokerHandler(socketserver.StreamRequestHandler):
+
+        def handle(self):
+            broker.handle(self.rfile, self.wfile)
+
+    class BrokerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    return(BrokerServer(path, BrokerHandler))
+
+
+def serve_broker(path, idle_timeout=BROKER_IDLE_TIMEOUT):
+    '''
+    Run the broker on the Unix socket at path until it has been idle
+    for idle_timeout seconds. It is started by BrokerClient, which holds
+    the lock file while it does, so a socket left behind by a broker
+    which died can safely be removed.
+    '''
+    try:
+        ttl = int(os.environ.get('MEMSET_CACHE_TTL', 60))
+    except ValueError:
+        ttl = 60
+    broker = Broker(ttl=ttl)
+    # the module which started the broker removes the files it was
+    # imported from when it finishes.
+    _import_transport()
+
+    if os.path.exists(path):
+        os.remove(path)
+    old_umask = os.umask(0o177)
+    try:
+        server = _broker_server(path, broker)
+    finally:
+        os.umask(old_umask)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    while broker.idle_for() < idle_timeout:
+        time.sleep(min(1.0, idle_timeout / 10.0))
+    # new callers start a new broker once the socket has gone, while any
+    # already connected to this one are still answered.
+    os.remove(path)
+    while broker.idle_for() < BROKER_DRAIN_TIME:
+        time.sleep(BROKER_DRAIN_TIME / 10.0)
+    server.shutdown()
+    server.server_close()
+
+
+def _route_through_broker(api_key, api_method, payload, api_uri, data, fetch, reader):
+    broker = BrokerClient.from_environment()
+    if broker is None:
+        return(None)
+    return(broker.call(api_key, api_method, api_uri, data, reader=reader))
+
+
+# the broker shares connections and responses between processes itself,
+# so is used in place of the single-flight lock files.
+register_router(_route_through_broker, first=True)
@@ -0,0 +1,151 @@
+# This code is part of Ansible, but is an independent component.
+# This particular file snippet, and this file snippet only, is BSD licensed.
+# Modules you write using this snippet, which is embedded dynamically by Ansible
+# still belong to the author of the module, and may assign their own license
+# to the complete work.
+#
+# Copyright (c) 2018, Simon Weald <ansible@simonweald.com>
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import contextlib
+import fcntl
+import hashlib
+import os
+import tempfile
+import time
+
+from ansible.module_utils.basic import json
+from ansible.module_utils.memset import is_dns_change, register_observer
+
+# successful DNS changes are journaled on the host the module runs on,
+# so that memset_dns_reload can tell whether a reload is needed. The
+# journal lives here unless MEMSET_JOURNAL_DIR says otherwise.
+JOURNAL_DIR = '~/.ansible/memset/journal'
+
+
+class DNSJournal(object):
+    '''
+    A journal, local to the host the modules run on, of the DNS changes
+    made since the account's DNS was last reloaded. Every successful
+    zone, domain or record change made through memset_api_call by a
+    module which imports this file appends a line to it, and
+    memset_dns_reload clears it when it submits a reload, so an empty
+    journal means there is nothing to publish.
+
+    Files are kept per account (a hash of the API key, which is never
+    written): the changes, the last reload job and a lock file which
+    serialises writers.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+
+    @classmethod
+    def from_environment(cls):
+        path = os.environ.get('MEMSET_JOURNAL_DIR') or JOURNAL_DIR
+        return(cls(path=os.path.expanduser(path)))
+
+    def _account_path(self, api_key, suffix):
+        key_hash = hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+        return(os.path.join(self.path, '{0}.{1}' . format(key_hash, suffix)))
+
+    @contextlib.contextmanager
+    def locked(self, api_key):
+        if not os.path.isdir(self.path):
+            try:
+                os.makedirs(self.path, 0o700)
+            except OSError:
+                if not os.path.isdir(self.path):
+                    raise
+        with open(self._account_path(api_key, 'lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def record(self, api_key, api_method, payload):
+        '''
+        Append a change. Only the fields identifying what was changed are
+        kept from the payload. The journal is best effort, so a change
+        that can't be written is not an error for the module.
+        '''
+        entry = dict(time=round(time.time(), 3), method=api_method)
+        for key in ['id', 'zone_id', 'domain', 'nickname']:
+            if key in payload:
+                entry[key] = payload[key]
+        try:
+            with self.locked(api_key):
+                with open(self._account_path(api_key, 'changes'), 'a') as f:
+                    f.write(json.dumps(entry, sort_keys=True) + '\n')
+        except (IOError, OSError):
+            pass
+
+    def changes(self, api_key):
+        '''
+        Returns the changes journaled since the last reload. Call with the
+        lock held.
+        '''
+        changes = []
+        try:
+            with open(self._account_path(api_key, 'changes')) as f:
+                for line in f:
+                    try:
+                        changes.append(json.loads(line))
+                    except ValueError:
+                        # a line cut short by a crash still records a change.
+                        changes.append(dict())
+        except (IOError, OSError):
+            pass
+        return(changes)
+
+    def last_reload(self, api_key):
+        '''
+        Returns the last reload submitted for the account, as a dict of
+        the job and the time it was submitted, or None.
+        '''
+        try:
+            with open(self._account_path(api_key, 'reload')) as f:
+                return(json.load(f))
+        except (IOError, OSError, ValueError):
+            return(None)
+
+    def reloaded(self, api_key, job, submitted):
+        '''
+        Record a submitted reload, which publishes every journaled change.
+        Call with the lock held.
+        '''
+        fd, tmp_path = tempfile.mkstemp(dir=self.path)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(dict(job=job, submitted=submitted), f)
+        os.rename(tmp_path, self._account_path(api_key, 'reload'))
+        try:
+            os.remove(self._account_path(api_key, 'changes'))
+        except OSError:
+            pass
+
+
+def _journal_change(api_key, api_method, payload, status_code, cached):
+    if status_code == 200 and not cached and is_dns_change(api_method):
+        DNSJournal.from_environment().record(api_key, api_method, payload)
+
+
+register_observer(_journal_change)
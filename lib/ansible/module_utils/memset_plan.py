@@ -0,0 +1,128 @@
+# This code is part of Ansible, but is an independent component.
+# This particular file snippet, and this file snippet only, is BSD licensed.
+# Modules you write using this snippet, which is embedded dynamically by Ansible
+# still belong to the author of the module, and may assign their own license
+# to the complete work.
+#
+# Copyright (c) 2018, Simon Weald <ansible@simonweald.com>
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import hashlib
+import os
+import tempfile
+
+from ansible.module_utils.basic import json
+from ansible.module_utils.memset import memset_api_call
+
+# change plans written in check mode record this version, and are only
+# applied by modules which write the same version.
+PLAN_VERSION = 1
+
+
+def state_fingerprint(state):
+    '''
+    A stable hash of the parts of the account a change plan depends on.
+    '''
+    data = json.dumps(state, sort_keys=True, separators=(',', ':'))
+    return(hashlib.sha256(data.encode('utf-8')).hexdigest())
+
+
+def _plan_identity(module_name, args):
+    '''
+    What a plan was made for: the module, the account (by a hash of the
+    API key, which is never written to the plan) and the module options.
+    '''
+    # options which only change how the account is read don't change the plan.
+    ignored = ['api_key', 'plan_file', 'check_mode', 'fetch_strategy']
+    options = dict([(key, value) for key, value in args.items() if key not in ignored])
+    return(dict(module=module_name,
+                account=hashlib.sha256(args['api_key'].encode('utf-8')).hexdigest(),
+                options=state_fingerprint(options)))
+
+
+def write_plan(path, module_name, args, state, actions):
+    '''
+    Write a change plan, made in check mode, for a later run to apply.
+    actions is a list of (api_method, payload) tuples, and state is the
+    part of the account the plan was worked out from; it is kept in the
+    plan so that the module applying it knows what to fetch again.
+    '''
+    plan = _plan_identity(module_name, args)
+    plan['version'] = PLAN_VERSION
+    plan['state'] = state
+    plan['fingerprint'] = state_fingerprint(state)
+    plan['actions'] = [dict(method=api_method, payload=payload) for api_method, payload in actions]
+
+    # write to a temporary file and rename it into place so a plan is
+    # never left half written.
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.memset-plan-')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(plan, f, indent=2, sort_keys=True)
+    os.rename(tmp_path, path)
+
+    return(plan)
+
+
+def read_plan(path, module_name, args):
+    '''
+    Read a change plan and make sure it was made by the same module with
+    the same options and API key. Returns the plan and an error message,
+    one of which is None.
+    '''
+    try:
+        with open(path) as f:
+            plan = json.load(f)
+    except (IOError, OSError) as e:
+        return(None, "Unable to read plan file {0} ({1})." . format(path, e))
+    except ValueError:
+        return(None, "Plan file {0} is not valid JSON." . format(path))
+
+    if not isinstance(plan, dict) or plan.get('version') != PLAN_VERSION:
+        return(None, "Plan file {0} was not written by this version of {1}." . format(path, module_name))
+
+    identity = _plan_identity(module_name, args)
+    for key in ['module', 'account', 'options']:
+        if plan.get(key) != identity[key]:
+            return(None, "Plan file {0} was made for a different {1}." . format(path, key))
+
+    return(plan, None)
+
+
+def apply_plan(api_key, plan, state):
+    '''
+    Make the calls in a change plan, once the state it was made from has
+    been fetched again and found to be unchanged. Calls are made in order
+    and the first failure stops the rest. Returns (has_failed, msg,
+    responses) with the parsed response of each call made.
+    '''
+    if state_fingerprint(state) != plan['fingerprint']:
+        msg = 'The account has changed since the plan was made; run in check mode again to make a new plan.'
+        return(True, msg, [])
+
+    responses = []
+    for action in plan['actions']:
+        has_failed, msg, response = memset_api_call(api_key=api_key, api_method=action['method'], payload=action['payload'])
+        if has_failed:
+            return(has_failed, msg, responses)
+        responses.append(msg)
+
+    return(False, None, responses)
@@ -0,0 +1,252 @@
+# This code is part of Ansible, but is an independent component.
+# This particular file snippet, and this file snippet only, is BSD licensed.
+# Modules you write using this snippet, which is embedded dynamically by Ansible
+# still belong to the author of the module, and may assign their own license
+# to the complete work.
+#
+# Copyright (c) 2018, Simon Weald <ansible@simonweald.com>
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import fcntl
+import hashlib
+import os
+import tempfile
+import time
+
+from ansible.module_utils.basic import json
+from ansible.module_utils.memset import is_mutating_method, register_observer, register_router
+
+# identical list calls made at the same time by modules on the same host
+# can share a single API call. This is opt-in: the processes coordinate
+# through lock files in the directory set with MEMSET_SINGLE_FLIGHT_DIR.
+# A list call only shares a call which started after this process last
+# changed the account, so a module always sees its own changes. The
+# broker, if it is used, shares calls itself and is tried first.
+SINGLE_FLIGHT_SUFFIXES = ('_list', '.list')
+_LAST_CHANGE = dict()
+
+
+class _SpoolFile(object):
+    '''
+    Wraps a response body so that everything read from it is also
+    written to a spool file. If the spool can't be written it is given
+    up on rather than failing the request.
+    '''
+
+    def __init__(self, fileobj, spool):
+        self.fileobj = fileobj
+        self.spool = spool
+        self.failed = False
+
+    def read(self, size=-1):
+        chunk = self.fileobj.read(size)
+        if not self.failed:
+            try:
+                self.spool.write(chunk)
+            except (IOError, OSError):
+                self.failed = True
+        return(chunk)
+
+
+class SingleFlight(object):
+    '''
+    Collapses identical list calls made at the same time by different
+    processes (e.g. Ansible forks) into one API call. Each call is keyed
+    on a hash of the API key, the method and the payload, and has a lock
+    file. The first process to take the lock makes the call; the others
+    wait on the lock and then reuse its result, which is kept in a body
+    file next to the lock.
+
+    Bodies can be large and are usually streamed through a reader, so a
+    body is only kept if another process was waiting for it when the
+    response arrived; a process which arrives too late makes its own
+    call, and the last waiter to read a body removes it. Any problem
+    with the lock files also falls back to making the call.
+
+    Single-flight is opt-in and is enabled by setting
+    MEMSET_SINGLE_FLIGHT_DIR.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+
+    @classmethod
+    def from_environment(cls):
+        path = os.environ.get('MEMSET_SINGLE_FLIGHT_DIR')
+        if not path:
+            return(None)
+        return(cls(path=os.path.expanduser(path)))
+
+    def _base(self, api_key, api_method, payload):
+        key_hash = hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+        call = json.dumps([api_method, payload], sort_keys=True)
+        call_hash = hashlib.sha256(call.encode('utf-8')).hexdigest()
+        return(os.path.join(self.path, '{0}.{1}' . format(key_hash, call_hash)))
+
+    def _waiting(self, base):
+        prefix = os.path.basename(base) + '.wait-'
+        return([entry for entry in os.listdir(self.path) if entry.startswith(prefix)])
+
+    def _shared_result(self, base, arrived, not_before, reader):
+        '''
+        Returns the (status_code, content) of a call which was in flight
+        when this process arrived and started after not_before, or None.
+        '''
+        try:
+            with open(base + '.flight') as f:
+                flight = json.load(f)
+            if not flight['body'] or flight['finished'] < arrived or flight['started'] < not_before:
+                return(None)
+            with open(base + '.body', 'rb') as f:
+                if reader is not None and flight['status_code'] == 200:
+                    return(flight['status_code'], reader(f))
+                return(flight['status_code'], f.read())
+        except (IOError, OSError, ValueError, KeyError):
+            return(None)
+
+    def _publish(self, base, started, status_code, content, spool_path=None, streamed=False):
+        '''
+        Keep the call's body for the processes waiting for it. The body
+        is either in content or, for a streamed response, in the spool
+        (if there was anyone waiting when it arrived).
+        '''
+        flight = dict(started=started, finished=time.time(), status_code=status_code, body=False)
+        try:
+            if not streamed and self._waiting(base):
+                fd, spool_path = tempfile.mkstemp(dir=self.path)
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(content)
+            if spool_path is not None and os.path.exists(spool_path):
+                os.rename(spool_path, base + '.body')
+                flight['body'] = True
+            fd, tmp_path = tempfile.mkstemp(dir=self.path)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(flight, f)
+            os.rename(tmp_path, base + '.flight')
+        except (IOError, OSError):
+            pass
+        if spool_path is not None and os.path.exists(spool_path):
+            os.remove(spool_path)
+
+    def _lead(self, base, fetch, reader):
+        started = time.time()
+        spool = dict(path=None)
+        spool_reader = reader
+        if reader is not None:
+            def spool_reader(fileobj):
+                # a retried request starts a new spool, and the body is
+                # only spooled if someone is waiting for it.
+                spool['path'] = None
+                if not self._waiting(base):
+                    return(reader(fileobj))
+                try:
+                    fd, spool_path = tempfile.mkstemp(dir=self.path)
+                    f = os.fdopen(fd, 'wb')
+                except (IOError, OSError):
+                    return(reader(fileobj))
+                try:
+                    with f:
+                        spooled = _SpoolFile(fileobj, f)
+                        content = reader(spooled)
+                except Exception:
+                    os.remove(spool_path)
+                    raise
+                if spooled.failed:
+                    os.remove(spool_path)
+                else:
+                    spool['path'] = spool_path
+                return(content)
+
+        status_code, content, retries = fetch(spool_reader)
+        if reader is not None and status_code == 200:
+            self._publish(base, started, status_code, content, spool_path=spool['path'], streamed=True)
+        else:
+            self._publish(base, started, status_code, content)
+        return(status_code, content, retries, False)
+
+    def call(self, api_key, api_method, payload, fetch, reader=None, not_before=0):
+        '''
+        Make the call with fetch(reader), which returns the status code,
+        body and number of retries, unless an identical call is already
+        in flight. Returns the status code, body, number of retries and
+        whether the result was shared.
+        '''
+        base = self._base(api_key, api_method, payload)
+        try:
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path, 0o700)
+            lock = open(base + '.lock', 'a')
+        except (IOError, OSError):
+            return(fetch(reader) + (False,))
+
+        with lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                # an identical call is in flight; wait for it to finish.
+                arrived = time.time()
+                fd, wait_path = tempfile.mkstemp(prefix=os.path.basename(base) + '.wait-', dir=self.path)
+                os.close(fd)
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_SH)
+                    shared = self._shared_result(base, arrived, not_before, reader)
+                    if shared is None:
+                        # it finished too soon to keep its body for us, so
+                        # make the call ourselves unless another waiter has.
+                        fcntl.flock(lock, fcntl.LOCK_UN)
+                        fcntl.flock(lock, fcntl.LOCK_EX)
+                        shared = self._shared_result(base, arrived, not_before, reader)
+                finally:
+                    os.remove(wait_path)
+                    # bodies can be large, so the last waiter removes it.
+                    if not self._waiting(base):
+                        try:
+                            os.remove(base + '.body')
+                        except OSError:
+                            pass
+                if shared is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+                    return(shared + (0, True))
+
+            try:
+                return(self._lead(base, fetch, reader))
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _share_list_call(api_key, api_method, payload, api_uri, data, fetch, reader):
+    if not api_method.endswith(SINGLE_FLIGHT_SUFFIXES):
+        return(None)
+    single_flight = SingleFlight.from_environment()
+    if single_flight is None:
+        return(None)
+    flight_payload = dict([(key, value) for key, value in payload.items() if key != 'api_key'])
+    return(single_flight.call(api_key, api_method, flight_payload, fetch, reader=reader,
+                              not_before=_LAST_CHANGE.get(api_key, 0)))
+
+
+def _note_change(api_key, api_method, payload, status_code, cached):
+    if is_mutating_method(api_method):
+        _LAST_CHANGE[api_key] = time.time()
+
+
+register_router(_share_list_call)
+register_observer(_note_change)
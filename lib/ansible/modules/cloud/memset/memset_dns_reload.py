@@ -19,6 +19,7 @@ module: memset_dns_reload
 author: "Simon Weald (@analbeard)"
 version_added: "2.6"
 short_description: Request reload of Memset's DNS infrastructure,
+extends_documentation_fragment: memset
 notes:
   - DNS reload requests are a best-effort service provided by Memset; these generally
     happen every 15 minutes by default, however you can request an immediate reload if
@@ -26,6 +27,10 @@ notes:
     Memset customer control panel is required with the following minimum scope -
     I(dns.reload). If you wish to poll the job status to wait until the reload has
     completed, then I(job.status) is also required.
+  - The zone, domain and record modules journal every change they make on the host they run
+    on (in C(~/.ansible/memset/journal), or the C(MEMSET_JOURNAL_DIR) environment variable), and
+    a reload clears the journal. I(only_if_dirty) and I(coalesce_window) rely on the journal, so
+    this module must run on the same host as those modules, e.g. delegated to localhost.
 description:
     - Request a reload of Memset's DNS infrastructure, and optionally poll until it finishes.
 options:
@@ -38,9 +43,44 @@ options:
         type: bool
         description:
             - Boolean value, if set will poll the reload job's status and return
-              when the job has completed (unless the 30 second timeout is reached first).
+              when the job has completed (unless I(poll_timeout) is reached first).
               If the timeout is reached then the task will not be marked as failed, but
               stderr will indicate that the polling failed.
+    poll_interval:
+        default: 0.5
+        type: float
+        version_added: "2.7"
+        description:
+            - Seconds to wait before the first status check. The wait doubles after
+              each check which finds the job unfinished, up to I(poll_max_interval).
+    poll_max_interval:
+        default: 5
+        type: float
+        version_added: "2.7"
+        description:
+            - The longest wait between two status checks, in seconds.
+    poll_timeout:
+        default: 30
+        type: float
+        version_added: "2.7"
+        description:
+            - Give up polling once this many seconds have passed since the reload was
+              submitted.
+    only_if_dirty:
+        default: false
+        type: bool
+        version_added: "2.7"
+        description:
+            - Only request a reload if a zone, domain or record has been changed since the
+              last reload, so an unchanged run makes no reload at all.
+    coalesce_window:
+        default: 0
+        type: float
+        version_added: "2.7"
+        description:
+            - If a reload was requested less than this many seconds ago and nothing has changed
+              since, return that reload's job instead of requesting another one. Many hosts
+              notifying the same handler then share a single reload.
 '''
 
 EXAMPLES = '''
@@ -49,13 +89,22 @@ EXAMPLES = '''
     api_key: 5eb86c9196ab03919abcf03857163741
     poll: True
   delegate_to: localhost
+
+# as a handler notified by many roles and hosts, only reload when a zone
+# task actually changed something, and share one reload between them.
+- name: reload dns
+  memset_dns_reload:
+    api_key: 5eb86c9196ab03919abcf03857163741
+    only_if_dirty: true
+    coalesce_window: 60
+  delegate_to: localhost
 '''
 
 RETURN = '''
 ---
 memset_api:
   description: Raw response from the Memset API.
-  returned: always
+  returned: when a reload was requested or reused
   type: complex
   contains:
     error:
@@ -83,55 +132,178 @@ memset_api:
       returned: always
       type: string
       sample: "dns"
+job_latency:
+  description: Seconds between submitting the reload and seeing the job finish.
+  returned: when poll is true and the job finished
+  type: float
+  sample: 0.82
+dns_changes:
+  description: The number of zone, domain and record changes journaled since the last reload.
+  returned: when the journal could be read
+  type: int
+  sample: 3
+coalesced:
+  description: Whether a recent reload was reused instead of requesting a new one.
+  returned: when a reload was requested or reused
+  type: bool
+  sample: false
+memset_api_retries:
+  description: API calls retried after transient failures during this task.
+  returned: always
+  type: complex
+  contains:
+    backoff_seconds:
+      description: Total time spent waiting between attempts.
+      returned: always
+      type: float
+      sample: 1.25
+    retries:
+      description: Number of retried API calls.
+      returned: always
+      type: int
+      sample: 2
+memset_api_stats:
+  description: The API calls made during this task, overall and per API method. Latencies are in seconds.
+  returned: always
+  type: complex
+  contains:
+    calls:
+      description: Number of API calls made.
+      returned: always
+      type: int
+      sample: 3
+    latency_total:
+      description: Total time spent waiting for the API.
+      returned: always
+      type: float
+      sample: 0.412
+    latency_p95:
+      description: 95th percentile latency of a single call.
+      returned: always
+      type: float
+      sample: 0.188
+    request_bytes:
+      description: Total size of the request bodies sent.
+      returned: always
+      type: int
+      sample: 180
+    response_bytes:
+      description: Total size of the response bodies received.
+      returned: always
+      type: int
+      sample: 5120
+    retries:
+      description: Number of retried API calls.
+      returned: always
+      type: int
+      sample: 0
+    methods:
+      description: The same figures for each API method called.
+      returned: always
+      type: dict
+      sample: { "dns.zone_list": { "calls": 1, "latency_p95": 0.188, "latency_total": 0.188,
+                "request_bytes": 40, "response_bytes": 5120, "retries": 0 } }
 '''
 
-from time import sleep
+import time
 
 from ansible.module_utils.basic import AnsibleModule
+import ansible.module_utils.memset_broker  # noqa: F401 registers the broker with memset_api_call
 from ansible.module_utils.memset import memset_api_call
+from ansible.module_utils.memset import memset_api_retry_stats
+from ansible.module_utils.memset import memset_api_stats
+from ansible.module_utils.memset import wait_for_jobs
+from ansible.module_utils.memset_journal import DNSJournal
 
 
-def poll_reload_status(api_key=None, job_id=None, payload=None):
+def poll_reload_status(api_key=None, job_id=None, args=None, submitted=None):
     '''
-    We poll the `job.status` endpoint every 5 seconds up to a
-    maximum of 6 times. This is a relatively arbitrary choice of
-    timeout, however requests rarely take longer than 15 seconds
-    to complete.
+    Wait for the reload job to finish or the deadline to pass. Reloads
+    often finish within a second, so the first check is made quickly
+    and the interval then doubles up to a cap, which keeps slow jobs
+    from being polled too hard.
     '''
     memset_api, stderr, msg = None, None, None
-    payload['id'] = job_id
-
-    api_method = 'job.status'
-    _has_failed, _msg, response = memset_api_call(api_key=api_key, api_method=api_method, payload=payload)
-
-    while not response.json()['finished']:
-        counter = 0
-        while counter < 6:
-            sleep(5)
-            _has_failed, msg, response = memset_api_call(api_key=api_key, api_method=api_method, payload=payload)
-            counter += 1
-    if response.json()['error']:
+
+    result = wait_for_jobs(api_key, [job_id], interval=args['poll_interval'], max_interval=args['poll_max_interval'],
+                           timeout=args['poll_timeout'], submitted=submitted)[0]
+
+    if result['msg'] is not None:
+        stderr = "Reload submitted successfully, but polling the reload status failed."
+        return(memset_api, result['msg'], stderr, None)
+
+    if not result['finished']:
+        # the reload job was submitted but didn't finish in time. Don't return this as an overall task failure.
+        stderr = "Reload submitted successfully, but the job had not finished after {0} seconds." . format(args['poll_timeout'])
+        return(result['job'], None, stderr, None)
+
+    if result['job']['error']:
         # the reload job was submitted but polling failed. Don't return this as an overall task failure.
         stderr = "Reload submitted successfully, but the Memset API returned a job error when attempting to poll the reload status."
-        msg = msg
+        msg = result['job']
     else:
-        memset_api = response.json()
-        msg = None
+        memset_api = result['job']
 
-    return(memset_api, msg, stderr)
+    return(memset_api, msg, stderr, result['latency'])
+
+
+def submit_reload(args=None, journal=None):
+    '''
+    Submit the reload, and with the journal lock held, record it in the
+    journal since it publishes every change made so far.
+    '''
+    submitted = time.time()
+    api_method = 'dns.reload'
+    has_failed, msg, response = memset_api_call(api_key=args['api_key'], api_method=api_method)
+
+    if not has_failed and journal is not None:
+        try:
+            journal.reloaded(args['api_key'], response.json(), submitted)
+        except (IOError, OSError):
+            pass
+
+    return(has_failed, msg, response, submitted)
 
 
 def reload_dns(args=None):
     '''
     DNS reloads are a single API call and therefore there's not much
-    which can go wrong outside of auth errors.
+    which can go wrong outside of auth errors. The journal of DNS changes
+    decides whether a reload is needed at all (only_if_dirty), and
+    whether one submitted moments ago can be reused (coalesce_window).
     '''
-    retvals, payload = dict(), dict()
+    retvals = dict()
     has_changed, has_failed = False, False
-    memset_api, msg, stderr = None, None, None
+    memset_api, msg, stderr, job_latency = None, None, None, None
+    coalesced, dns_changes = False, None
+    response, submitted = None, None
 
-    api_method = 'dns.reload'
-    has_failed, msg, response = memset_api_call(api_key=args['api_key'], api_method=api_method)
+    journal = DNSJournal.from_environment()
+    try:
+        with journal.locked(args['api_key']):
+            dns_changes = len(journal.changes(args['api_key']))
+            last_reload = journal.last_reload(args['api_key'])
+
+            if args['only_if_dirty'] and not dns_changes:
+                retvals['failed'] = False
+                retvals['changed'] = False
+                retvals['dns_changes'] = dns_changes
+                retvals['msg'] = 'No DNS changes have been made since the last reload.'
+                return(retvals)
+
+            if last_reload is not None and not dns_changes and time.time() - last_reload['submitted'] < args['coalesce_window']:
+                # the reload submitted moments ago already publishes everything.
+                coalesced = True
+                memset_api, submitted = last_reload['job'], last_reload['submitted']
+            else:
+                has_failed, msg, response, submitted = submit_reload(args=args, journal=journal)
+    except (IOError, OSError) as e:
+        if args['only_if_dirty'] or args['coalesce_window']:
+            retvals['failed'] = True
+            retvals['msg'] = "Unable to use the DNS journal in {0} ({1})." . format(journal.path, e)
+            return(retvals)
+        # without the journal, reload unconditionally as before.
+        has_failed, msg, response, submitted = submit_reload(args=args)
 
     if has_failed:
         # this is the first time the API is called; incorrect credentials will
@@ -142,22 +314,25 @@ def reload_dns(args=None):
         retvals['msg'] = msg
         return(retvals)
 
-    # set changed to true if the reload request was accepted.
-    has_changed = True
-    memset_api = msg
-    # empty msg var as we don't want to return the API's json response twice.
-    msg = None
+    if not coalesced:
+        # set changed to true if the reload request was accepted.
+        has_changed = True
+        memset_api = msg
+        # empty msg var as we don't want to return the API's json response twice.
+        msg = None
 
     if args['poll']:
         # hand off to the poll function.
-        job_id = response.json()['id']
-        memset_api, msg, stderr = poll_reload_status(api_key=args['api_key'], job_id=job_id, payload=payload)
+        job_id = memset_api['id']
+        memset_api, msg, stderr, job_latency = poll_reload_status(api_key=args['api_key'], job_id=job_id, args=args,
+                                                                  submitted=submitted)
 
     # assemble return variables.
     retvals['failed'] = has_failed
     retvals['changed'] = has_changed
-    for val in ['msg', 'stderr', 'memset_api']:
-        if val is not None:
+    retvals['coalesced'] = coalesced
+    for val in ['msg', 'stderr', 'memset_api', 'job_latency', 'dns_changes']:
+        if eval(val) is not None:
             retvals[val] = eval(val)
 
     return(retvals)
@@ -168,7 +343,12 @@ def main():
     module = AnsibleModule(
         argument_spec=dict(
             api_key=dict(required=True, type='str', no_log=True),
-            poll=dict(required=False, default=False, type='bool')
+            poll=dict(required=False, default=False, type='bool'),
+            poll_interval=dict(required=False, default=0.5, type='float'),
+            poll_max_interval=dict(required=False, default=5, type='float'),
+            poll_timeout=dict(required=False, default=30, type='float'),
+            only_if_dirty=dict(required=False, default=False, type='bool'),
+            coalesce_window=dict(required=False, default=0, type='float')
         ),
         supports_check_mode=False
     )
@@ -178,8 +358,17 @@ def main():
     for key, arg in module.params.items():
         args[key] = arg
 
+    for arg in ['poll_interval', 'poll_max_interval', 'poll_timeout']:
+        if args[arg] <= 0:
+            module.fail_json(failed=True, msg='{0} must be greater than 0.' . format(arg))
+    if args['coalesce_window'] < 0:
+        module.fail_json(failed=True, msg='coalesce_window must not be negative.')
+
     retvals = reload_dns(args)
 
+    retvals['memset_api_retries'] = memset_api_retry_stats()
+    retvals['memset_api_stats'] = memset_api_stats()
+
     if retvals['failed']:
         module.fail_json(**retvals)
     else:
@@ -0,0 +1,316 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2018, Simon Weald <ansible@simonweald.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+ANSIBLE_METADATA = {
+    'metadata_version': '1.1',
+    'status': ['preview'],
+    'supported_by': 'community'
+}
+
+DOCUMENTATION = '''
+---
+module: memset_job_wait
+author: "Simon Weald (@analbeard)"
+version_added: "2.7"
+short_description: Wait for Memset jobs to finish.
+extends_documentation_fragment: memset
+notes:
+  - Memset API calls which take a while (e.g. DNS reloads and server operations) return a job,
+    and tasks which submit them without polling can be followed by this module to wait for all
+    of their jobs at once. An API key generated via the Memset customer control panel is needed
+    with the following minimum scope - I(job.status).
+  - Each job is polled on its own schedule, so a job which finishes quickly is seen to finish
+    quickly however slow the others are. Checks which fall due together are made concurrently.
+  - Jobs from several accounts (given with I(jobs)) are waited for at the same time, against the
+    same deadline.
+description:
+    - Poll the status of one or more Memset jobs until they have all finished, or a deadline passes.
+options:
+    api_key:
+        description:
+            - The API key obtained from the Memset control panel. Required with I(job_ids), and for
+              items of I(jobs) which don't have their own.
+    job_ids:
+        type: list
+        description:
+            - The ids of the jobs to wait for. One of I(job_ids) and I(jobs) is required.
+        aliases: [ ids ]
+    jobs:
+        type: list
+        description:
+            - The jobs to wait for, as a list of dicts with the job's I(id) and the I(api_key) of
+              the account it belongs to, so that jobs from several accounts can be waited for in
+              one task. Items without an I(api_key) use the module's I(api_key).
+    poll_interval:
+        default: 0.5
+        type: float
+        description:
+            - Seconds to wait before the first status check of each job. The wait doubles after
+              each check which finds the job unfinished, up to I(poll_max_interval).
+    poll_max_interval:
+        default: 5
+        type: float
+        description:
+            - The longest wait between two status checks of a job, in seconds.
+    timeout:
+        default: 300
+        type: float
+        description:
+            - Stop waiting once this many seconds have passed since the task started. Jobs which
+              haven't finished by then fail the task.
+    fail_on_error:
+        default: true
+        type: bool
+        description:
+            - Fail the task if any job finishes in an error state.
+    max_concurrency:
+        default: 4
+        type: int
+        description:
+            - The maximum number of status checks to make at once.
+'''
+
+EXAMPLES = '''
+- name: request DNS reloads for several accounts without waiting
+  memset_dns_reload:
+    api_key: "{{ item }}"
+  with_items: "{{ memset_api_keys }}"
+  register: reloads
+  delegate_to: localhost
+
+- name: pair each reload's job with its account's API key
+  set_fact:
+    reload_jobs: "{{ reload_jobs | default([]) + [{'api_key': item.item, 'id': item.memset_api.id}] }}"
+  with_items: "{{ reloads.results }}"
+  no_log: true
+
+- name: wait for all of the reloads to finish in a single task
+  memset_job_wait:
+    jobs: "{{ reload_jobs }}"
+    timeout: 120
+  delegate_to: localhost
+
+- name: wait for jobs submitted by earlier tasks with the same API key
+  memset_job_wait:
+    api_key: 5eb86c9196ab03919abcf03857163741
+    job_ids: "{{ jobs.results | map(attribute='memset_api.id') | list }}"
+  delegate_to: localhost
+'''
+
+RETURN = '''
+---
+jobs:
+  description: The outcome of each job, in the same order as I(job_ids) or I(jobs).
+  returned: always
+  type: complex
+  contains:
+    id:
+      description: Job ID.
+      returned: always
+      type: string
+      sample: "c9cc8ad2a3e3fb8c63ed83c424928ef8"
+    job:
+      description: The job's last status from the Memset API, or null if it could not be fetched.
+      returned: always
+      type: dict
+      sample: { "error": false, "finished": true, "id": "c9cc8ad2a3e3fb8c63ed83c424928ef8",
+                "status": "DONE", "type": "dns" }
+    finished:
+      description: Whether the job finished before the deadline.
+      returned: always
+      type: bool
+      sample: true
+    checks:
+      description: Number of status checks made for the job.
+      returned: always
+      type: int
+      sample: 3
+    latency:
+      description: Seconds between the task starting and the job being seen to finish.
+      returned: always
+      type: float
+      sample: 1.52
+    msg:
+      description: The error from the Memset API if the job's status could not be fetched.
+      returned: always
+      type: string
+      sample: null
+memset_api_retries:
+  description: API calls retried after transient failures during this task.
+  returned: always
+  type: complex
+  contains:
+    backoff_seconds:
+      description: Total time spent waiting between attempts.
+      returned: always
+      type: float
+      sample: 1.25
+    retries:
+      description: Number of retried API calls.
+      returned: always
+      type: int
+      sample: 2
+memset_api_stats:
+  description: The API calls made during this task, overall and per API method. Latencies are in seconds.
+  returned: always
+  type: complex
+  contains:
+    calls:
+      description: Number of API calls made.
+      returned: always
+      type: int
+      sample: 3
+    latency_total:
+      description: Total time spent waiting for the API.
+      returned: always
+      type: float
+      sample: 0.412
+    latency_p95:
+      description: 95th percentile latency of a single call.
+      returned: always
+      type: float
+      sample: 0.188
+    request_bytes:
+      description: Total size of the request bodies sent.
+      returned: always
+      type: int
+      sample: 180
+    response_bytes:
+      description: Total size of the response bodies received.
+      returned: always
+      type: int
+      sample: 5120
+    retries:
+      description: Number of retried API calls.
+      returned: always
+      type: int
+      sample: 0
+    methods:
+      description: The same figures for each API method called.
+      returned: always
+      type: dict
+      sample: { "job.status": { "calls": 3, "latency_p95": 0.188, "latency_total": 0.412,
+                "request_bytes": 120, "response_bytes": 330, "retries": 0 } }
+'''
+
+import threading
+import time
+
+from ansible.module_utils.basic import AnsibleModule
+import ansible.module_utils.memset_broker  # noqa: F401 registers the broker with memset_api_call
+from ansible.module_utils.memset import memset_api_retry_stats
+from ansible.module_utils.memset import memset_api_stats
+from ansible.module_utils.memset import wait_for_jobs
+
+
+def wait(args=None):
+    '''
+    Wait for every job, then work out which of them (if any) should
+    fail the task: jobs which couldn't be polled, didn't finish in time
+    or (with fail_on_error) finished in an error state.
+    '''
+    retvals = dict()
+
+    # each account's jobs are waited for in a thread of their own, all
+    # against the same deadline.
+    by_key = dict()
+    for api_key, job_id in args['jobs']:
+        by_key.setdefault(api_key, []).append(job_id)
+
+    submitted = time.time()
+    outcomes = dict()
+
+    def wait_for_account(api_key, job_ids):
+        for job in wait_for_jobs(api_key, job_ids, interval=args['poll_interval'], max_interval=args['poll_max_interval'],
+                                 timeout=args['timeout'], submitted=submitted, max_concurrency=args['max_concurrency']):
+            outcomes[(api_key, job['id'])] = job
+
+    if len(by_key) == 1:
+        wait_for_account(*list(by_key.items())[0])
+    else:
+        threads = [threading.Thread(target=wait_for_account, args=item) for item in by_key.items()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    jobs = [dict(outcomes[(api_key, job_id)]) for api_key, job_id in args['jobs']]
+
+    failures = []
+    for job in jobs:
+        if job['msg'] is not None or not job['finished']:
+            failures.append(job)
+        elif args['fail_on_error'] and job['job'].get('error'):
+            failures.append(job)
+
+    retvals['changed'] = False
+    retvals['failed'] = len(failures) > 0
+    retvals['jobs'] = jobs
+    if failures:
+        retvals['msg'] = "{0} of {1} jobs did not finish successfully ({2})." . format(
+            len(failures), len(jobs), ', ' . join([job['id'] for job in failures]))
+        # an invalid API key fails every check in the same way, so surface it.
+        errors = set([job['msg'] for job in failures if job['msg'] is not None])
+        if len(errors) == 1 and len(failures) == len(jobs):
+            retvals['msg'] = errors.pop()
+
+    return(retvals)
+
+
+def main():
+    global module
+    module = AnsibleModule(
+        argument_spec=dict(
+            api_key=dict(required=False, type='str', no_log=True),
+            job_ids=dict(required=False, aliases=['ids'], type='list'),
+            jobs=dict(required=False, type='list', elements='dict',
+                      options=dict(id=dict(required=True, type='str'), api_key=dict(required=False, type='str', no_log=True))),
+            poll_interval=dict(required=False, default=0.5, type='float'),
+            poll_max_interval=dict(required=False, default=5, type='float'),
+            timeout=dict(required=False, default=300, type='float'),
+            fail_on_error=dict(required=False, default=True, type='bool'),
+            max_concurrency=dict(required=False, default=4, type='int')
+        ),
+        mutually_exclusive=[['job_ids', 'jobs']],
+        required_one_of=[['job_ids', 'jobs']],
+        supports_check_mode=True
+    )
+
+    # populate the dict with the user-provided vars.
+    args = dict()
+    for key, arg in module.params.items():
+        args[key] = arg
+    args['check_mode'] = module.check_mode
+
+    for arg in ['poll_interval', 'poll_max_interval', 'timeout']:
+        if args[arg] <= 0:
+            module.fail_json(failed=True, msg='{0} must be greater than 0.' . format(arg))
+    if args['max_concurrency'] < 1:
+        module.fail_json(failed=True, msg='max_concurrency must be at least 1.')
+
+    # every job is waited for as an (api_key, job id) pair.
+    if args['jobs'] is None:
+        args['jobs'] = [dict(id=job_id) for job_id in args['job_ids']]
+    if [job for job in args['jobs'] if not (job.get('api_key') or args['api_key'])]:
+        module.fail_json(failed=True, msg='api_key is required for jobs which do not set their own.')
+    args['jobs'] = [(job.get('api_key') or args['api_key'], str(job['id'])) for job in args['jobs']]
+
+    retvals = wait(args)
+
+    retvals['memset_api_retries'] = memset_api_retry_stats()
+    retvals['memset_api_stats'] = memset_api_stats()
+
+    if retvals['failed']:
+        module.fail_json(**retvals)
+    else:
+        module.exit_json(**retvals)
+
+
+if __name__ == '__main__':
+    main()
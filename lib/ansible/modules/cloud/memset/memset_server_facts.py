@@ -17,76 +17,220 @@ DOCUMENTATION = '''
 ---
 module: memset_server_facts
 author: "Simon Weald (@analbeard)"
-version_added: "2.6"
-short_description: Do something with something at Memset.
+version_added: "2.7"
+short_description: Retrieve facts about servers in a Memset account.
+extends_documentation_fragment: memset
 notes:
-  - Zone domains can be thought of as a collection of domains, all of which share the
-    same DNS records (i.e. they point to the same IP). An API key generated via the
-    Memset customer control panel is needed with the following minimum scope -
-    I(dns.zone_domain_create), I(dns.zone_domain_delete), I(dns.zone_domain_list).
+  - Servers are filtered as the server list is read, so only matching servers (and only
+    the requested I(fields)) are held in memory and returned. All filters must match
+    for a server to be returned; a filter which is not set matches every server.
+  - An API key generated via the Memset customer control panel is needed with the
+    following minimum scope - I(server.list).
 description:
-    - Do something with something at Memset.
+    - Retrieve facts about the servers in a Memset account, optionally filtered by
+      type, network zone, status and name.
 options:
-    state:
+    api_key:
         required: true
         description:
-            - Indicates desired state of resource.
-        choices: [ absent, present ]
+            - The API key obtained from the Memset control panel.
+    type:
+        type: list
+        description:
+            - Only return servers of these types (e.g. C(miniserver), C(dedicated)).
+    network_zone:
+        type: list
+        description:
+            - Only return servers in at least one of these network zones.
+    status:
+        type: list
+        description:
+            - Only return servers with one of these statuses (e.g. C(LIVE)).
+    name:
+        description:
+            - Only return servers whose name or nickname matches this pattern.
+    name_match:
+        default: glob
+        choices: [ glob, regex ]
+        description:
+            - How I(name) is matched; shell-style wildcards, or a regular expression
+              which must match from the start of the name.
+    fields:
+        type: list
+        description:
+            - Only return these fields of each server. All fields are returned if this
+              is not set.
 '''
 
 EXAMPLES = '''
-# Create the zone domain 'test.com'
-- name: create zone domain
-  memset_zone_domain:
-    domain: test.com
-    zone: testzone
-    state: present
+- name: get facts about all servers
+  memset_server_facts:
     api_key: 5eb86c9196ab03919abcf03857163741
   delegate_to: localhost
+
+- name: get the names and IPs of live miniservers in Reading whose name begins with web
+  memset_server_facts:
+    api_key: 5eb86c9196ab03919abcf03857163741
+    type: miniserver
+    network_zone: reading
+    status: LIVE
+    name: "web*"
+    fields: [ name, nickname, primary_ip ]
+  delegate_to: localhost
 '''
 
 RETURN = '''
 ---
-memset_api:
-  description: Info from the Memset API
-  returned: when changed or state == present
+ansible_facts:
+  description: Facts about the matching servers.
+  returned: success
+  type: complex
+  contains:
+    memset_servers:
+      description: The matching servers, with the requested fields.
+      returned: success
+      type: list
+      sample: [{ "name": "testyaa1", "nickname": "web1", "primary_ip": "1.2.3.4", "status": "LIVE",
+                 "type": "miniserver", "network_zones": ["reading"] }]
+memset_api_retries:
+  description: API calls retried after transient failures during this task.
+  returned: always
+  type: complex
+  contains:
+    backoff_seconds:
+      description: Total time spent waiting between attempts.
+      returned: always
+      type: float
+      sample: 1.25
+    retries:
+      description: Number of retried API calls.
+      returned: always
+      type: int
+      sample: 2
+memset_api_stats:
+  description: The API calls made during this task, overall and per API method. Latencies are in seconds.
+  returned: always
   type: complex
   contains:
-    resource:
-      description: short description
+    calls:
+      description: Number of API calls made.
+      returned: always
+      type: int
+      sample: 1
+    latency_total:
+      description: Total time spent waiting for the API.
+      returned: always
+      type: float
+      sample: 0.188
+    latency_p95:
+      description: 95th percentile latency of a single call.
+      returned: always
+      type: float
+      sample: 0.188
+    request_bytes:
+      description: Total size of the request bodies sent.
       returned: always
-      type: string
-      sample: "asdfasdfasdf"
+      type: int
+      sample: 40
+    response_bytes:
+      description: Total size of the response bodies received.
+      returned: always
+      type: int
+      sample: 5120
+    retries:
+      description: Number of retried API calls.
+      returned: always
+      type: int
+      sample: 0
+    methods:
+      description: The same figures for each API method called.
+      returned: always
+      type: dict
+      sample: { "server.list": { "calls": 1, "latency_p95": 0.188, "latency_total": 0.188,
+                "request_bytes": 40, "response_bytes": 5120, "retries": 0 } }
 '''
 
+import fnmatch
+import re
+
 from ansible.module_utils.basic import AnsibleModule
+import ansible.module_utils.memset_broker  # noqa: F401 registers the broker with memset_api_call
+import ansible.module_utils.memset_single_flight  # noqa: F401 registers single-flight with memset_api_call
 from ansible.module_utils.memset import memset_api_call
+from ansible.module_utils.memset import memset_api_retry_stats
+from ansible.module_utils.memset import memset_api_stats
+
+
+def build_filter(args=None):
+    '''
+    Compile the filter options into a single predicate which is called
+    once per server as the server list is read. Each filter is turned
+    into a set lookup or a compiled regex up front, so the per-server
+    cost doesn't depend on how the filters were written.
+    '''
+    predicates = []
+
+    if args['type']:
+        types = set([server_type.lower() for server_type in args['type']])
+        predicates.append(lambda server: (server.get('type') or '').lower() in types)
+
+    if args['network_zone']:
+        network_zones = set([network_zone.lower() for network_zone in args['network_zone']])
+        predicates.append(lambda server: bool(network_zones.intersection([zone.lower() for zone in server.get('network_zones') or []])))
+
+    if args['status']:
+        statuses = set([status.lower() for status in args['status']])
+        predicates.append(lambda server: (server.get('status') or '').lower() in statuses)
+
+    if args['name']:
+        if args['name_match'] == 'glob':
+            pattern = re.compile(fnmatch.translate(args['name']))
+        else:
+            try:
+                pattern = re.compile(args['name'])
+            except re.error as e:
+                module.fail_json(failed=True, msg='Invalid name pattern: {0}' . format(e))
+        predicates.append(lambda server: bool(pattern.match(server.get('name') or '') or pattern.match(server.get('nickname') or '')))
+
+    if not predicates:
+        return(None)
+
+    def matches(server):
+        for predicate in predicates:
+            if not predicate(server):
+                return(False)
+        return(True)
+
+    return(matches)
 
 
 def get_server_list(args=None):
     '''
-    We need to perform some initial sanity checking and also look
-    up required info before handing it off to create or delete.
+    Fetch the server list, keeping only the matching servers and the
+    requested fields as it is read.
     '''
-    retvals, payload = dict(), dict()
+    retvals = dict()
     has_failed, has_changed = False, False
-    msg, memset_api, stderr = None, None, None
+    msg, stderr = None, None
 
-    # get the zones and check if the relevant zone exists.
     api_method = 'server.list'
-    _has_failed, _msg, response = memset_api_call(api_key=args['api_key'], api_method=api_method)
-    if _has_failed:
+    has_failed, msg, response = memset_api_call(api_key=args['api_key'], api_method=api_method,
+                                                item_filter=build_filter(args), fields=args['fields'])
+    if has_failed:
         # this is the first time the API is called; incorrect credentials will
         # manifest themselves at this point so we need to ensure the user is
         # informed of the reason.
-        retvals['failed'] = _has_failed
-        retvals['msg'] = _msg
+        retvals['failed'] = has_failed
+        retvals['msg'] = msg
         retvals['stderr'] = "API returned an error: {0}" . format(response.status_code)
         return(retvals)
 
+    retvals['ansible_facts'] = dict(memset_servers=response.json())
+    msg = None
+
     retvals['changed'] = has_changed
     retvals['failed'] = has_failed
-    for val in ['msg', 'stderr', 'memset_api']:
+    for val in ['msg', 'stderr']:
         if val is not None:
             retvals[val] = eval(val)
 
@@ -97,9 +241,15 @@ def main():
     global module
     module = AnsibleModule(
         argument_spec=dict(
-            api_key=dict(required=True, type='str', no_log=True)
+            api_key=dict(required=True, type='str', no_log=True),
+            type=dict(required=False, type='list'),
+            network_zone=dict(required=False, type='list'),
+            status=dict(required=False, type='list'),
+            name=dict(required=False, type='str'),
+            name_match=dict(required=False, default='glob', choices=['glob', 'regex'], type='str'),
+            fields=dict(required=False, type='list')
         ),
-        supports_check_mode=False
+        supports_check_mode=True
     )
 
     # populate the dict with the user-provided vars.
@@ -109,6 +259,9 @@ def main():
 
     retvals = get_server_list(args)
 
+    retvals['memset_api_retries'] = memset_api_retry_stats()
+    retvals['memset_api_stats'] = memset_api_stats()
+
     if retvals['failed']:
         module.fail_json(**retvals)
     else:
@@ -117,69 +270,3 @@ def main():
 
 if __name__ == '__main__':
     main()
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-In[12]: for server in response.json():
-    ...: if server['type'] == 'miniserver':
-    ...: print(server['name'])
-
-filters:
-  - mini/dedicated
-  - network zone
-  - status
-  - name
@@ -19,11 +19,16 @@ module: memset_zone
 author: "Simon Weald (@analbeard)"
 version_added: "2.6"
 short_description: Creates and deletes Memset DNS zones.
+extends_documentation_fragment:
+  - memset
+  - memset.plan
 notes:
   - Zones can be thought of as a logical group of domains, all of which share the
     same DNS records (i.e. they point to the same IP). An API key generated via the
     Memset customer control panel is needed with the following minimum scope -
     I(dns.zone_create), I(dns.zone_delete), I(dns.zone_list).
+  - A plan made with I(plan_file) depends on the zones with this name; applying it fetches them
+    again with I(dns.zone_info), or with a filtered I(dns.zone_list) if there were none.
 description:
     - Manage DNS zones in a Memset account.
 options:
@@ -73,6 +78,26 @@ EXAMPLES = '''
     api_key: 5eb86c9196ab03919abcf03857163741
     force: true
   delegate_to: localhost
+
+# Plan a change in check mode, then apply exactly that change later
+- name: plan zone change
+  memset_zone:
+    name: test
+    state: present
+    api_key: 5eb86c9196ab03919abcf03857163741
+    ttl: 600
+    plan_file: /tmp/memset-zone-test.plan
+  check_mode: true
+  delegate_to: localhost
+
+- name: apply zone change
+  memset_zone:
+    name: test
+    state: present
+    api_key: 5eb86c9196ab03919abcf03857163741
+    ttl: 600
+    plan_file: /tmp/memset-zone-test.plan
+  delegate_to: localhost
 '''
 
 RETURN = '''
@@ -106,12 +131,90 @@ memset_api:
       returned: always
       type: int
       sample: 300
+plan:
+  description: The change plan written in check mode, or applied, when plan_file is set.
+  returned: when plan_file is set
+  type: complex
+  contains:
+    actions:
+      description: The planned API calls, in the order they are made.
+      returned: always
+      type: list
+      sample: [ { "method": "dns.zone_update", "payload": { "id": "b0bb1ce851aeea6feeb2dc32fe83bf9c", "ttl": 600 } } ]
+    fingerprint:
+      description: Hash of the part of the account the plan was made from.
+      returned: always
+      type: string
+      sample: "9f2c1d0e5b7a4c3e8d6f1a2b3c4d5e6f7a8b9c0d1e2f3a4b5c6d7e8f9a0b1c2d"
+memset_api_retries:
+  description: API calls retried after transient failures during this task.
+  returned: always
+  type: complex
+  contains:
+    backoff_seconds:
+      description: Total time spent waiting between attempts.
+      returned: always
+      type: float
+      sample: 1.25
+    retries:
+      description: Number of retried API calls.
+      returned: always
+      type: int
+      sample: 2
+memset_api_stats:
+  description: The API calls made during this task, overall and per API method. Latencies are in seconds.
+  returned: always
+  type: complex
+  contains:
+    calls:
+      description: Number of API calls made.
+      returned: always
+      type: int
+      sample: 3
+    latency_total:
+      description: Total time spent waiting for the API.
+      returned: always
+      type: float
+      sample: 0.412
+    latency_p95:
+      description: 95th percentile latency of a single call.
+      returned: always
+      type: float
+      sample: 0.188
+    request_bytes:
+      description: Total size of the request bodies sent.
+      returned: always
+      type: int
+      sample: 180
+    response_bytes:
+      description: Total size of the response bodies received.
+      returned: always
+      type: int
+      sample: 5120
+    retries:
+      description: Number of retried API calls.
+      returned: always
+      type: int
+      sample: 0
+    methods:
+      description: The same figures for each API method called.
+      returned: always
+      type: dict
+      sample: { "dns.zone_list": { "calls": 1, "latency_p95": 0.188, "latency_total": 0.188,
+                "request_bytes": 40, "response_bytes": 5120, "retries": 0 } }
 '''
 
 from ansible.module_utils.basic import AnsibleModule
-from ansible.module_utils.memset import check_zone
-from ansible.module_utils.memset import get_zone_id
+import ansible.module_utils.memset_broker  # noqa: F401 registers the broker with memset_api_call
+import ansible.module_utils.memset_single_flight  # noqa: F401 registers single-flight with memset_api_call
+import ansible.module_utils.memset_journal  # noqa: F401 registers the DNS journal with memset_api_call
+from ansible.module_utils.memset import AccountIndex
 from ansible.module_utils.memset import memset_api_call
+from ansible.module_utils.memset import memset_api_retry_stats
+from ansible.module_utils.memset import memset_api_stats
+from ansible.module_utils.memset_plan import apply_plan
+from ansible.module_utils.memset_plan import read_plan
+from ansible.module_utils.memset_plan import write_plan
 
 
 def api_validation(args=None):
@@ -125,27 +228,50 @@ def api_validation(args=None):
         module.fail_json(failed=True, msg=stderr, stderr=stderr)
 
 
-def check(args=None):
+def check(args=None, index=None):
     '''
     Support for running with check mode.
     '''
     retvals = dict()
 
-    api_method = 'dns.zone_list'
-    has_failed, _msg, response = memset_api_call(api_key=args['api_key'], api_method=api_method)
-
-    zone_exists, counter = check_zone(data=response, name=args['name'])
+    zone_exists = len(index.zones(args['name'])) == 1
 
     # set changed to true if the operation would cause a change.
     has_changed = ((zone_exists and args['state'] == 'absent') or (not zone_exists and args['state'] == 'present'))
 
     retvals['changed'] = has_changed
-    retvals['failed'] = has_failed
+    retvals['failed'] = False
 
     return(retvals)
 
 
-def create_zone(args=None, zone_exists=None, payload=None):
+def get_zone_info(args=None, zone=None):
+    '''
+    dns.zone_list, dns.zone_create and dns.zone_update all return the
+    zone's details, so dns.zone_info is only needed if the response we
+    have doesn't include them.
+    '''
+    if isinstance(zone, dict) and 'records' in zone and 'domains' in zone:
+        return(zone)
+
+    if isinstance(zone, dict) and 'id' in zone:
+        zone_id = zone['id']
+    else:
+        api_method = 'dns.zone_list'
+        _has_failed, _msg, response = memset_api_call(api_key=args['api_key'], api_method=api_method)
+        zone_exists, msg, counter, zone_id = AccountIndex(zones=response.json()).get_zone_id(args['name'])
+        if not zone_exists:
+            return(None)
+
+    payload = dict()
+    payload['id'] = zone_id
+    api_method = 'dns.zone_info'
+    _has_failed, _msg, response = memset_api_call(api_key=args['api_key'], api_method=api_method, payload=payload)
+
+    return(response.json())
+
+
+def create_zone(args=None, zone_exists=None, payload=None, index=None):
     '''
     At this point we already know whether the zone exists, so we
     just need to make the API reflect the desired state.
@@ -158,42 +284,32 @@ def create_zone(args=None, zone_exists=None, payload=None):
         payload['nickname'] = args['name']
         api_method = 'dns.zone_create'
         has_failed, msg, response = memset_api_call(api_key=args['api_key'], api_method=api_method, payload=payload)
-        if not has_failed:
-            has_changed = True
+        zone = msg
     else:
-        api_method = 'dns.zone_list'
-        _has_failed, _msg, response = memset_api_call(api_key=args['api_key'], api_method=api_method)
-        for zone in response.json():
-            if zone['nickname'] == args['name']:
-                break
+        zone = index.zones(args['name'])[0]
         if zone['ttl'] != args['ttl']:
             # update the zone if the desired TTL is different.
             payload['id'] = zone['id']
             payload['ttl'] = args['ttl']
             api_method = 'dns.zone_update'
             has_failed, msg, response = memset_api_call(api_key=args['api_key'], api_method=api_method, payload=payload)
-            if not has_failed:
-                has_changed = True
+            zone = msg
 
-    # populate return var with zone info.
-    api_method = 'dns.zone_list'
-    _has_failed, _msg, response = memset_api_call(api_key=args['api_key'], api_method=api_method)
+    if has_failed:
+        return(has_failed, has_changed, memset_api, msg)
 
-    zone_exists, msg, counter, zone_id = get_zone_id(zone_name=args['name'], current_zones=response.json())
+    has_changed = payload != dict()
+    msg = None
 
-    if zone_exists:
-        payload = dict()
-        payload['id'] = zone_id
-        api_method = 'dns.zone_info'
-        _has_failed, _msg, response = memset_api_call(api_key=args['api_key'], api_method=api_method, payload=payload)
-        memset_api = response.json()
-    else:
-        msg = msg
+    # populate return var with zone info.
+    memset_api = get_zone_info(args=args, zone=zone)
+    if memset_api is None:
+        msg = 'No matching zone found'
 
     return(has_failed, has_changed, memset_api, msg)
 
 
-def delete_zone(args=None, zone_exists=None, payload=None):
+def delete_zone(args=None, zone_exists=None, payload=None, index=None):
     '''
     Deletion requires extra sanity checking as the zone cannot be
     deleted if it contains domains or records. Setting force=true
@@ -203,18 +319,11 @@ def delete_zone(args=None, zone_exists=None, payload=None):
     msg, memset_api = None, None
 
     if zone_exists:
-        api_method = 'dns.zone_list'
-        _has_failed, _msg, response = memset_api_call(api_key=args['api_key'], api_method=api_method, payload=payload)
-        counter = 0
-        for zone in response.json():
-            if zone['nickname'] == args['name']:
-                counter += 1
-        if counter == 1:
-            for zone in response.json():
-                if zone['nickname'] == args['name']:
-                    zone_id = zone['id']
-                    domain_count = len(zone['domains'])
-                    record_count = len(zone['records'])
+        zones = index.zones(args['name'])
+        if len(zones) == 1:
+            zone_id = zones[0]['id']
+            domain_count = len(zones[0]['domains'])
+            record_count = len(zones[0]['records'])
             if (domain_count > 0 or record_count > 0) and args['force'] is False:
                 # we need to fail out if force was not explicitly set.
                 stderr = 'Zone contains domains or records and force was not used.'
@@ -241,10 +350,131 @@ def delete_zone(args=None, zone_exists=None, payload=None):
     return(has_failed, has_changed, memset_api, msg)
 
 
+def zone_state(zones=None):
+    '''
+    The parts of the zones with the requested name which a change plan
+    depends on.
+    '''
+    state = []
+    for zone in zones:
+        state.append(dict(id=zone['id'], nickname=zone['nickname'], ttl=zone['ttl'],
+                          domains=len(zone['domains']), records=len(zone['records'])))
+
+    return(sorted(state, key=lambda zone: zone['id']))
+
+
+def plan_zone(args=None, index=None):
+    '''
+    Work out the API calls needed to reach the desired state, in the same
+    way as create_zone and delete_zone. Returns a list of (api_method,
+    payload) tuples and an error message if the change can't be made.
+    '''
+    zones = index.zones(args['name'])
+
+    if args['state'] == 'present':
+        if len(zones) != 1:
+            return([('dns.zone_create', dict(nickname=args['name'], ttl=args['ttl']))], None)
+        if zones[0]['ttl'] != args['ttl']:
+            return([('dns.zone_update', dict(id=zones[0]['id'], ttl=args['ttl']))], None)
+        return([], None)
+
+    if not zones:
+        return([], None)
+    if len(zones) > 1:
+        return([], 'Unable to delete zone as multiple zones with the same name exist.')
+    if (zones[0]['domains'] or zones[0]['records']) and args['force'] is False:
+        return([], 'Zone contains domains or records and force was not used.')
+
+    return([('dns.zone_delete', dict(id=zones[0]['id']))], None)
+
+
+def plan_or_apply(args=None):
+    '''
+    With plan_file set, check mode writes the calls this run would make
+    to the file, and a normal run makes the calls in the file once it
+    has checked that the zones they were planned from haven't changed.
+    '''
+    retvals = dict()
+    memset_api = None
+
+    if args['check_mode']:
+        api_method = 'dns.zone_list'
+        has_failed, msg, response = memset_api_call(api_key=args['api_key'], api_method=api_method)
+        if has_failed:
+            # this is the first time the API is called; incorrect credentials will
+            # manifest themselves at this point so we need to ensure the user is
+            # informed of the reason.
+            retvals['failed'] = has_failed
+            retvals['msg'] = msg
+            return(retvals)
+
+        index = AccountIndex(zones=response.json())
+        actions, msg = plan_zone(args=args, index=index)
+        if msg is not None:
+            retvals['failed'] = True
+            retvals['msg'] = msg
+            return(retvals)
+
+        plan = write_plan(args['plan_file'], 'memset_zone', args, zone_state(index.zones(args['name'])), actions)
+        retvals['changed'] = len(actions) > 0
+        retvals['failed'] = False
+        retvals['plan'] = dict(actions=plan['actions'], fingerprint=plan['fingerprint'])
+        return(retvals)
+
+    plan, msg = read_plan(args['plan_file'], 'memset_zone', args)
+    if msg is not None:
+        retvals['failed'] = True
+        retvals['msg'] = msg
+        return(retvals)
+
+    # zones the plan was made from are fetched individually; if there were
+    # none, the zone list is needed to notice one being created since.
+    zones = []
+    if plan['state']:
+        for planned in plan['state']:
+            has_failed, msg, response = memset_api_call(api_key=args['api_key'], api_method='dns.zone_info',
+                                                        payload=dict(id=planned['id']))
+            if not has_failed:
+                zones.append(response.json())
+            elif response.status_code != 404:
+                retvals['failed'] = has_failed
+                retvals['msg'] = msg
+                return(retvals)
+    else:
+        has_failed, msg, response = memset_api_call(api_key=args['api_key'], api_method='dns.zone_list',
+                                                    item_filter=lambda zone: zone['nickname'] == args['name'])
+        if has_failed:
+            retvals['failed'] = has_failed
+            retvals['msg'] = msg
+            return(retvals)
+        zones = response.json()
+
+    has_failed, msg, responses = apply_plan(args['api_key'], plan, zone_state(zones))
+
+    if not has_failed:
+        msg = None
+        if args['state'] == 'present':
+            # the zone as returned by the last call, or as fetched above.
+            memset_api = get_zone_info(args=args, zone=(responses or zones)[-1])
+        elif responses:
+            memset_api = responses[-1]
+
+    retvals['failed'] = has_failed
+    retvals['changed'] = len(responses) > 0
+    retvals['plan'] = dict(actions=plan['actions'], fingerprint=plan['fingerprint'])
+    for val in ['msg', 'memset_api']:
+        if eval(val) is not None:
+            retvals[val] = eval(val)
+
+    return(retvals)
+
+
 def create_or_delete(args=None):
     '''
     We need to perform some initial sanity checking and also look
     up required info before handing it off to create or delete.
+    The zone list is only fetched once per run and is passed on to
+    whichever function needs it.
     '''
     retvals, payload = dict(), dict()
     has_failed, has_changed = False, False
@@ -262,13 +492,18 @@ def create_or_delete(args=None):
 
         return(retvals)
 
-    zone_exists, _msg, counter, _zone_id = get_zone_id(zone_name=args['name'], current_zones=response.json())
+    index = AccountIndex(zones=response.json())
+
+    if args['check_mode']:
+        return(check(args=args, index=index))
+
+    zone_exists, _msg, counter, _zone_id = index.get_zone_id(args['name'])
 
     if args['state'] == 'present':
-        has_failed, has_changed, memset_api, msg = create_zone(args=args, zone_exists=zone_exists, payload=payload)
+        has_failed, has_changed, memset_api, msg = create_zone(args=args, zone_exists=zone_exists, payload=payload, index=index)
 
     elif args['state'] == 'absent':
-        has_failed, has_changed, memset_api, msg = delete_zone(args=args, zone_exists=zone_exists, payload=payload)
+        has_failed, has_changed, memset_api, msg = delete_zone(args=args, zone_exists=zone_exists, payload=payload, index=index)
 
     retvals['failed'] = has_failed
     retvals['changed'] = has_changed
@@ -287,7 +522,8 @@ def main():
             api_key=dict(required=True, type='str', no_log=True),
             name=dict(required=True, aliases=['nickname'], type='str'),
             ttl=dict(required=False, default=0, choices=[0, 300, 600, 900, 1800, 3600, 7200, 10800, 21600, 43200, 86400], type='int'),
-            force=dict(required=False, default=False, type='bool')
+            force=dict(required=False, default=False, type='bool'),
+            plan_file=dict(required=False, type='path')
         ),
         supports_check_mode=True
     )
@@ -301,11 +537,14 @@ def main():
     # validate some API-specific limitations.
     api_validation(args=args)
 
-    if module.check_mode:
-        retvals = check(args)
+    if args['plan_file'] is not None:
+        retvals = plan_or_apply(args)
     else:
         retvals = create_or_delete(args)
 
+    retvals['memset_api_retries'] = memset_api_retry_stats()
+    retvals['memset_api_stats'] = memset_api_stats()
+
     if retvals['failed']:
         module.fail_json(**retvals)
     else:
@@ -19,13 +19,20 @@ module: memset_zone_domain
 author: "Simon Weald (@analbeard)"
 version_added: "2.6"
 short_description: Create and delete domains in Memset DNS zones.
+extends_documentation_fragment:
+  - memset
+  - memset.plan
 notes:
   - Zone domains can be thought of as a collection of domains, all of which share the
     same DNS records (i.e. they point to the same IP). An API key generated via the
     Memset customer control panel is needed with the following minimum scope -
     I(dns.zone_domain_create), I(dns.zone_domain_delete), I(dns.zone_domain_list).
-  - Currently this module can only create one domain at a time. Multiple domains should
-    be created using C(with_items).
+  - Multiple domains should be managed with I(domains) rather than C(with_items); the zone and
+    domain lists are then fetched once for the whole set instead of once per domain.
+  - The domain details returned are taken from the domain list, or from the API's response when
+    a domain is created, so no separate I(dns.zone_domain_info) call is made.
+  - A plan made with I(plan_file) depends on whether the domain exists and which zone it is in;
+    applying it fetches the domain again with a single I(dns.zone_domain_info) call.
 description:
     - Manage DNS zone domains in a Memset account.
 options:
@@ -39,14 +46,28 @@ options:
         description:
             - The API key obtained from the Memset control panel.
     domain:
-        required: true
         description:
             - The zone domain name. Ensure this value has at most 250 characters.
+              Required unless I(domains) is set.
         aliases: ['name']
     zone:
-        required: true
         description:
-            - The zone to add the domain to (this must already exist).
+            - The zone to add the domain to (this must already exist). Required unless every
+              item of I(domains) sets its own zone.
+    domains:
+        type: list
+        version_added: "2.7"
+        description:
+            - A list of domains to manage in a single run, which may span several zones. Each item is
+              either a domain name, or a dict taking the I(domain), I(zone) and I(state) options;
+              unset keys take the values of the module's own I(zone) and I(state) options.
+            - Mutually exclusive with I(domain) and I(plan_file).
+    max_concurrency:
+        type: int
+        default: 4
+        version_added: "2.7"
+        description:
+            - The maximum number of domains to create or delete at once when I(domains) is set.
 '''
 
 EXAMPLES = '''
@@ -58,6 +79,37 @@ EXAMPLES = '''
     state: present
     api_key: 5eb86c9196ab03919abcf03857163741
   delegate_to: localhost
+
+# Plan the change in check mode, then apply exactly that change later
+- name: plan zone domain
+  memset_zone_domain:
+    domain: test.com
+    zone: testzone
+    state: present
+    api_key: 5eb86c9196ab03919abcf03857163741
+    plan_file: /tmp/memset-test.com.plan
+  check_mode: true
+  delegate_to: localhost
+
+- name: apply zone domain plan
+  memset_zone_domain:
+    domain: test.com
+    zone: testzone
+    state: present
+    api_key: 5eb86c9196ab03919abcf03857163741
+    plan_file: /tmp/memset-test.com.plan
+  delegate_to: localhost
+
+# Attach many domains to a zone, and remove one from another, in one run
+- name: manage zone domains
+  memset_zone_domain:
+    zone: testzone
+    api_key: 5eb86c9196ab03919abcf03857163741
+    domains:
+      - test.com
+      - test.net
+      - { 'domain': 'test.org', 'zone': 'oldzone', 'state': 'absent' }
+  delegate_to: localhost
 '''
 
 RETURN = '''
@@ -76,12 +128,113 @@ memset_api:
       returned: always
       type: string
       sample: "b0bb1ce851aeea6feeb2dc32fe83bf9c"
+domains:
+  description: Per-domain results, in the same order as the I(domains) option.
+  returned: when domains is set
+  type: list
+  sample: [
+    {
+      "changed": true,
+      "domain": "test.com",
+      "failed": false,
+      "memset_api": {
+        "domain": "test.com",
+        "zone_id": "b0bb1ce851aeea6feeb2dc32fe83bf9c"
+      },
+      "state": "present",
+      "zone": "testzone"
+    }
+  ]
+plan:
+  description: The change plan written in check mode, or applied, when plan_file is set.
+  returned: when plan_file is set
+  type: complex
+  contains:
+    actions:
+      description: The planned API calls, in the order they are made.
+      returned: always
+      type: list
+      sample: [ { "method": "dns.zone_domain_create", "payload": { "domain": "test.com", "zone_id": "b0bb1ce851aeea6feeb2dc32fe83bf9c" } } ]
+    fingerprint:
+      description: Hash of the part of the account the plan was made from.
+      returned: always
+      type: string
+      sample: "9f2c1d0e5b7a4c3e8d6f1a2b3c4d5e6f7a8b9c0d1e2f3a4b5c6d7e8f9a0b1c2d"
+memset_api_retries:
+  description: API calls retried after transient failures during this task.
+  returned: always
+  type: complex
+  contains:
+    backoff_seconds:
+      description: Total time spent waiting between attempts.
+      returned: always
+      type: float
+      sample: 1.25
+    retries:
+      description: Number of retried API calls.
+      returned: always
+      type: int
+      sample: 2
+memset_api_stats:
+  description: The API calls made during this task, overall and per API method. Latencies are in seconds.
+  returned: always
+  type: complex
+  contains:
+    calls:
+      description: Number of API calls made.
+      returned: always
+      type: int
+      sample: 3
+    latency_total:
+      description: Total time spent waiting for the API.
+      returned: always
+      type: float
+      sample: 0.412
+    latency_p95:
+      description: 95th percentile latency of a single call.
+      returned: always
+      type: float
+      sample: 0.188
+    request_bytes:
+      description: Total size of the request bodies sent.
+      returned: always
+      type: int
+      sample: 180
+    response_bytes:
+      description: Total size of the response bodies received.
+      returned: always
+      type: int
+      sample: 5120
+    retries:
+      description: Number of retried API calls.
+      returned: always
+      type: int
+      sample: 0
+    methods:
+      description: The same figures for each API method called.
+      returned: always
+      type: dict
+      sample: { "dns.zone_list": { "calls": 1, "latency_p95": 0.188, "latency_total": 0.188,
+                "request_bytes": 40, "response_bytes": 5120, "retries": 0 } }
 '''
 
 from ansible.module_utils.basic import AnsibleModule
-from ansible.module_utils.memset import get_zone_id
-from ansible.module_utils.memset import check_zone_domain
+import ansible.module_utils.memset_broker  # noqa: F401 registers the broker with memset_api_call
+import ansible.module_utils.memset_single_flight  # noqa: F401 registers single-flight with memset_api_call
+import ansible.module_utils.memset_journal  # noqa: F401 registers the DNS journal with memset_api_call
+from ansible.module_utils.memset import AccountIndex
 from ansible.module_utils.memset import memset_api_call
+from ansible.module_utils.memset import memset_api_calls
+from ansible.module_utils.memset import memset_api_retry_stats
+from ansible.module_utils.memset import memset_api_stats
+from ansible.module_utils.memset import project_fields
+from ansible.module_utils.memset_plan import apply_plan
+from ansible.module_utils.memset_plan import read_plan
+from ansible.module_utils.memset_plan import write_plan
+from ansible.module_utils.six import string_types
+
+# keys accepted by each item of the domains option.
+DOMAIN_KEYS = ['domain', 'zone', 'state']
 
 
 def api_validation(args=None):
@@ -89,6 +242,49 @@ def api_validation(args=None):
     Perform some validation which will be enforced by Memset's API (see:
     https://www.memset.com/apidocs/methods_dns.html#dns.zone_domain_create)
     '''
+    if args['max_concurrency'] < 1:
+        module.fail_json(failed=True, msg='max_concurrency must be at least 1.')
+
+    if args['domains'] is not None:
+        domains, errors, seen = [], [], set()
+        for idx, item in enumerate(args['domains']):
+            prefix = 'domains[{0}]' . format(idx)
+            if isinstance(item, string_types):
+                item = dict(domain=item)
+            if not isinstance(item, dict):
+                errors.append('{0}: each domain must be a name or a dict.' . format(prefix))
+                continue
+
+            item = dict(item)
+            if 'name' in item:
+                item['domain'] = item.pop('name')
+            unknown = [key for key in item if key not in DOMAIN_KEYS]
+            if unknown:
+                errors.append('{0}: unsupported keys {1}.' . format(prefix, ', ' . join(sorted(unknown))))
+                continue
+
+            zone_domain = dict(domain=item.get('domain'), zone=item.get('zone') or args['zone'], state=item.get('state') or args['state'])
+            missing = [key for key in DOMAIN_KEYS if not zone_domain[key]]
+            if missing:
+                errors.append('{0}: missing required keys {1}.' . format(prefix, ', ' . join(missing)))
+            elif zone_domain['state'] not in ['present', 'absent']:
+                errors.append('{0}: state must be one of present, absent.' . format(prefix))
+            elif len(zone_domain['domain']) > 250:
+                errors.append('{0}: Zone domain must be less than 250 characters in length.' . format(prefix))
+            elif zone_domain['domain'] in seen:
+                errors.append('{0}: {1} is listed more than once.' . format(prefix, zone_domain['domain']))
+            else:
+                seen.add(zone_domain['domain'])
+                domains.append(zone_domain)
+        if errors:
+            module.fail_json(failed=True, msg=' ' . join(errors))
+        args['domains'] = domains
+        return
+
+    missing = [key for key in ['domain', 'zone'] if args[key] is None]
+    if missing:
+        module.fail_json(failed=True, msg='missing required arguments: {0}' . format(', ' . join(missing)))
+
     # zone domain length must be less than 250 chars
     if len(args['domain']) > 250:
         stderr = 'Zone domain must be less than 250 characters in length.'
@@ -103,9 +299,12 @@ def check(args=None):
     has_changed = False
 
     api_method = 'dns.zone_domain_list'
-    has_failed, msg, response = memset_api_call(api_key=args['api_key'], api_method=api_method)
+    has_failed, msg, response = memset_api_call(api_key=args['api_key'], api_method=api_method,
+                                                item_filter=lambda zone_domain: zone_domain['domain'] == args['domain'])
 
-    domain_exists = check_zone_domain(data=response, domain=args['domain'])
+    domain_exists = False
+    if not has_failed:
+        domain_exists = AccountIndex(domains=response.json()).has_domain(args['domain'])
 
     # set changed to true if the operation would cause a change.
     has_changed = ((domain_exists and args['state'] == 'absent') or (not domain_exists and args['state'] == 'present'))
@@ -120,18 +319,21 @@ def create_zone_domain(args=None, zone_exists=None, zone_id=None, payload=None):
     '''
     At this point we already know whether the containing zone exists,
     so we just need to create the domain (or exit if it already exists).
+    The domain list and dns.zone_domain_create both return the domain's
+    details, so they are returned without a dns.zone_domain_info call.
     '''
     has_changed, has_failed = False, False
-    msg = None
+    msg, memset_api = None, None
 
     api_method = 'dns.zone_domain_list'
-    _has_failed, _msg, response = memset_api_call(api_key=args['api_key'], api_method=api_method)
-
-    for zone_domain in response.json():
-        if zone_domain['domain'] == args['domain']:
-            # zone domain already exists, nothing to change.
-            has_changed = False
-            break
+    _has_failed, _msg, response = memset_api_call(api_key=args['api_key'], api_method=api_method,
+                                                  item_filter=lambda zone_domain: zone_domain['domain'] == args['domain'])
+
+    zone_domain = AccountIndex(domains=response.json()).domain(args['domain'])
+    if zone_domain is not None:
+        # zone domain already exists, nothing to change.
+        has_changed = False
+        memset_api = zone_domain
     else:
         # we need to create the domain
         api_method = 'dns.zone_domain_create'
@@ -140,8 +342,10 @@ def create_zone_domain(args=None, zone_exists=None, zone_id=None, payload=None):
         has_failed, msg, response = memset_api_call(api_key=args['api_key'], api_method=api_method, payload=payload)
         if not has_failed:
             has_changed = True
+            memset_api = msg if isinstance(msg, dict) else payload
+            msg = None
 
-    return(has_failed, has_changed, msg)
+    return(has_failed, has_changed, memset_api, msg)
 
 
 def delete_zone_domain(args=None, payload=None):
@@ -154,9 +358,12 @@ def delete_zone_domain(args=None, payload=None):
     msg, memset_api = None, None
 
     api_method = 'dns.zone_domain_list'
-    _has_failed, _msg, response = memset_api_call(api_key=args['api_key'], api_method=api_method)
+    _has_failed, _msg, response = memset_api_call(api_key=args['api_key'], api_method=api_method,
+                                                  item_filter=lambda zone_domain: zone_domain['domain'] == args['domain'])
 
-    domain_exists = check_zone_domain(data=response, domain=args['domain'])
+    domain_exists = False
+    if not _has_failed:
+        domain_exists = AccountIndex(domains=response.json()).has_domain(args['domain'])
 
     if domain_exists:
         api_method = 'dns.zone_domain_delete'
@@ -171,18 +378,18 @@ def delete_zone_domain(args=None, payload=None):
     return(has_failed, has_changed, memset_api, msg)
 
 
-def create_or_delete_domain(args=None):
+def find_zone_id(args=None):
     '''
-    We need to perform some initial sanity checking and also look
-    up required info before handing it off to create or delete.
+    Look up the id of the zone the domain belongs in. Returns the id, or
+    the return values to fail with if the zone can't be used.
     '''
-    retvals, payload = dict(), dict()
-    has_changed, has_failed = False, False
-    msg, stderr, memset_api = None, None, None
+    retvals = dict()
+    stderr = None
 
-    # get the zones and check if the relevant zone exists.
+    # get the zones and check if the relevant zone exists. Only the zone
+    # ids and names are needed, so their domains and records are dropped.
     api_method = 'dns.zone_list'
-    has_failed, msg, response = memset_api_call(api_key=args['api_key'], api_method=api_method)
+    has_failed, msg, response = memset_api_call(api_key=args['api_key'], api_method=api_method, fields=['id', 'nickname'])
 
     if has_failed:
         # this is the first time the API is called; incorrect credentials will
@@ -191,25 +398,41 @@ def create_or_delete_domain(args=None):
         retvals['failed'] = has_failed
         retvals['msg'] = msg
         retvals['stderr'] = "API returned an error: {0}" . format(response.status_code)
-        return(retvals)
+        return(retvals, None)
 
-    zone_exists, msg, counter, zone_id = get_zone_id(zone_name=args['zone'], current_zones=response.json())
+    zone_exists, msg, counter, zone_id = AccountIndex(zones=response.json()).get_zone_id(args['zone'])
 
     if not zone_exists:
         # the zone needs to be unique - this isn't a requirement of Memset's API but it
         # makes sense in the context of this module.
-        has_failed = True
         if counter == 0:
             stderr = "DNS zone '{0}' does not exist, cannot create domain." . format(args['zone'])
         elif counter > 1:
             stderr = "{0} matches multiple zones, cannot create domain." . format(args['zone'])
 
-        retvals['failed'] = has_failed
+        retvals['failed'] = True
         retvals['msg'] = stderr
+        return(retvals, None)
+
+    return(None, zone_id)
+
+
+def create_or_delete_domain(args=None):
+    '''
+    We need to perform some initial sanity checking and also look
+    up required info before handing it off to create or delete.
+    '''
+    payload = dict()
+    has_changed, has_failed = False, False
+    msg, stderr, memset_api = None, None, None
+
+    retvals, zone_id = find_zone_id(args)
+    if retvals is not None:
         return(retvals)
+    retvals = dict()
 
     if args['state'] == 'present':
-        has_failed, has_changed, msg = create_zone_domain(args=args, zone_exists=zone_exists, zone_id=zone_id, payload=payload)
+        has_failed, has_changed, memset_api, msg = create_zone_domain(args=args, zone_exists=True, zone_id=zone_id, payload=payload)
 
     if args['state'] == 'absent':
         has_failed, has_changed, memset_api, msg = delete_zone_domain(args=args, payload=payload)
@@ -223,15 +446,194 @@ def create_or_delete_domain(args=None):
     return(retvals)
 
 
+def create_or_delete_domains(args=None):
+    '''
+    Reconcile every item of the domains option in one pass. The zone and
+    domain lists are fetched once and indexed, then only the domains
+    which differ from the desired state are created or deleted. Domains
+    are unique, so the changes are independent and are made
+    concurrently. A failure for one domain does not stop the others.
+    '''
+    retvals, results, changes = dict(), [], []
+
+    nicknames = set([zone_domain['zone'] for zone_domain in args['domains']])
+    api_method = 'dns.zone_list'
+    has_failed, msg, response = memset_api_call(api_key=args['api_key'], api_method=api_method,
+                                                item_filter=lambda zone: zone['nickname'] in nicknames,
+                                                fields=['id', 'nickname'])
+
+    if has_failed:
+        # this is the first time the API is called; incorrect credentials will
+        # manifest themselves at this point so we need to ensure the user is
+        # informed of the reason.
+        retvals['failed'] = has_failed
+        retvals['msg'] = msg
+        retvals['stderr'] = "API returned an error: {0}" . format(response.status_code)
+        return(retvals)
+
+    index = AccountIndex(zones=response.json())
+
+    names = set([zone_domain['domain'] for zone_domain in args['domains']])
+    api_method = 'dns.zone_domain_list'
+    has_failed, msg, response = memset_api_call(api_key=args['api_key'], api_method=api_method,
+                                                item_filter=lambda zone_domain: zone_domain['domain'] in names)
+
+    if has_failed:
+        retvals['failed'] = has_failed
+        retvals['msg'] = msg
+        return(retvals)
+
+    for zone_domain in response.json():
+        index.add_domain(zone_domain)
+
+    for zone_domain in args['domains']:
+        result = dict(changed=False, failed=False)
+        for key in ['domain', 'zone', 'state']:
+            result[key] = zone_domain[key]
+        results.append(result)
+
+        zone_exists, _msg, counter, zone_id = index.get_zone_id(zone_domain['zone'])
+        if not zone_exists:
+            result['failed'] = True
+            if counter == 0:
+                result['msg'] = "DNS zone '{0}' does not exist, cannot create domain." . format(zone_domain['zone'])
+            else:
+                result['msg'] = "{0} matches multiple zones, cannot create domain." . format(zone_domain['zone'])
+            continue
+
+        existing = index.domain(zone_domain['domain'])
+        if zone_domain['state'] == 'present':
+            if existing is not None:
+                # the domain list already has the details we'd return.
+                result['memset_api'] = existing
+            else:
+                changes.append((result, 'dns.zone_domain_create', dict(domain=zone_domain['domain'], zone_id=zone_id)))
+        elif existing is not None:
+            changes.append((result, 'dns.zone_domain_delete', dict(domain=zone_domain['domain'])))
+
+    if args['check_mode']:
+        responses = [(False, None, None)] * len(changes)
+    else:
+        calls = [(api_method, payload) for _result, api_method, payload in changes]
+        responses = memset_api_calls(api_key=args['api_key'], calls=calls, max_concurrency=args['max_concurrency'])
+
+    for (result, api_method, payload), (has_failed, msg, _response) in zip(changes, responses):
+        if has_failed:
+            result['failed'] = True
+            result['msg'] = msg
+            continue
+        result['changed'] = True
+        if api_method == 'dns.zone_domain_create':
+            result['memset_api'] = msg if isinstance(msg, dict) else payload
+
+    failures = [result for result in results if result['failed']]
+
+    retvals['changed'] = any([result['changed'] for result in results])
+    retvals['failed'] = len(failures) > 0
+    retvals['domains'] = results
+    if failures:
+        retvals['msg'] = "{0} of {1} domains could not be reconciled." . format(len(failures), len(results))
+
+    return(retvals)
+
+
+def domain_state(zone_id=None, zone_domain=None):
+    '''
+    The parts of the account a change plan depends on: the zone the
+    domain belongs in, and the domain as it exists (if it does).
+    '''
+    if zone_domain is not None:
+        zone_domain = project_fields(zone_domain, ['domain', 'zone_id'])
+
+    return(dict(zone_id=zone_id, domain=zone_domain))
+
+
+def plan_zone_domain(args=None, zone_id=None, zone_domain=None):
+    '''
+    Work out the API calls needed to reach the desired state, in the same
+    way as create_zone_domain and delete_zone_domain. Returns a list of
+    (api_method, payload) tuples.
+    '''
+    if args['state'] == 'present' and zone_domain is None:
+        return([('dns.zone_domain_create', dict(domain=args['domain'], zone_id=zone_id))])
+    if args['state'] == 'absent' and zone_domain is not None:
+        return([('dns.zone_domain_delete', dict(domain=args['domain']))])
+
+    return([])
+
+
+def plan_or_apply(args=None):
+    '''
+    With plan_file set, check mode writes the calls this run would make
+    to the file, and a normal run makes the calls in the file once it
+    has checked that the domain they were planned from hasn't changed.
+    '''
+    memset_api = None
+
+    if args['check_mode']:
+        retvals, zone_id = find_zone_id(args)
+        if retvals is not None:
+            return(retvals)
+
+        api_method = 'dns.zone_domain_list'
+        has_failed, msg, response = memset_api_call(api_key=args['api_key'], api_method=api_method,
+                                                    item_filter=lambda zone_domain: zone_domain['domain'] == args['domain'])
+        if has_failed:
+            return(dict(failed=has_failed, msg=msg))
+
+        zone_domain = AccountIndex(domains=response.json()).domain(args['domain'])
+        actions = plan_zone_domain(args=args, zone_id=zone_id, zone_domain=zone_domain)
+        plan = write_plan(args['plan_file'], 'memset_zone_domain', args, domain_state(zone_id, zone_domain), actions)
+
+        return(dict(changed=len(actions) > 0, failed=False,
+                    plan=dict(actions=plan['actions'], fingerprint=plan['fingerprint'])))
+
+    plan, msg = read_plan(args['plan_file'], 'memset_zone_domain', args)
+    if msg is not None:
+        return(dict(failed=True, msg=msg))
+
+    # domains are unique, so the one domain can be fetched on its own.
+    zone_domain = None
+    api_method = 'dns.zone_domain_info'
+    has_failed, msg, response = memset_api_call(api_key=args['api_key'], api_method=api_method, payload=dict(domain=args['domain']))
+    if not has_failed:
+        zone_domain = response.json()
+    elif response.status_code != 404:
+        return(dict(failed=has_failed, msg=msg))
+
+    has_failed, msg, responses = apply_plan(args['api_key'], plan, domain_state(plan['state']['zone_id'], zone_domain))
+
+    if not has_failed:
+        msg = None
+        if args['state'] == 'present':
+            # the domain as created, or as fetched above.
+            memset_api = responses[-1] if responses else zone_domain
+        elif responses:
+            memset_api = responses[-1]
+
+    retvals = dict(failed=has_failed, changed=len(responses) > 0,
+                   plan=dict(actions=plan['actions'], fingerprint=plan['fingerprint']))
+    for val in ['msg', 'memset_api']:
+        if eval(val) is not None:
+            retvals[val] = eval(val)
+
+    return(retvals)
+
+
 def main():
     global module
     module = AnsibleModule(
         argument_spec=dict(
             state=dict(default='present', choices=['present', 'absent'], type='str'),
             api_key=dict(required=True, type='str', no_log=True),
-            domain=dict(required=True, aliases=['name'], type='str'),
-            zone=dict(required=True, type='str')
+            domain=dict(required=False, aliases=['name'], type='str'),
+            zone=dict(required=False, type='str'),
+            plan_file=dict(required=False, type='path'),
+            domains=dict(required=False, type='list'),
+            max_concurrency=dict(required=False, default=4, type='int')
         ),
+        mutually_exclusive=[['domains', 'domain'], ['domains', 'plan_file']],
+        required_one_of=[['domains', 'domain']],
         supports_check_mode=True
     )
 
@@ -244,20 +646,17 @@ def main():
     # validate some API-specific limitations.
     api_validation(args=args)
 
-    if module.check_mode:
+    if args['domains'] is not None:
+        retvals = create_or_delete_domains(args)
+    elif args['plan_file'] is not None:
+        retvals = plan_or_apply(args)
+    elif module.check_mode:
         retvals = check(args)
     else:
         retvals = create_or_delete_domain(args)
 
-    # we would need to populate the return values with the API's response
-    # in several places so it's easier to do it at the end instead.
-    if not retvals['failed']:
-        if args['state'] == 'present' and not module.check_mode:
-            payload = dict()
-            payload['domain'] = args['domain']
-            api_method = 'dns.zone_domain_info'
-            _has_failed, _msg, response = memset_api_call(api_key=args['api_key'], api_method=api_method, payload=payload)
-            retvals['memset_api'] = response.json()
+    retvals['memset_api_retries'] = memset_api_retry_stats()
+    retvals['memset_api_stats'] = memset_api_stats()
 
     if retvals['failed']:
         module.fail_json(**retvals)
@@ -19,13 +19,26 @@ module: memset_zone_record
 author: "Simon Weald (@analbeard)"
 version_added: "2.6"
 short_description: Create and delete records in Memset DNS zones.
+extends_documentation_fragment:
+  - memset
+  - memset.plan
 notes:
   - Zones can be thought of as a logical group of domains, all of which share the
     same DNS records (i.e. they point to the same IP). An API key generated via the
     Memset customer control panel is needed with the following minimum scope -
     I(dns.zone_create), I(dns.zone_delete), I(dns.zone_list).
-  - Currently this module can only create one DNS record at a time. Multiple records
-    should be created using C(with_items).
+  - Multiple records should be managed with I(records) rather than C(with_items); the
+    zones and their records are then fetched once for the whole set instead of once per record.
+  - When the task runs on the controller (e.g. it is delegated to localhost) for many hosts, the
+    single records requested by every host in the batch are reconciled together in one run of
+    this module, with identical records only sent once; each host still gets its own result.
+    Hosts are collected until every host in the batch has arrived, as many hosts as there are
+    forks have arrived, or none has arrived for C(MEMSET_RECORD_AGGREGATE_WINDOW) seconds
+    (default 2). Setting it to 0 disables this. Each host's record is applied in order of host
+    name, as it would be without this, so the outcome doesn't depend on which hosts are run together.
+  - A plan made with I(plan_file) depends on the records in the zone with the same name and type;
+    applying it fetches them again with a single I(dns.zone_info) call rather than listing every
+    zone and record in the account. I(plan_file) can't be used with I(records).
 description:
     - Manage DNS records in a Memset account.
 options:
@@ -39,9 +52,9 @@ options:
         description:
             - The API key obtained from the Memset control panel.
     address:
-        required: true
         description:
             - The address for this record (can be IP or text string depending on record type).
+              Required unless I(records) is set.
         aliases: [ ip, data ]
     priority:
         description:
@@ -51,9 +64,8 @@ options:
         description:
             - The subdomain to create.
     type:
-        required: true
         description:
-            - The type of DNS record to create.
+            - The type of DNS record to create. Required unless I(records) is set.
         choices: [ A, AAAA, CNAME, MX, NS, SRV, TXT ]
     relative:
         type: bool
@@ -66,9 +78,51 @@ options:
               valid int from U(https://www.memset.com/apidocs/methods_dns.html#dns.zone_record_create).
         choices: [ 0, 300, 600, 900, 1800, 3600, 7200, 10800, 21600, 43200, 86400 ]
     zone:
-        required: true
         description:
-            - The name of the zone to which to add the record to.
+            - The name of the zone to which to add the record to. Required unless I(records) is set.
+    records:
+        type: list
+        version_added: "2.7"
+        description:
+            - A list of records to manage in a single run, which may span several zones. Each item
+              is a dict taking the I(zone), I(type), I(address), I(record), I(ttl), I(priority),
+              I(relative) and I(state) options; unset keys take the same defaults as the options
+              themselves, with I(state) defaulting to the module's I(state).
+            - Existing records are matched on zone, record and type as set by I(record_match), and only
+              records which differ from the desired state are changed. Identical items are treated as a
+              single record.
+            - Mutually exclusive with I(zone), I(type), I(address) and I(record).
+    max_concurrency:
+        type: int
+        default: 4
+        version_added: "2.7"
+        description:
+            - The maximum number of record changes to make at once when I(records) is set.
+    record_match:
+        default: address
+        version_added: "2.7"
+        description:
+            - How the items of I(records) are matched with existing records.
+            - C(address) matches each item with an existing record of the same zone, record and type,
+              preferring one with the same address, and matches each existing record with at most one
+              item.
+            - C(name) applies the items in order, each as a task managing that single record would;
+              every existing record of the same zone, record and type is changed to match the item, up
+              to the first which already does. Tasks for several hosts which are run together (see the
+              notes) are applied this way, in order of host name.
+        choices: [ address, name ]
+    fetch_strategy:
+        default: auto
+        version_added: "2.7"
+        description:
+            - How the existing records are fetched. C(zone_info) fetches each zone's records with
+              one I(dns.zone_info) call per zone, and C(record_list) fetches every record in the
+              account with a single I(dns.zone_record_list) call.
+            - C(auto) uses C(zone_info) when only one zone is managed, or when at most 32 zones and
+              a quarter of the account's zones are, and C(record_list) otherwise. With the response
+              cache enabled (C(MEMSET_CACHE_DIR)) C(auto) always uses C(record_list), which is the
+              one that can be cached.
+        choices: [ auto, zone_info, record_list ]
 '''
 
 EXAMPLES = '''
@@ -107,6 +161,38 @@ EXAMPLES = '''
   with_items:
     - { 'zone': 'domain1.com', 'type': 'A', 'record': 'www', 'address': '1.2.3.4' }
     - { 'zone': 'domain2.com', 'type': 'A', 'record': 'mail', 'address': '4.3.2.1' }
+
+# manage many records in one run
+- name: reconcile DNS records
+  memset_zone_record:
+    api_key: dcf089a2896940da9ffefb307ef49ccd
+    records:
+      - { 'zone': 'domain1.com', 'type': 'A', 'record': 'www', 'address': '1.2.3.4' }
+      - { 'zone': 'domain2.com', 'type': 'A', 'record': 'mail', 'address': '4.3.2.1' }
+      - { 'zone': 'domain2.com', 'type': 'A', 'record': 'old', 'address': '4.3.2.2', 'state': 'absent' }
+  delegate_to: localhost
+
+# plan a record change in check mode, then apply exactly that change later
+- name: plan DNS record change
+  memset_zone_record:
+    api_key: dcf089a2896940da9ffefb307ef49ccd
+    zone: domain.com
+    type: A
+    record: www
+    address: 1.2.3.5
+    plan_file: /tmp/memset-www.plan
+  check_mode: true
+  delegate_to: localhost
+
+- name: apply DNS record change
+  memset_zone_record:
+    api_key: dcf089a2896940da9ffefb307ef49ccd
+    zone: domain.com
+    type: A
+    record: www
+    address: 1.2.3.5
+    plan_file: /tmp/memset-www.plan
+  delegate_to: localhost
 '''
 
 RETURN = '''
@@ -155,12 +241,123 @@ memset_api:
       returned: always
       type: string
       sample: "b0bb1ce851aeea6feeb2dc32fe83bf9c"
+records:
+  description: Per-record results, in the same order as the I(records) option.
+  returned: when records is set
+  type: list
+  sample: [
+    {
+      "address": "1.2.3.4",
+      "changed": true,
+      "failed": false,
+      "memset_api": {
+        "address": "1.2.3.4",
+        "priority": 0,
+        "record": "www",
+        "relative": false,
+        "ttl": 0,
+        "type": "A",
+        "zone_id": "b0bb1ce851aeea6feeb2dc32fe83bf9c"
+      },
+      "record": "www",
+      "state": "present",
+      "type": "A",
+      "zone": "domain1.com"
+    }
+  ]
+plan:
+  description: The change plan written in check mode, or applied, when plan_file is set.
+  returned: when plan_file is set
+  type: complex
+  contains:
+    actions:
+      description: The planned API calls, in the order they are made.
+      returned: always
+      type: list
+      sample: [ { "method": "dns.zone_record_create", "payload": { "address": "1.2.3.4", "priority": 0, "record": "www",
+                "relative": false, "ttl": 0, "type": "A", "zone_id": "b0bb1ce851aeea6feeb2dc32fe83bf9c" } } ]
+    fingerprint:
+      description: Hash of the part of the account the plan was made from.
+      returned: always
+      type: string
+      sample: "9f2c1d0e5b7a4c3e8d6f1a2b3c4d5e6f7a8b9c0d1e2f3a4b5c6d7e8f9a0b1c2d"
+memset_api_retries:
+  description: API calls retried after transient failures during this task.
+  returned: always
+  type: complex
+  contains:
+    backoff_seconds:
+      description: Total time spent waiting between attempts.
+      returned: always
+      type: float
+      sample: 1.25
+    retries:
+      description: Number of retried API calls.
+      returned: always
+      type: int
+      sample: 2
+memset_api_stats:
+  description: The API calls made during this task, overall and per API method. Latencies are in seconds.
+  returned: always
+  type: complex
+  contains:
+    calls:
+      description: Number of API calls made.
+      returned: always
+      type: int
+      sample: 3
+    latency_total:
+      description: Total time spent waiting for the API.
+      returned: always
+      type: float
+      sample: 0.412
+    latency_p95:
+      description: 95th percentile latency of a single call.
+      returned: always
+      type: float
+      sample: 0.188
+    request_bytes:
+      description: Total size of the request bodies sent.
+      returned: always
+      type: int
+      sample: 180
+    response_bytes:
+      description: Total size of the response bodies received.
+      returned: always
+      type: int
+      sample: 5120
+    retries:
+      description: Number of retried API calls.
+      returned: always
+      type: int
+      sample: 0
+    methods:
+      description: The same figures for each API method called.
+      returned: always
+      type: dict
+      sample: { "dns.zone_list": { "calls": 1, "latency_p95": 0.188, "latency_total": 0.188,
+                "request_bytes": 40, "response_bytes": 5120, "retries": 0 } }
 '''
 
 from ansible.module_utils.basic import AnsibleModule
-from ansible.module_utils.memset import get_zone_id
+import ansible.module_utils.memset_broker  # noqa: F401 registers the broker with memset_api_call
+import ansible.module_utils.memset_single_flight  # noqa: F401 registers single-flight with memset_api_call
+import ansible.module_utils.memset_journal  # noqa: F401 registers the DNS journal with memset_api_call
+from ansible.module_utils.memset import AccountIndex
+from ansible.module_utils.memset import fetch_zone_records
 from ansible.module_utils.memset import memset_api_call
-from ansible.module_utils.memset import get_zone_id
+from ansible.module_utils.memset import memset_api_calls
+from ansible.module_utils.memset import memset_api_retry_stats
+from ansible.module_utils.memset import memset_api_stats
+from ansible.module_utils.memset import normalize_records
+from ansible.module_utils.memset import validate_record
+from ansible.module_utils.memset import FETCH_STRATEGIES, RECORD_TYPES, TTL_CHOICES
+from ansible.module_utils.memset_plan import apply_plan
+from ansible.module_utils.memset_plan import read_plan
+from ansible.module_utils.memset_plan import write_plan
+
+# keys accepted by each item of the records option, and their defaults.
+RECORD_DEFAULTS = dict(state=None, zone=None, type=None, address=None, record='', ttl=0, priority=0, relative=False)
 
 
 def api_validation(args=None):
@@ -168,28 +365,31 @@ def api_validation(args=None):
     Perform some validation which will be enforced by Memset's API (see:
     https://www.memset.com/apidocs/methods_dns.html#dns.zone_record_create)
     '''
-    failed_validation = False
-
-    # priority can only be integer 0 > 999
-    if not 0 <= args['priority'] <= 999:
-        failed_validation = True
-        error = 'Priority must be in the range 0 > 999 (inclusive).'
-    # data value must be max 250 chars
-    if len(args['address']) > 250:
-        failed_validation = True
-        error = "Address must be less than 250 characters in length."
-    # record value must be max 250 chars
-    if args['record']:
-        if len(args['record']) > 63:
-            failed_validation = True
-            error = "Record must be less than 63 characters in length."
-    # relative isn't used for all record types
-    if args['relative']:
-        if args['type'] not in ['CNAME', 'MX', 'NS', 'SRV']:
-            failed_validation = True
-            error = "Relative is only valid for CNAME, MX, NS and SRV record types."
+    if args['max_concurrency'] < 1:
+        module.fail_json(failed=True, msg='max_concurrency must be at least 1.')
+
+    if args['records'] is not None:
+        defaults = dict(RECORD_DEFAULTS, state=args['state'])
+        items = []
+        for item in args['records']:
+            # absent records are matched on zone, record and type alone.
+            if isinstance(item, dict) and item.get('state', args['state']) == 'absent':
+                if not [key for key in ['address', 'ip', 'data'] if key in item]:
+                    item = dict(item, address='')
+            items.append(item)
+        choices = dict(state=['present', 'absent'], type=RECORD_TYPES, ttl=TTL_CHOICES)
+        args['records'], errors = normalize_records(items, defaults=defaults, required=['zone', 'type', 'address'], choices=choices)
+        if errors:
+            module.fail_json(failed=True, msg=' ' . join(errors))
+        return
+
+    missing = [key for key in ['zone', 'type', 'address'] if args[key] is None]
+    if missing:
+        module.fail_json(failed=True, msg='missing required arguments: {0}' . format(', ' . join(missing)))
+
+    error = validate_record(args)
     # if any of the above failed then fail early
-    if failed_validation:
+    if error:
         module.fail_json(failed=True, msg=error)
 
 
@@ -281,19 +481,22 @@ def delete_zone_record(args=None, records=None, payload=None):
     return(has_changed, has_failed, memset_api, msg)
 
 
-def create_or_delete(args=None):
+def find_zone_records(args=None):
     '''
-    We need to perform some initial sanity checking and also look
-    up required info before handing it off to create or delete functions.
-    Check mode is integrated into the create or delete functions.
+    Look up the zone and its records with the requested name and type.
+    Returns the zone's id and the records, or the return values to fail
+    with if either can't be found.
     '''
-    has_failed, has_changed = False, False
-    msg, memset_api, stderr = None, None, None
-    retvals, payload = dict(), dict()
+    retvals = dict()
+    stderr = None
 
-    # get the zones and check if the relevant zone exists.
+    # get the zones and check if the relevant zone exists. Zones embed
+    # their records, so only the ids and names of the matching zones are
+    # kept as it is read.
     api_method = 'dns.zone_list'
-    _has_failed, msg, response = memset_api_call(api_key=args['api_key'], api_method=api_method)
+    _has_failed, msg, response = memset_api_call(api_key=args['api_key'], api_method=api_method,
+                                                 item_filter=lambda zone: zone['nickname'] == args['zone'],
+                                                 fields=['id', 'nickname'])
 
     if _has_failed:
         # this is the first time the API is called; incorrect credentials will
@@ -302,28 +505,49 @@ def create_or_delete(args=None):
         retvals['failed'] = _has_failed
         retvals['msg'] = msg
         retvals['stderr'] = "API returned an error: {0}" . format(response.status_code)
-        return(retvals)
+        return(retvals, None, None)
 
-    zone_exists, _msg, counter, zone_id = get_zone_id(zone_name=args['zone'], current_zones=response.json())
+    zone_exists, _msg, counter, zone_id = AccountIndex(zones=response.json()).get_zone_id(args['zone'])
 
     if not zone_exists:
-        has_failed = True
         if counter == 0:
             stderr = "DNS zone {0} does not exist." . format(args['zone'])
         elif counter > 1:
             stderr = "{0} matches multiple zones." . format(args['zone'])
-        retvals['failed'] = has_failed
+        retvals['failed'] = True
         retvals['msg'] = stderr
         retvals['stderr'] = stderr
-        return(retvals)
+        return(retvals, None, None)
+
+    # get the zone's records, keeping only the matching ones.
+    def matching(zone_record):
+        return(zone_record['record'] == args['record'] and zone_record['type'] == args['type'])
+
+    _has_failed, _msg, records = fetch_zone_records(args['api_key'], [zone_id], zone_count=response.item_count,
+                                                    strategy=args['fetch_strategy'], item_filter=matching)
+
+    if _has_failed:
+        retvals['failed'] = _has_failed
+        retvals['msg'] = _msg
+        return(retvals, None, None)
 
-    # get a list of all records ( as we can't limit records by zone)
-    api_method = 'dns.zone_record_list'
-    _has_failed, _msg, response = memset_api_call(api_key=args['api_key'], api_method=api_method)
+    return(None, zone_id, records)
 
-    # find any matching records
-    records = [record for record in response.json() if record['zone_id'] == zone_id
-               and record['record'] == args['record'] and record['type'] == args['type']]
+
+def create_or_delete(args=None):
+    '''
+    We need to perform some initial sanity checking and also look
+    up required info before handing it off to create or delete functions.
+    Check mode is integrated into the create or delete functions.
+    '''
+    has_failed, has_changed = False, False
+    msg, memset_api, stderr = None, None, None
+    payload = dict()
+
+    retvals, zone_id, records = find_zone_records(args)
+    if retvals is not None:
+        return(retvals)
+    retvals = dict()
 
     if args['state'] == 'present':
         has_changed, has_failed, memset_api, msg = create_zone_record(args=args, zone_id=zone_id, records=records, payload=payload)
@@ -340,20 +564,340 @@ def create_or_delete(args=None):
     return(retvals)
 
 
+def record_state(zone_id=None, records=None):
+    '''
+    The parts of the zone a change plan for a single record depends on:
+    the zone, and its records with the requested name and type.
+    '''
+    return(dict(zone_id=zone_id, records=sorted(records, key=lambda zone_record: zone_record['id'])))
+
+
+def plan_zone_record(args=None, zone_id=None, records=None):
+    '''
+    Work out the API calls needed to reach the desired state, in the same
+    way as create_zone_record and delete_zone_record. Returns a list of
+    (api_method, payload) tuples.
+    '''
+    actions = []
+
+    if args['state'] == 'absent':
+        for zone_record in records:
+            actions.append(('dns.zone_record_delete', dict(id=zone_record['id'])))
+        return(actions)
+
+    new_record = dict()
+    new_record['zone_id'] = zone_id
+    for arg in ['priority', 'address', 'relative', 'record', 'ttl', 'type']:
+        new_record[arg] = args[arg]
+
+    if not records:
+        return([('dns.zone_record_create', new_record)])
+
+    for zone_record in records:
+        new_record['id'] = zone_record['id']
+        if zone_record == new_record:
+            break
+        payload = zone_record.copy()
+        payload.update(new_record)
+        actions.append(('dns.zone_record_update', payload))
+
+    return(actions)
+
+
+def plan_or_apply(args=None):
+    '''
+    With plan_file set, check mode writes the calls this run would make
+    to the file, and a normal run makes the calls in the file once it
+    has checked that the records they were planned from haven't changed.
+    '''
+    retvals = dict()
+    memset_api = None
+
+    if args['check_mode']:
+        retvals, zone_id, records = find_zone_records(args)
+        if retvals is not None:
+            return(retvals)
+        retvals = dict(failed=False)
+
+        actions = plan_zone_record(args=args, zone_id=zone_id, records=records)
+        plan = write_plan(args['plan_file'], 'memset_zone_record', args, record_state(zone_id, records), actions)
+        retvals['changed'] = len(actions) > 0
+        retvals['plan'] = dict(actions=plan['actions'], fingerprint=plan['fingerprint'])
+        return(retvals)
+
+    plan, msg = read_plan(args['plan_file'], 'memset_zone_record', args)
+    if msg is not None:
+        retvals['failed'] = True
+        retvals['msg'] = msg
+        return(retvals)
+
+    # a single zone's records are far cheaper to fetch than every record
+    # in the account.
+    zone_id = plan['state']['zone_id']
+    records = []
+    has_failed, msg, response = memset_api_call(api_key=args['api_key'], api_method='dns.zone_info', payload=dict(id=zone_id))
+    if not has_failed:
+        records = [zone_record for zone_record in response.json()['records']
+                   if zone_record['record'] == args['record'] and zone_record['type'] == args['type']]
+    elif response.status_code != 404:
+        retvals['failed'] = has_failed
+        retvals['msg'] = msg
+        return(retvals)
+
+    has_failed, msg, responses = apply_plan(args['api_key'], plan, record_state(zone_id if not has_failed else None, records))
+
+    if not has_failed:
+        msg = None
+        if args['state'] == 'present':
+            # the record as returned by the last call, or the existing one
+            # if it was already correct.
+            memset_api = responses[-1] if responses else records[0]
+        elif records:
+            memset_api = records[-1]
+
+    retvals['failed'] = has_failed
+    retvals['changed'] = len(responses) > 0
+    retvals['plan'] = dict(actions=plan['actions'], fingerprint=plan['fingerprint'])
+    for val in ['msg', 'memset_api']:
+        if eval(val) is not None:
+            retvals[val] = eval(val)
+
+    return(retvals)
+
+
+def make_changes(args=None, changes=None):
+    '''
+    Make a list of (result, api_method, payload, memset_api) changes,
+    which are all independent of each other, so can be made concurrently.
+    Each change's result is updated with its outcome, and the API's
+    responses are returned in the same order.
+    '''
+    if args['check_mode']:
+        responses = [(False, None, None)] * len(changes)
+    else:
+        calls = [(api_method, payload) for _result, api_method, payload, _memset_api in changes]
+        responses = memset_api_calls(api_key=args['api_key'], calls=calls, max_concurrency=args['max_concurrency'])
+
+    for (result, _api_method, _payload, memset_api), (_has_failed, msg, _response) in zip(changes, responses):
+        if _has_failed:
+            result['failed'] = True
+            result['msg'] = msg
+            continue
+        result['changed'] = True
+        result['memset_api'] = memset_api
+
+    return(responses)
+
+
+def reconcile_by_address(args=None, index=None, pending=None):
+    '''
+    Match each item with an existing record of the same zone, record and
+    type, preferring one with the same address. Each existing record is
+    matched by at most one item, so several items (e.g. round-robin A
+    records) can share a name.
+    '''
+    changes = []
+
+    # ids of existing records which have already been matched, so that two
+    # desired records never claim the same one.
+    claimed = set()
+
+    for record, result, zone_id in pending:
+        matches = [zone_record for zone_record in index.records(zone_id, record['record'], record['type'])
+                   if zone_record['id'] not in claimed]
+
+        if record['state'] == 'absent':
+            for zone_record in matches:
+                claimed.add(zone_record['id'])
+                changes.append((result, 'dns.zone_record_delete', dict(id=zone_record['id']), zone_record))
+            continue
+
+        new_record = dict()
+        new_record['zone_id'] = zone_id
+        for arg in ['priority', 'address', 'relative', 'record', 'ttl', 'type']:
+            new_record[arg] = record[arg]
+
+        # prefer an existing record with the same address, otherwise update
+        # any unclaimed record with the same name and type.
+        exact = [zone_record for zone_record in matches if zone_record['address'] == record['address']]
+        if exact or matches:
+            zone_record = (exact or matches)[0]
+            claimed.add(zone_record['id'])
+            new_record['id'] = zone_record['id']
+            if zone_record == new_record:
+                result['memset_api'] = zone_record
+            else:
+                payload = zone_record.copy()
+                payload.update(new_record)
+                changes.append((result, 'dns.zone_record_update', payload, new_record))
+        else:
+            changes.append((result, 'dns.zone_record_create', new_record, new_record))
+
+    make_changes(args=args, changes=changes)
+
+
+def reconcile_by_name(args=None, index=None, pending=None):
+    '''
+    Apply each item as a single-record run of the module would (see
+    plan_zone_record), in order: every existing record with the same
+    zone, record and type is changed, up to the first which already
+    matches. Items for different records are made concurrently; an item
+    for the same record as an earlier one is made after it, and sees
+    its changes.
+    '''
+    rounds, depth = [], dict()
+    for record, result, zone_id in pending:
+        key = (zone_id, record['record'], record['type'])
+        depth[key] = depth.get(key, -1) + 1
+        if depth[key] == len(rounds):
+            rounds.append([])
+        rounds[depth[key]].append((record, result, zone_id))
+
+    for items in rounds:
+        changes, existing = [], []
+        for record, result, zone_id in items:
+            matches = index.records(zone_id, record['record'], record['type'])
+            by_id = dict([(zone_record['id'], zone_record) for zone_record in matches])
+            actions = plan_zone_record(args=record, zone_id=zone_id, records=matches)
+            if record['state'] == 'present' and len(actions) < len(matches):
+                # the record after the last update was already correct.
+                result['memset_api'] = matches[len(actions)]
+            for api_method, payload in actions:
+                memset_api = by_id[payload['id']] if api_method == 'dns.zone_record_delete' else payload
+                changes.append((result, api_method, payload, memset_api))
+                existing.append(by_id.get(payload.get('id')))
+
+        responses = make_changes(args=args, changes=changes)
+
+        # keep the index up to date for the items in the next round.
+        for (result, api_method, payload, memset_api), zone_record, (_has_failed, _msg, response) in zip(changes, existing, responses):
+            if _has_failed:
+                continue
+            if api_method == 'dns.zone_record_delete':
+                index.remove_record(zone_record)
+            elif api_method == 'dns.zone_record_update':
+                index.update_record(payload)
+            else:
+                created = response.json() if response is not None else None
+                if not isinstance(created, dict) or 'id' not in created:
+                    created = dict(payload, id=None)
+                index.add_record(created)
+
+
+def create_or_delete_records(args=None):
+    '''
+    Reconcile every item of the records option in one pass. The zone
+    and record lists are fetched once and indexed, then only the
+    mutations needed to reach the desired state are made. A failure for
+    one record does not stop the others from being processed.
+    '''
+    retvals, results = dict(), []
+
+    nicknames = set([record['zone'] for record in args['records']])
+    api_method = 'dns.zone_list'
+    _has_failed, msg, response = memset_api_call(api_key=args['api_key'], api_method=api_method,
+                                                 item_filter=lambda zone: zone['nickname'] in nicknames,
+                                                 fields=['id', 'nickname'])
+
+    if _has_failed:
+        # this is the first time the API is called; incorrect credentials will
+        # manifest themselves at this point so we need to ensure the user is
+        # informed of the reason.
+        retvals['failed'] = _has_failed
+        retvals['msg'] = msg
+        retvals['stderr'] = "API returned an error: {0}" . format(response.status_code)
+        return(retvals)
+
+    index = AccountIndex(zones=response.json())
+
+    # only records in the zones we're managing need to be kept.
+    zone_ids = set()
+    for record in args['records']:
+        zone_ids.update([zone['id'] for zone in index.zones(record['zone'])])
+
+    _has_failed, msg, records = fetch_zone_records(args['api_key'], zone_ids, zone_count=response.item_count,
+                                                   strategy=args['fetch_strategy'], max_concurrency=args['max_concurrency'])
+
+    if _has_failed:
+        retvals['failed'] = _has_failed
+        retvals['msg'] = msg
+        return(retvals)
+
+    # index the existing records so that each desired record is matched
+    # without scanning the whole account.
+    for zone_record in records:
+        index.add_record(zone_record)
+
+    # identical items describe the same record, so they share the first
+    # one's outcome rather than each claiming (or creating) a record.
+    first_results, duplicates, pending = dict(), [], []
+
+    for record in args['records']:
+        result = dict(changed=False, failed=False)
+        for key in ['zone', 'record', 'type', 'address', 'state']:
+            result[key] = record[key]
+        results.append(result)
+
+        identity = tuple(sorted(record.items()))
+        if identity in first_results:
+            duplicates.append((result, first_results[identity]))
+            continue
+        first_results[identity] = result
+
+        matching_zones = index.zones(record['zone'])
+        if len(matching_zones) != 1:
+            result['failed'] = True
+            if not matching_zones:
+                result['msg'] = "DNS zone {0} does not exist." . format(record['zone'])
+            else:
+                result['msg'] = "{0} matches multiple zones." . format(record['zone'])
+            continue
+
+        pending.append((record, result, matching_zones[0]['id']))
+
+    if args['record_match'] == 'name':
+        reconcile_by_name(args=args, index=index, pending=pending)
+    else:
+        reconcile_by_address(args=args, index=index, pending=pending)
+
+    for result, first_result in duplicates:
+        for key in ['changed', 'failed', 'msg', 'memset_api']:
+            if key in first_result:
+                result[key] = first_result[key]
+
+    failures = [result for result in results if result['failed']]
+
+    retvals['changed'] = any([result['changed'] for result in results])
+    retvals['failed'] = len(failures) > 0
+    retvals['records'] = results
+    if failures:
+        retvals['msg'] = "{0} of {1} records could not be reconciled." . format(len(failures), len(results))
+
+    return(retvals)
+
+
 def main():
     global module
     module = AnsibleModule(
         argument_spec=dict(
             state=dict(required=False, default='present', choices=['present', 'absent'], type='str'),
             api_key=dict(required=True, type='str', no_log=True),
-            zone=dict(required=True, type='str'),
-            type=dict(required=True, choices=['A', 'AAAA', 'CNAME', 'MX', 'NS', 'SRV', 'TXT'], type='str'),
-            address=dict(required=True, aliases=['ip', 'data'], type='str'),
+            zone=dict(required=False, type='str'),
+            type=dict(required=False, choices=RECORD_TYPES, type='str'),
+            address=dict(required=False, aliases=['ip', 'data'], type='str'),
             record=dict(required=False, default='', type='str'),
-            ttl=dict(required=False, default=0, choices=[0, 300, 600, 900, 1800, 3600, 7200, 10800, 21600, 43200, 86400], type='int'),
+            ttl=dict(required=False, default=0, choices=TTL_CHOICES, type='int'),
             priority=dict(required=False, default=0, type='int'),
-            relative=dict(required=False, default=False, type='bool')
+            relative=dict(required=False, default=False, type='bool'),
+            records=dict(required=False, type='list'),
+            max_concurrency=dict(required=False, default=4, type='int'),
+            record_match=dict(required=False, default='address', choices=['address', 'name'], type='str'),
+            plan_file=dict(required=False, type='path'),
+            fetch_strategy=dict(required=False, default='auto', choices=FETCH_STRATEGIES, type='str')
         ),
+        mutually_exclusive=[['records', 'zone'], ['records', 'type'], ['records', 'address'], ['records', 'record'],
+                            ['records', 'plan_file']],
+        required_one_of=[['records', 'zone']],
         supports_check_mode=True
     )
 
@@ -366,7 +910,15 @@ def main():
     # perform some Memset API-specific validation
     api_validation(args=args)
 
-    retvals = create_or_delete(args)
+    if args['records'] is not None:
+        retvals = create_or_delete_records(args)
+    elif args['plan_file'] is not None:
+        retvals = plan_or_apply(args)
+    else:
+        retvals = create_or_delete(args)
+
+    retvals['memset_api_retries'] = memset_api_retry_stats()
+    retvals['memset_api_stats'] = memset_api_stats()
 
     if retvals['failed']:
         module.fail_json(**retvals)
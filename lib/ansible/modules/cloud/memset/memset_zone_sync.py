@@ -0,0 +1,408 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2018, Simon Weald <ansible@simonweald.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+ANSIBLE_METADATA = {
+    'metadata_version': '1.1',
+    'status': ['preview'],
+    'supported_by': 'community'
+}
+
+DOCUMENTATION = '''
+---
+module: memset_zone_sync
+author: "Simon Weald (@analbeard)"
+version_added: "2.7"
+short_description: Make the records in a Memset DNS zone match a desired set.
+extends_documentation_fragment: memset
+notes:
+  - Records are matched on their name, type and address. Records which match but
+    have a different TTL, priority or relative setting are updated in place; when
+    I(purge) is set, a record which only differs by address is also updated in place
+    rather than being deleted and recreated.
+  - An API key generated via the Memset customer control panel is needed with the
+    following minimum scope - I(dns.zone_info), I(dns.zone_list), I(dns.zone_record_create),
+    I(dns.zone_record_delete), I(dns.zone_record_update).
+description:
+    - Manage the complete set of DNS records in a Memset zone in a single task.
+options:
+    api_key:
+        required: true
+        description:
+            - The API key obtained from the Memset control panel.
+    zone:
+        required: true
+        description:
+            - The name of the zone to synchronise (this must already exist and be unique).
+    records:
+        required: true
+        type: list
+        description:
+            - The desired records in the zone. Each item is a dict which takes the I(type),
+              I(address), I(record), I(ttl), I(priority) and I(relative) options of
+              M(memset_zone_record), with the same defaults.
+    purge:
+        default: false
+        type: bool
+        description:
+            - Delete any records in the zone which are not in I(records).
+    max_concurrency:
+        type: int
+        default: 4
+        description:
+            - The maximum number of record changes to make at once.
+'''
+
+EXAMPLES = '''
+- name: make example.com contain exactly these records
+  memset_zone_sync:
+    api_key: 5eb86c9196ab03919abcf03857163741
+    zone: example.com
+    purge: true
+    records:
+      - { type: A, address: 1.2.3.4 }
+      - { type: A, record: www, address: 1.2.3.4 }
+      - { type: MX, address: mail.example.com, priority: 10 }
+      - { type: TXT, address: "v=spf1 +a +mx ?all" }
+  delegate_to: localhost
+'''
+
+RETURN = '''
+memset_api:
+  description: Summary of the changes made to the zone.
+  returned: always
+  type: complex
+  contains:
+    created:
+      description: Records which were created.
+      returned: always
+      type: list
+      sample: [{ "address": "1.2.3.4", "priority": 0, "record": "www", "relative": false,
+                 "ttl": 0, "type": "A", "zone_id": "b0bb1ce851aeea6feeb2dc32fe83bf9c" }]
+    deleted:
+      description: Records which were deleted.
+      returned: always
+      type: list
+      sample: []
+    updated:
+      description: Records which were updated, as they are after the update.
+      returned: always
+      type: list
+      sample: []
+    unchanged:
+      description: Number of records which already matched.
+      returned: always
+      type: int
+      sample: 3
+memset_api_retries:
+  description: API calls retried after transient failures during this task.
+  returned: always
+  type: complex
+  contains:
+    backoff_seconds:
+      description: Total time spent waiting between attempts.
+      returned: always
+      type: float
+      sample: 1.25
+    retries:
+      description: Number of retried API calls.
+      returned: always
+      type: int
+      sample: 2
+memset_api_stats:
+  description: The API calls made during this task, overall and per API method. Latencies are in seconds.
+  returned: always
+  type: complex
+  contains:
+    calls:
+      description: Number of API calls made.
+      returned: always
+      type: int
+      sample: 3
+    latency_total:
+      description: Total time spent waiting for the API.
+      returned: always
+      type: float
+      sample: 0.412
+    latency_p95:
+      description: 95th percentile latency of a single call.
+      returned: always
+      type: float
+      sample: 0.188
+    request_bytes:
+      description: Total size of the request bodies sent.
+      returned: always
+      type: int
+      sample: 180
+    response_bytes:
+      description: Total size of the response bodies received.
+      returned: always
+      type: int
+      sample: 5120
+    retries:
+      description: Number of retried API calls.
+      returned: always
+      type: int
+      sample: 0
+    methods:
+      description: The same figures for each API method called.
+      returned: always
+      type: dict
+      sample: { "dns.zone_list": { "calls": 1, "latency_p95": 0.188, "latency_total": 0.188,
+                "request_bytes": 40, "response_bytes": 5120, "retries": 0 } }
+'''
+
+from ansible.module_utils.basic import AnsibleModule
+import ansible.module_utils.memset_broker  # noqa: F401 registers the broker with memset_api_call
+import ansible.module_utils.memset_single_flight  # noqa: F401 registers single-flight with memset_api_call
+import ansible.module_utils.memset_journal  # noqa: F401 registers the DNS journal with memset_api_call
+from ansible.module_utils.memset import AccountIndex
+from ansible.module_utils.memset import memset_api_call
+from ansible.module_utils.memset import memset_api_retry_stats
+from ansible.module_utils.memset import memset_api_stats
+from ansible.module_utils.memset import memset_api_calls
+from ansible.module_utils.memset import normalize_records
+from ansible.module_utils.memset import RECORD_TYPES, TTL_CHOICES
+
+# keys accepted by each item of the records option, and their defaults.
+RECORD_DEFAULTS = dict(type=None, address=None, record='', ttl=0, priority=0, relative=False)
+
+# fields which are compared for records whose (record, type, address) key matches.
+COMPARED_FIELDS = ['ttl', 'priority', 'relative']
+
+
+def api_validation(args=None):
+    '''
+    Perform some validation which will be enforced by Memset's API (see:
+    https://www.memset.com/apidocs/methods_dns.html#dns.zone_record_create)
+    '''
+    if args['max_concurrency'] < 1:
+        module.fail_json(failed=True, msg='max_concurrency must be at least 1.')
+
+    choices = dict(type=RECORD_TYPES, ttl=TTL_CHOICES)
+    args['records'], errors = normalize_records(args['records'], defaults=RECORD_DEFAULTS, required=['type', 'address'], choices=choices)
+
+    # the diff is keyed on (record, type, address), so each key may only appear once.
+    seen = set()
+    for record in args['records']:
+        key = (record['record'], record['type'], record['address'])
+        if key in seen:
+            errors.append("Duplicate record {0} {1} {2}." . format(record['record'] or '@', record['type'], record['address']))
+        seen.add(key)
+
+    if errors:
+        module.fail_json(failed=True, msg=' ' . join(errors))
+
+
+def get_zone_records(args=None, zone=None):
+    '''
+    dns.zone_list already embeds each zone's records, in which case they
+    are used as-is; otherwise the zone's records are fetched with
+    dns.zone_info, which is still far smaller than the account-wide
+    dns.zone_record_list.
+    '''
+    records = zone.get('records')
+    if records is not None and all([isinstance(record, dict) for record in records]):
+        return(False, None, records)
+
+    payload = dict()
+    payload['id'] = zone['id']
+    api_method = 'dns.zone_info'
+    has_failed, msg, response = memset_api_call(api_key=args['api_key'], api_method=api_method, payload=payload)
+    if has_failed:
+        return(has_failed, msg, None)
+
+    return(False, None, response.json()['records'])
+
+
+def diff_records(zone_id=None, desired=None, current=None, purge=False):
+    '''
+    Work out the creates, updates and deletes needed to make the current
+    records match the desired ones. Both sides are hashed on (record,
+    type, address) so the diff is linear in the size of the zone.
+    '''
+    creates, updates, deletes = [], [], []
+    unchanged = 0
+
+    live = dict()
+    for zone_record in current:
+        key = (zone_record['record'], zone_record['type'], zone_record['address'])
+        live.setdefault(key, []).append(zone_record)
+
+    unmatched = []
+    for record in desired:
+        new_record = dict()
+        new_record['zone_id'] = zone_id
+        for arg in ['priority', 'address', 'relative', 'record', 'ttl', 'type']:
+            new_record[arg] = record[arg]
+
+        matches = live.get((record['record'], record['type'], record['address']))
+        if not matches:
+            unmatched.append(new_record)
+            continue
+
+        zone_record = matches.pop(0)
+        if [field for field in COMPARED_FIELDS if zone_record[field] != new_record[field]]:
+            payload = zone_record.copy()
+            payload.update(new_record)
+            updates.append(payload)
+        else:
+            unchanged += 1
+
+    # anything left in the live index is not in the desired set.
+    leftovers = dict()
+    for matches in live.values():
+        for zone_record in matches:
+            leftovers.setdefault((zone_record['record'], zone_record['type']), []).append(zone_record)
+
+    for new_record in unmatched:
+        candidates = leftovers.get((new_record['record'], new_record['type']))
+        if purge and candidates:
+            # the old record would be deleted anyway, so change its address
+            # in place rather than making a delete and a create.
+            payload = candidates.pop().copy()
+            payload.update(new_record)
+            updates.append(payload)
+        else:
+            creates.append(new_record)
+
+    if purge:
+        for candidates in leftovers.values():
+            deletes.extend(candidates)
+
+    return(creates, updates, deletes, unchanged)
+
+
+def sync_zone(args=None):
+    '''
+    Look up the zone and its current records, diff them against the
+    desired set and make only the calls needed to reconcile the two.
+    '''
+    retvals = dict()
+    has_failed, has_changed = False, False
+    msg, stderr, memset_api = None, None, None
+
+    # only the zone being synced (and any others with its name) is kept,
+    # along with its embedded records.
+    api_method = 'dns.zone_list'
+    has_failed, msg, response = memset_api_call(api_key=args['api_key'], api_method=api_method,
+                                                item_filter=lambda zone: zone['nickname'] == args['zone'])
+
+    if has_failed:
+        # this is the first time the API is called; incorrect credentials will
+        # manifest themselves at this point so we need to ensure the user is
+        # informed of the reason.
+        retvals['failed'] = has_failed
+        retvals['msg'] = msg
+        retvals['stderr'] = "API returned an error: {0}" . format(response.status_code)
+        return(retvals)
+
+    index = AccountIndex(zones=response.json())
+    zone_exists, msg, counter, zone_id = index.get_zone_id(args['zone'])
+
+    if not zone_exists:
+        if counter == 0:
+            stderr = "DNS zone {0} does not exist." . format(args['zone'])
+        elif counter > 1:
+            stderr = "{0} matches multiple zones." . format(args['zone'])
+        retvals['failed'] = True
+        retvals['msg'] = stderr
+        retvals['stderr'] = stderr
+        return(retvals)
+
+    has_failed, msg, current = get_zone_records(args=args, zone=index.zone(zone_id))
+    if has_failed:
+        retvals['failed'] = has_failed
+        retvals['msg'] = msg
+        return(retvals)
+
+    creates, updates, deletes, unchanged = diff_records(zone_id=zone_id, desired=args['records'], current=current, purge=args['purge'])
+    memset_api = dict(created=[], updated=[], deleted=[], unchanged=unchanged)
+
+    changes = [('dns.zone_record_delete', 'deleted', zone_record) for zone_record in deletes]
+    changes.extend([('dns.zone_record_update', 'updated', payload) for payload in updates])
+    changes.extend([('dns.zone_record_create', 'created', new_record) for new_record in creates])
+
+    # every change touches a different record, so the changes in a phase
+    # can be made concurrently. The deletes are made first, so a record
+    # which replaces one of the same name (e.g. a CNAME replacing an A
+    # record) is never created while the old one still exists.
+    if args['check_mode']:
+        responses = [(False, None, None)] * len(changes)
+    else:
+        responses = []
+        for phase in [changes[:len(deletes)], changes[len(deletes):]]:
+            calls = []
+            for api_method, action, payload in phase:
+                if api_method == 'dns.zone_record_delete':
+                    payload = dict(id=payload['id'])
+                calls.append((api_method, payload))
+            if calls:
+                responses.extend(memset_api_calls(api_key=args['api_key'], calls=calls,
+                                                  max_concurrency=args['max_concurrency']))
+
+    errors = []
+    for (api_method, action, payload), (_has_failed, _msg, response) in zip(changes, responses):
+        if _has_failed:
+            errors.append(_msg)
+            continue
+        if _msg is not None and api_method != 'dns.zone_record_delete':
+            payload = _msg
+        has_changed = True
+        memset_api[action].append(payload)
+
+    if errors:
+        has_failed = True
+        msg = "{0} of {1} changes failed: {2}" . format(len(errors), len(changes), ' ' . join(errors))
+    else:
+        msg = None
+
+    retvals['failed'] = has_failed
+    retvals['changed'] = has_changed
+    for val in ['msg', 'stderr', 'memset_api']:
+        if val is not None:
+            retvals[val] = eval(val)
+
+    return(retvals)
+
+
+def main():
+    global module
+    module = AnsibleModule(
+        argument_spec=dict(
+            api_key=dict(required=True, type='str', no_log=True),
+            zone=dict(required=True, type='str'),
+            records=dict(required=True, type='list'),
+            purge=dict(required=False, default=False, type='bool'),
+            max_concurrency=dict(required=False, default=4, type='int')
+        ),
+        supports_check_mode=True
+    )
+
+    # populate the dict with the user-provided vars.
+    args = dict()
+    for key, arg in module.params.items():
+        args[key] = arg
+    args['check_mode'] = module.check_mode
+
+    # validate some API-specific limitations.
+    api_validation(args=args)
+
+    retvals = sync_zone(args)
+
+    retvals['memset_api_retries'] = memset_api_retry_stats()
+    retvals['memset_api_stats'] = memset_api_stats()
+
+    if retvals['failed']:
+        module.fail_json(**retvals)
+    else:
+        module.exit_json(**retvals)
+
+
+if __name__ == '__main__':
+    main()
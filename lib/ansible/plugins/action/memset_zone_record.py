@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2018, Simon Weald <ansible@simonweald.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+'''
+Aggregates memset_zone_record tasks across the hosts in a play batch.
+
+When every host registers its own record, running the module once per
+host costs two account-wide list calls per host. Instead, each host's
+worker writes its (already templated) record to a spool directory on
+the controller. The first worker to arrive for a task becomes the
+leader: it waits until every host in the batch which hasn't been served
+yet has arrived, as many hosts as there are forks have arrived (no more
+can), or no new host has arrived for a short window. It then runs the
+module once in records mode for all of them, and hands each host back
+its own result. The records are applied in order of host name, each as
+a single-record run of the module would apply it (record_match=name),
+so how the hosts fall into rounds doesn't change the outcome.
+
+Aggregation only applies to tasks which run on the controller (e.g.
+delegate_to: localhost) and manage a single record without a plan
+file. The window is set with the MEMSET_RECORD_AGGREGATE_WINDOW
+environment variable (seconds, default 2); setting it to 0 runs the
+module once per host as before.
+'''
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import fcntl
+import json
+import os
+import tempfile
+import time
+import uuid
+
+from ansible import constants as C
+from ansible.module_utils.memset import RECORD_TYPES, TTL_CHOICES, normalize_records
+from ansible.plugins.action import ActionBase
+
+RECORD_DEFAULTS = dict(state='present', zone=None, type=None, address=None, record='', ttl=0, priority=0, relative=False)
+
+# how often followers check for their result and the leader checks for
+# new arrivals, and how long a follower waits for the leader before
+# giving up and running the module itself.
+POLL_INTERVAL = 0.05
+LEADER_TIMEOUT = 600
+
+
+def aggregate_window():
+    try:
+        return(max(0.0, float(os.environ.get('MEMSET_RECORD_AGGREGATE_WINDOW', 2))))
+    except ValueError:
+        return(2.0)
+
+
+def play_forks():
+    '''
+    The number of workers running the task at once, which is the most
+    hosts which can ever arrive for a round.
+    '''
+    try:
+        from ansible import context
+        forks = context.CLIARGS.get('forks')
+    except ImportError:
+        forks = None
+    try:
+        return(max(1, int(forks or C.DEFAULT_FORKS)))
+    except (TypeError, ValueError):
+        return(1)
+
+
+def _write_json(path, data):
+    '''
+    Write to a temporary file and rename it into place so readers never
+    see a partial file. Files may contain API keys, so are private.
+    '''
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    os.rename(tmp_path, path)
+
+
+def _read_json(path, default=None):
+    try:
+        with open(path) as f:
+            return(json.load(f))
+    except (IOError, OSError, ValueError):
+        return(default)
+
+
+class Rendezvous(object):
+    '''
+    Collects requests from the workers running one task into rounds.
+    The first request of a round makes its worker the round's leader;
+    a round is closed by its leader, after which new requests start the
+    next round.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        if not os.path.isdir(path):
+            try:
+                os.makedirs(path, 0o700)
+            except OSError:
+                if not os.path.isdir(path):
+                    raise
+
+    def _locked(self, func):
+        with open(os.path.join(self.path, 'lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                return(func())
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _round_dir(self, round_id):
+        return(os.path.join(self.path, 'round-{0}' . format(round_id)))
+
+    def submit(self, host, request):
+        '''
+        Add a request to the open round, starting one if needed. Returns
+        the request's path and whether this worker leads the round.
+        '''
+        def submit():
+            state_path = os.path.join(self.path, 'state.json')
+            state = _read_json(state_path, dict(round=0, open=False))
+            leader = not state['open']
+            if leader:
+                state = dict(round=state['round'] + 1, open=True)
+                os.mkdir(self._round_dir(state['round']), 0o700)
+                _write_json(state_path, state)
+            request_path = os.path.join(self._round_dir(state['round']), '{0}.request' . format(uuid.uuid4().hex))
+            _write_json(request_path, dict(host=host, request=request))
+            return(request_path, leader)
+
+        return(self._locked(submit))
+
+    def requests(self, request_path):
+        round_dir = os.path.dirname(request_path)
+        requests = []
+        for entry in sorted(os.listdir(round_dir)):
+            if entry.endswith('.request'):
+                data = _read_json(os.path.join(round_dir, entry))
+                if data is not None:
+                    requests.append((os.path.join(round_dir, entry), data['host'], data['request']))
+        return(requests)
+
+    def served_hosts(self):
+        '''
+        The hosts whose requests were in earlier rounds.
+        '''
+        state = _read_json(os.path.join(self.path, 'state.json'), dict())
+        return(set(state.get('served', [])))
+
+    def close(self, request_path):
+        '''
+        Close the round and return its requests; anything submitted
+        before the round was closed belongs to it.
+        '''
+        def close():
+            state_path = os.path.join(self.path, 'state.json')
+            state = _read_json(state_path)
+            state['open'] = False
+            requests = self.requests(request_path)
+            state['served'] = sorted(set(state.get('served', [])) | set([host for _path, host, _request in requests]))
+            _write_json(state_path, state)
+            return(requests)
+
+        return(self._locked(close))
+
+    def gather(self, request_path, expected_hosts, window, max_requests=None):
+        '''
+        As the leader, wait until every expected host which wasn't in an
+        earlier round has submitted a request, max_requests requests have
+        arrived, or none has arrived for window seconds, then close the
+        round and return its requests.
+        '''
+        expected_hosts = set(expected_hosts) - self.served_hosts()
+        seen, last_arrival = 0, time.time()
+        while True:
+            requests = self.requests(request_path)
+            hosts = set([host for _path, host, _request in requests])
+            if len(requests) > seen:
+                seen, last_arrival = len(requests), time.time()
+            if expected_hosts.issubset(hosts) or (max_requests and len(requests) >= max_requests):
+                break
+            if time.time() - last_arrival >= window:
+                break
+            time.sleep(POLL_INTERVAL)
+
+        return(self.close(request_path))
+
+    def respond(self, request_path, result):
+        _write_json(request_path + '.result', result)
+        os.remove(request_path)
+
+    def wait(self, request_path, timeout):
+        '''
+        As a follower, wait for the leader's result for this request.
+        Returns None if it doesn't arrive in time.
+        '''
+        deadline = time.time() + timeout
+        result_path = request_path + '.result'
+        while time.time() < deadline:
+            result = _read_json(result_path)
+            if result is not None:
+                os.remove(result_path)
+                return(result)
+            time.sleep(POLL_INTERVAL)
+        return(None)
+
+
+class ActionModule(ActionBase):
+
+    def _record_request(self):
+        '''
+        Returns the task's record as an item of the module's records
+        option, or None if the task can't be aggregated.
+        '''
+        args = self._task.args
+        if args.get('records') is not None or args.get('plan_file') or not args.get('api_key'):
+            return(None)
+
+        item = dict([(key, value) for key, value in args.items() if key not in ['api_key', 'max_concurrency', 'fetch_strategy']])
+        # absent records are matched on zone, record and type alone.
+        if item.get('state', 'present') == 'absent' and not [key for key in ['address', 'ip', 'data'] if key in item]:
+            item['address'] = ''
+        choices = dict(state=['present', 'absent'], type=RECORD_TYPES, ttl=TTL_CHOICES)
+        records, errors = normalize_records([item], defaults=RECORD_DEFAULTS, required=['zone', 'type', 'address'], choices=choices)
+        if errors:
+            # let the module report the error for this host.
+            return(None)
+
+        return(dict(api_key=args['api_key'], max_concurrency=args.get('max_concurrency', 4),
+                    fetch_strategy=args.get('fetch_strategy', 'auto'), record=records[0]))
+
+    def _reconcile(self, requests, task_vars):
+        '''
+        Run the module once per API key for every request in the round,
+        with identical records only sent once. Returns a result per
+        request path.
+        '''
+        results = dict()
+        by_key = dict()
+        for request_path, host, request in sorted(requests, key=lambda request: (request[1], request[0])):
+            by_key.setdefault(request['api_key'], []).append((request_path, request))
+
+        for api_key, key_requests in by_key.items():
+            # identical records requested by several hosts are only sent once.
+            records, unique, position = [], dict(), dict()
+            for request_path, request in key_requests:
+                fingerprint = json.dumps(request['record'], sort_keys=True)
+                if fingerprint not in unique:
+                    unique[fingerprint] = len(records)
+                    records.append(request['record'])
+                position[request_path] = unique[fingerprint]
+
+            # hosts asking for different fetch strategies leave the choice to the module.
+            strategies = set([request['fetch_strategy'] for _path, request in key_requests])
+            module_args = dict(api_key=api_key, records=records, record_match='name',
+                               max_concurrency=max([int(request['max_concurrency']) for _path, request in key_requests]),
+                               fetch_strategy=strategies.pop() if len(strategies) == 1 else 'auto')
+            module_result = self._execute_module(module_name='memset_zone_record', module_args=module_args, task_vars=task_vars)
+
+            aggregate = dict(hosts=len(key_requests), records=len(records))
+            for request_path, request in key_requests:
+                result = dict(changed=False, failed=bool(module_result.get('failed')), memset_aggregate=aggregate)
+                for key in ['memset_api_retries', 'memset_api_stats']:
+                    if key in module_result:
+                        result[key] = module_result[key]
+                if 'records' in module_result:
+                    item = module_result['records'][position[request_path]]
+                    for key in ['changed', 'failed', 'msg', 'memset_api']:
+                        if key in item:
+                            result[key] = item[key]
+                else:
+                    # the run as a whole failed, e.g. because of a bad API key.
+                    for key in ['msg', 'stderr']:
+                        if key in module_result:
+                            result[key] = module_result[key]
+                results[request_path] = result
+
+        return(results)
+
+    def run(self, tmp=None, task_vars=None):
+        if task_vars is None:
+            task_vars = dict()
+
+        result = super(ActionModule, self).run(tmp, task_vars)
+        del tmp
+
+        window = aggregate_window()
+        request = self._record_request()
+        local = self._connection.transport == 'local'
+        if not window or request is None or not local:
+            result.update(self._execute_module(task_vars=task_vars))
+            return(result)
+
+        rendezvous = Rendezvous(os.path.join(C.DEFAULT_LOCAL_TMP, 'memset_zone_record', self._task._uuid))
+        request_path, leader = rendezvous.submit(task_vars.get('inventory_hostname'), request)
+
+        if leader:
+            expected_hosts = task_vars.get('ansible_play_batch') or [task_vars.get('inventory_hostname')]
+            requests = rendezvous.gather(request_path, expected_hosts, window, max_requests=play_forks())
+            try:
+                results = self._reconcile(requests, task_vars)
+            except Exception as e:
+                results = dict([(path, dict(failed=True, msg='Aggregated run failed: {0}' . format(e)))
+                                for path, _host, _request in requests])
+            own_result = results.pop(request_path)
+            os.remove(request_path)
+            for path, host_result in results.items():
+                rendezvous.respond(path, host_result)
+            result.update(own_result)
+            return(result)
+
+        own_result = rendezvous.wait(request_path, LEADER_TIMEOUT)
+        if own_result is None:
+            # the leader went away; fall back to running the module for this host.
+            own_result = self._execute_module(task_vars=task_vars)
+        result.update(own_result)
+        return(result)
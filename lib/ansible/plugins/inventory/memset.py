@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2018, Simon Weald <ansible@simonweald.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+DOCUMENTATION = '''
+    name: memset
+    plugin_type: inventory
+    author: "Simon Weald (@analbeard)"
+    version_added: "2.7"
+    short_description: Memset server inventory source
+    extends_documentation_fragment:
+      - constructed
+      - inventory_cache
+    description:
+      - Build an inventory of the servers in a Memset account from a single I(server.list) API call.
+      - Servers are grouped by type, network zone and status, and can also be grouped by
+        patterns matched against their names.
+      - Uses a YAML configuration file ending in C(memset.yml) or C(memset.yaml).
+      - With the inventory cache enabled, the server list is only fetched once per I(cache_timeout)
+        seconds, however many hosts and plays use it.
+      - An API key generated via the Memset customer control panel is needed with the
+        following minimum scope - I(server.list).
+    options:
+      plugin:
+        description: Token that ensures this is a source file for the plugin.
+        required: true
+        choices: ['memset']
+      api_key:
+        description: The API key obtained from the Memset control panel.
+        required: true
+        env:
+          - name: MEMSET_API_KEY
+      hostname:
+        description: The server field used as the inventory hostname.
+        default: name
+        choices: ['name', 'nickname', 'primary_ip']
+      group_prefix:
+        description: Prefix for the type, network zone and status groups.
+        default: memset_
+      name_groups:
+        description:
+          - Extra groups keyed by group name, each with a regular expression. A server is
+            added to the group if the pattern matches the start of its name or nickname.
+        type: dict
+        default: {}
+'''
+
+EXAMPLES = '''
+# memset.yml
+plugin: memset
+api_key: 5eb86c9196ab03919abcf03857163741
+hostname: nickname
+name_groups:
+  webservers: ^web
+  databases: ^db
+cache: true
+cache_plugin: jsonfile
+cache_connection: ~/.cache/ansible/memset
+cache_timeout: 300
+'''
+
+import re
+
+from ansible.errors import AnsibleError
+from ansible.module_utils.memset import memset_api_call
+from ansible.module_utils.six import iteritems
+from ansible.plugins.inventory import BaseInventoryPlugin, Cacheable, Constructable
+
+# the server fields kept from server.list and exposed as host variables.
+SERVER_FIELDS = ['name', 'nickname', 'type', 'status', 'primary_ip', 'network_zones', 'os', 'monitor',
+                 'firewall_rule_group']
+
+
+class InventoryModule(BaseInventoryPlugin, Constructable, Cacheable):
+
+    NAME = 'memset'
+
+    def verify_file(self, path):
+        '''
+        Only accept configuration files meant for this plugin.
+        '''
+        return(super(InventoryModule, self).verify_file(path) and path.endswith(('memset.yml', 'memset.yaml')))
+
+    def _get_servers(self):
+        has_failed, msg, response = memset_api_call(api_key=self.get_option('api_key'), api_method='server.list',
+                                                    fields=SERVER_FIELDS)
+        if has_failed:
+            raise AnsibleError(msg)
+        return(response.json())
+
+    def _add_group(self, group, host):
+        group = self._sanitize_group_name(group)
+        self.inventory.add_group(group)
+        self.inventory.add_child(group, host)
+
+    def _populate(self, servers):
+        prefix = self.get_option('group_prefix')
+        name_groups = [(group, re.compile(pattern)) for group, pattern in iteritems(self.get_option('name_groups'))]
+        strict = self.get_option('strict')
+
+        for server in servers:
+            host = server.get(self.get_option('hostname'))
+            if not host:
+                continue
+            self.inventory.add_host(host)
+            for key, value in iteritems(server):
+                self.inventory.set_variable(host, 'memset_{0}' . format(key), value)
+            if server.get('primary_ip'):
+                self.inventory.set_variable(host, 'ansible_host', server['primary_ip'])
+
+            if server.get('type'):
+                self._add_group('{0}type_{1}' . format(prefix, server['type']), host)
+            if server.get('status'):
+                self._add_group('{0}status_{1}' . format(prefix, server['status'].lower()), host)
+            for network_zone in server.get('network_zones') or []:
+                self._add_group('{0}zone_{1}' . format(prefix, network_zone), host)
+            for group, pattern in name_groups:
+                if pattern.match(server.get('name') or '') or pattern.match(server.get('nickname') or ''):
+                    self._add_group(group, host)
+
+            hostvars = self.inventory.get_host(host).get_vars()
+            self._set_composite_vars(self.get_option('compose'), hostvars, host, strict=strict)
+            self._add_host_to_composed_groups(self.get_option('groups'), hostvars, host, strict=strict)
+            self._add_host_to_keyed_groups(self.get_option('keyed_groups'), hostvars, host, strict=strict)
+
+    def parse(self, inventory, loader, path, cache=True):
+        super(InventoryModule, self).parse(inventory, loader, path)
+        self._read_config_data(path)
+
+        cache_key = self.get_cache_key(path)
+        # cache is the inventory manager's hint that the cache may be used,
+        # the cache option is whether the user has enabled it at all.
+        use_cache = self.get_option('cache') and cache
+        update_cache = self.get_option('cache') and not cache
+
+        servers = None
+        if use_cache:
+            try:
+                servers = self._cache[cache_key]
+            except KeyError:
+                update_cache = True
+
+        if servers is None:
+            servers = self._get_servers()
+
+        if update_cache:
+            self._cache[cache_key] = servers
+
+        self._populate(servers)
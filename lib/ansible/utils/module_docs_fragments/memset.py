@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2018, Simon Weald <ansible@simonweald.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+
+class ModuleDocFragment(object):
+
+    # Standard Memset documentation fragment
+    DOCUMENTATION = '''
+notes:
+  - List responses can be cached on the controller and shared between tasks by setting the
+    C(MEMSET_CACHE_DIR) environment variable, with C(MEMSET_CACHE_TTL) controlling how long
+    entries are kept in seconds (default 60). The cache for an API key is discarded whenever
+    a zone, domain or record is created, updated or deleted with that key.
+  - Transient API failures (HTTP 429 and 5xx responses, dropped connections) are retried with
+    exponential backoff, honouring any C(Retry-After) header. Calls which change state are only
+    retried when the API did not process them. The number of retries is set with the
+    C(MEMSET_API_RETRIES) environment variable (default 3).
+  - Every API call is timed and summarised in C(memset_api_stats). Setting the C(MEMSET_API_TRACE)
+    environment variable to a file path appends one JSON line per call to that file, with the API
+    method, status code, latency, request and response sizes, retries and whether the response
+    came from the cache. The API key is never written to the trace.
+  - Every zone, domain and record change is journaled on the host running the module, in
+    C(~/.ansible/memset/journal) or the directory set with the C(MEMSET_JOURNAL_DIR) environment
+    variable, so that M(memset_dns_reload) can skip or share reloads when nothing has changed.
+  - Identical list calls made at the same time by tasks on the same host (e.g. by many forks) can
+    share a single API call by setting the C(MEMSET_SINGLE_FLIGHT_DIR) environment variable to a
+    directory, in which the tasks coordinate through lock files.
+  - Setting the C(MEMSET_BROKER_SOCKET) environment variable to a socket path routes every API call
+    through a broker process on the host running the module, which keeps API connections open and
+    list responses in memory (for C(MEMSET_CACHE_TTL) seconds) between tasks. The broker is started by
+    the first task which needs it and exits after C(MEMSET_BROKER_IDLE_TIMEOUT) seconds without a call
+    (default 300). Calls are made directly if the broker can't be started.
+'''
+
+    # Plan and apply support for the DNS zone, domain and record modules
+    PLAN = '''
+options:
+    plan_file:
+        type: path
+        version_added: "2.7"
+        description:
+            - In check mode, write the API calls the module would make to this file, along with a
+              fingerprint of the part of the account they were worked out from.
+            - Otherwise, make the calls planned in this file instead of working them out again. Only the
+              part of the account the plan was made from is fetched again, and the plan is refused if
+              its fingerprint has changed or if it was made with different options or API key.
+'''
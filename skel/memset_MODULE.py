@@ -60,6 +60,8 @@ memset_api:
 '''
 
 from ansible.module_utils.basic import AnsibleModule
+import ansible.module_utils.memset_broker  # noqa: F401 registers the broker with memset_api_call
+import ansible.module_utils.memset_single_flight  # noqa: F401 registers single-flight with memset_api_call
 from ansible.module_utils.memset import memset_api_call
 
 
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2018, Simon Weald <ansible@simonweald.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+'''
+Micro-benchmark zone and record lookups on synthetic accounts of growing
+size, comparing a linear scan of the list responses with AccountIndex.
+
+    python test/benchmarks/bench_account_index.py [--sizes N [N ...]]
+'''
+
+from __future__ import (absolute_import, division, print_function)
+
+import argparse
+import random
+import timeit
+
+from ansible.module_utils.memset import AccountIndex
+
+RECORDS_PER_ZONE = 20
+
+
+def make_account(record_count):
+    zones, records = [], []
+    for zone_idx in range(max(1, record_count // RECORDS_PER_ZONE)):
+        zones.append(dict(id='zone{0}' . format(zone_idx), nickname='zone{0}.example.com' . format(zone_idx),
+                          ttl=0, domains=[], records=[]))
+    for idx in range(record_count):
+        zone = zones[idx % len(zones)]
+        records.append(dict(id='record{0}' . format(idx), zone_id=zone['id'], record='host{0}' . format(idx),
+                            type='A', address='192.0.2.1', ttl=0, priority=0, relative=False))
+    return(zones, records)
+
+
+def linear_lookup(zones, records, nickname, record):
+    zone_id = [zone['id'] for zone in zones if zone['nickname'] == nickname][0]
+    return([r for r in records if r['zone_id'] == zone_id and r['record'] == record and r['type'] == 'A'])
+
+
+def indexed_lookup(index, nickname, record):
+    zone_id = index.zones(nickname)[0]['id']
+    return(index.records(zone_id, record, 'A'))
+
+
+def per_call_us(func, number):
+    return(min(timeit.repeat(func, number=number, repeat=3)) / number * 1e6)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    opts = parser.parse_args()
+
+    print('{0:>10} {1:>12} {2:>18} {3:>18}' . format('records', 'build ms', 'linear us/lookup', 'index us/lookup'))
+    for size in opts.sizes:
+        zones, records = make_account(size)
+        targets = [random.choice(records) for _ in range(100)]
+        lookups = [('{0}.example.com' . format(target['zone_id']), target['record']) for target in targets]
+
+        build = min(timeit.repeat(lambda: AccountIndex(zones=zones, records=records), number=1, repeat=3)) * 1000
+        index = AccountIndex(zones=zones, records=records)
+
+        def linear():
+            for nickname, record in lookups:
+                linear_lookup(zones, records, nickname, record)
+
+        def indexed():
+            for nickname, record in lookups:
+                indexed_lookup(index, nickname, record)
+
+        linear_us = per_call_us(linear, 1) / len(lookups)
+        index_us = per_call_us(indexed, 100) / len(lookups)
+        print('{0:>10} {1:>12.1f} {2:>18.1f} {3:>18.3f}' . format(size, build, linear_us, index_us))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2018, Simon Weald <ansible@simonweald.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+'''
+Measure record mutation throughput with different max_concurrency values,
+by syncing a batch of new records into an empty zone on a local stand-in
+for the Memset API which adds a fixed latency to every call.
+
+    python test/benchmarks/bench_concurrency.py [--records N] [--latency SECONDS]
+'''
+
+from __future__ import (absolute_import, division, print_function)
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from memset_standin import MemsetStandin, VALID_API_KEY  # noqa: E402
+
+from ansible.module_utils import memset  # noqa: E402
+from ansible.modules.cloud.memset import memset_zone_sync  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--records', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    opts = parser.parse_args()
+
+    records = [dict(type='A', record='host{0}' . format(idx), address='192.0.2.{0}' . format(idx % 250))
+               for idx in range(opts.records)]
+
+    print('{0:>16} {1:>10} {2:>10} {3:>16}' . format('max_concurrency', 'changes', 'seconds', 'changes/second'))
+    for max_concurrency in opts.concurrency:
+        with MemsetStandin(latency=opts.latency) as standin:
+            standin.account.add_zone('example.com')
+            memset.MEMSET_API_URL = standin.url
+
+            args = dict(api_key=VALID_API_KEY, zone='example.com', records=list(records), purge=False,
+                        max_concurrency=max_concurrency, check_mode=False)
+            memset_zone_sync.api_validation(args=args)
+
+            start = time.time()
+            retvals = memset_zone_sync.sync_zone(args)
+            elapsed = time.time() - start
+
+            changes = len(retvals['memset_api']['created'])
+            if retvals['failed'] or changes != opts.records:
+                sys.exit('sync failed: {0}' . format(retvals.get('msg')))
+            print('{0:>16} {1:>10} {2:>10.2f} {3:>16.1f}' . format(max_concurrency, changes, elapsed, changes / elapsed))
+
+        memset.close_connection_pools()
+
+
+if __name__ == '__main__':
+    main()
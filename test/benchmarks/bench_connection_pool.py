@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2018, Simon Weald <ansible@simonweald.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+'''
+Compare TLS handshakes and wall time per module run with the previous
+open_url transport (one connection per call) and the pooled keep-alive
+transport, against a local HTTPS stand-in for the Memset API.
+
+    python test/benchmarks/bench_connection_pool.py [--runs N]
+'''
+
+from __future__ import (absolute_import, division, print_function)
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from memset_standin import MemsetStandin, VALID_API_KEY, make_self_signed_cert  # noqa: E402
+
+from ansible.module_utils import memset  # noqa: E402
+from ansible.modules.cloud.memset import memset_zone, memset_zone_record  # noqa: E402
+
+
+SCENARIOS = [
+    ('memset_zone present', memset_zone.create_or_delete,
+     dict(state='present', api_key=VALID_API_KEY, name='example.com', ttl=300, force=False, check_mode=False)),
+    ('memset_zone_record present', memset_zone_record.create_or_delete,
+     dict(state='present', api_key=VALID_API_KEY, zone='example.com', type='A', record='www',
+          address='192.0.2.1', ttl=0, priority=0, relative=False, check_mode=False)),
+]
+
+TRANSPORTS = [
+    ('open_url', memset._open_url_request),
+    ('keep-alive pool', memset._keepalive_request),
+]
+
+
+def run_scenario(standin, func, args, runs):
+    handshakes, elapsed = 0, 0.0
+    for _ in range(runs):
+        standin.reset_counters()
+        start = time.time()
+        func(dict(args))
+        elapsed += time.time() - start
+        handshakes += standin.connections
+        # every module run is a fresh process, so nothing survives between runs.
+        memset.close_connection_pools()
+    return(handshakes / runs, elapsed / runs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=50)
+    opts = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        certfile, keyfile = make_self_signed_cert(tmpdir)
+        os.environ['SSL_CERT_FILE'] = certfile
+
+        standin = MemsetStandin(certfile=certfile, keyfile=keyfile)
+        zone = standin.account.add_zone('example.com', ttl=300)
+        standin.account.add_record(zone['id'], record='www', address='192.0.2.1')
+
+        with standin:
+            memset.MEMSET_API_URL = standin.url
+            print('{0:<28} {1:<16} {2:>12} {3:>14}' . format('scenario', 'transport', 'handshakes', 'ms per run'))
+            for name, func, args in SCENARIOS:
+                for transport_name, transport in TRANSPORTS:
+                    memset._api_request = transport
+                    handshakes, elapsed = run_scenario(standin, func, args, opts.runs)
+                    print('{0:<28} {1:<16} {2:>12.1f} {3:>14.2f}' . format(name, transport_name, handshakes, elapsed * 1000))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
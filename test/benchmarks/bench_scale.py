@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2018, Simon Weald <ansible@simonweald.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+'''
+Run each memset module against synthetic accounts of growing size on the
+local stand-in, reporting API calls, wall time and peak RSS per scenario.
+
+    python test/benchmarks/bench_scale.py [--sizes N [N ...]] [--latency SECONDS]
+                                          [--error-rate RATE] [--json FILE]
+
+Every scenario runs the module in a fresh Python process, as Ansible
+would, so the peak RSS is that of the module alone.
+'''
+
+from __future__ import (absolute_import, division, print_function)
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from memset_standin import MemsetStandin, VALID_API_KEY, synthetic_account  # noqa: E402
+
+# runs a module with its arguments file against the stand-in's URL.
+RUNNER = '''
+import runpy, sys
+from ansible.module_utils import memset
+memset.MEMSET_API_URL = sys.argv[1]
+sys.argv = sys.argv[2:]
+runpy.run_module(sys.argv[0], run_name='__main__', alter_sys=True)
+'''
+
+# a forked child's peak RSS includes whatever it inherited from its parent
+# before exec, so modules are launched from a small process started before
+# any accounts are built. It reads [argv, stdout path] lines and answers
+# with [exit code, peak RSS in KB].
+SPAWNER = '''
+import json, os, subprocess, sys
+for line in sys.stdin:
+    argv, stdout_path = json.loads(line)
+    with open(stdout_path, 'wb') as stdout:
+        proc = subprocess.Popen(argv, stdout=stdout, stderr=subprocess.DEVNULL)
+        _pid, status, rusage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+    print(json.dumps([proc.returncode, rusage.ru_maxrss]), flush=True)
+'''
+
+
+def scenarios(account):
+    '''
+    Returns (name, module, params) for each scenario. Zone 0 always exists
+    in a synthetic account, so every scenario targets it.
+    '''
+    zone_id = [zone['id'] for zone in account.zones.values() if zone['nickname'] == 'zone0.example.com'][0]
+    current = [account.records[record_id] for record_id in account.zone_records[zone_id]]
+    host = sorted(current, key=lambda record: record['record'])[0]
+    bulk = [dict(zone='zone0.example.com', type='A', record='bulk{0}' . format(idx), address='192.0.2.250')
+            for idx in range(10)]
+    sync = [dict(type=record['type'], record=record['record'], address=record['address']) for record in current]
+
+    return([
+        ('memset_zone unchanged', 'memset_zone', dict(state='present', name='zone0.example.com', ttl=0)),
+        ('memset_zone_domain unchanged', 'memset_zone_domain',
+         dict(state='present', zone='zone0.example.com', domain='zone0.example.com')),
+        ('memset_zone_record create', 'memset_zone_record',
+         dict(zone='zone0.example.com', type='A', record='new', address='192.0.2.250')),
+        ('memset_zone_record unchanged', 'memset_zone_record',
+         dict(zone='zone0.example.com', type='A', record=host['record'], address=host['address'])),
+        ('memset_zone_record bulk x10', 'memset_zone_record', dict(records=bulk)),
+        ('memset_zone_sync unchanged', 'memset_zone_sync', dict(zone='zone0.example.com', records=sync)),
+        ('memset_dns_reload poll', 'memset_dns_reload', dict(poll=True)),
+    ])
+
+
+def run_module(spawner, standin, module, params, tmpdir):
+    '''
+    Run the module in a child process and return its result, the wall
+    time and the child's peak RSS in MB.
+    '''
+    params = dict(params, api_key=VALID_API_KEY)
+    args_path = os.path.join(tmpdir, 'args.json')
+    stdout_path = os.path.join(tmpdir, 'stdout.json')
+    with open(args_path, 'w') as f:
+        json.dump(dict(ANSIBLE_MODULE_ARGS=params), f)
+
+    argv = [sys.executable, '-c', RUNNER, standin.url, 'ansible.modules.cloud.memset.{0}' . format(module), args_path]
+    start = time.time()
+    spawner.stdin.write(json.dumps([argv, stdout_path]) + '\n')
+    spawner.stdin.flush()
+    returncode, max_rss = json.loads(spawner.stdout.readline())
+    elapsed = time.time() - start
+
+    try:
+        with open(stdout_path) as f:
+            result = json.load(f)
+    except ValueError:
+        result = dict(failed=True, msg='module produced no JSON (exit code {0})' . format(returncode))
+
+    # ru_maxrss is in kilobytes on Linux.
+    return(result, elapsed, max_rss / 1024.0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 1000, 100000])
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='probability of an injected 503 on each call')
+    parser.add_argument('--json', help='also write the results to this file')
+    opts = parser.parse_args()
+
+    results = []
+    tmpdir = tempfile.mkdtemp()
+    # keep the DNS journal out of the user's home directory, and share
+    # identical list calls between the forks.
+    env = dict(os.environ, MEMSET_JOURNAL_DIR=os.path.join(tmpdir, 'journal'),
+               MEMSET_SINGLE_FLIGHT_DIR=os.path.join(tmpdir, 'flight'))
+    spawner = subprocess.Popen([sys.executable, '-c', SPAWNER], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                               universal_newlines=True, env=env)
+    print('{0:>8} {1:<32} {2:>6} {3:>10} {4:>10} {5:>7}' . format('records', 'scenario', 'calls', 'seconds', 'peak MB', 'result'))
+    for size in opts.sizes:
+        account = synthetic_account(size)
+        with MemsetStandin(account=account, latency=opts.latency, seed=size) as standin:
+            if opts.error_rate:
+                standin.inject_fault('*', count=None, rate=opts.error_rate)
+            for name, module, params in scenarios(account):
+                standin.reset_counters()
+                result, elapsed, peak_rss = run_module(spawner, standin, module, params, tmpdir)
+                calls = sum(standin.calls.values())
+                outcome = 'failed' if result.get('failed') else ('changed' if result.get('changed') else 'ok')
+                print('{0:>8} {1:<32} {2:>6} {3:>10.3f} {4:>10.1f} {5:>7}' . format(size, name, calls, elapsed, peak_rss, outcome))
+                results.append(dict(records=size, scenario=name, calls=calls, seconds=round(elapsed, 3),
+                                    peak_rss_mb=round(peak_rss, 1), result=outcome))
+
+    spawner.stdin.close()
+    spawner.wait()
+    shutil.rmtree(tmpdir)
+
+    if opts.json:
+        with open(opts.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
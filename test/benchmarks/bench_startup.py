@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2018, Simon Weald <ansible@simonweald.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+'''
+Measure how long each memset module takes to import and to run up to
+its first API call, in a fresh Python process as Ansible would run it.
+
+    python test/benchmarks/bench_startup.py [--runs N] [--json FILE]
+
+Each module is run with no arguments, so it fails argument validation
+before calling the API. The import time includes the time taken to
+import module_utils (ansible.module_utils.basic among them); the number
+of modules loaded, whether the HTTP transport was imported and which of
+the optional memset module_utils were loaded are also reported.
+'''
+
+from __future__ import (absolute_import, division, print_function)
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+MODULE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'lib', 'ansible', 'modules', 'cloud',
+                          'memset')
+
+# modules which make up the HTTP transport, and are only needed once a
+# module calls the API.
+TRANSPORT_MODULES = ['ansible.module_utils.urls', 'http.client', 'httplib', 'ssl']
+
+# module_utils which only the modules using them import, and so ship.
+OPTIONAL_MODULES = ['broker', 'journal', 'plan', 'single_flight']
+
+# imports the module and runs its main() with the given arguments,
+# printing the timings as JSON on stderr.
+RUNNER = '''
+import contextlib, io, json, sys, time
+start = time.time()
+baseline = len(sys.modules)
+module = __import__(sys.argv[1], fromlist=['main'])
+imported = time.time()
+loaded = sorted(sys.modules)
+from ansible.module_utils import basic
+basic._ANSIBLE_ARGS = json.dumps(dict(ANSIBLE_MODULE_ARGS=json.loads(sys.argv[2]))).encode('utf-8')
+try:
+    module.main()
+except SystemExit:
+    pass
+finished = time.time()
+sys.stderr.write(json.dumps(dict(import_seconds=imported - start, execute_seconds=finished - imported,
+                                 modules=len(loaded) - baseline, loaded=loaded)))
+'''
+
+
+def run_module(module, params):
+    proc = subprocess.Popen([sys.executable, '-c', RUNNER, 'ansible.modules.cloud.memset.{0}' . format(module),
+                             json.dumps(params)], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    _stdout, stderr = proc.communicate()
+    return(json.loads(stderr.decode('utf-8').strip().splitlines()[-1]))
+
+
+def median(values):
+    values = sorted(values)
+    return(values[len(values) // 2])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--json', help='also write the results to this file')
+    opts = parser.parse_args()
+
+    modules = sorted([entry[:-3] for entry in os.listdir(MODULE_DIR) if entry.startswith('memset_') and entry.endswith('.py')])
+    results = []
+    print('{0:<28} {1:>10} {2:>11} {3:>8} {4:>10}  {5}' . format('module', 'import ms', 'execute ms', 'modules', 'transport',
+                                                                'optional'))
+    for module in modules:
+        runs = [run_module(module, dict()) for _ in range(opts.runs)]
+        import_ms = median([run['import_seconds'] for run in runs]) * 1000
+        execute_ms = median([run['execute_seconds'] for run in runs]) * 1000
+        transport = [name for name in TRANSPORT_MODULES if name in runs[0]['loaded']]
+        optional = [name for name in OPTIONAL_MODULES if 'ansible.module_utils.memset_' + name in runs[0]['loaded']]
+        print('{0:<28} {1:>10.1f} {2:>11.1f} {3:>8} {4:>10}  {5}' . format(module, import_ms, execute_ms, runs[0]['modules'],
+                                                                        'yes' if transport else 'no', ' ' . join(optional)))
+        results.append(dict(module=module, import_ms=round(import_ms, 1), execute_ms=round(execute_ms, 1),
+                            modules=runs[0]['modules'], transport=transport, optional=optional))
+
+    if opts.json:
+        with open(opts.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
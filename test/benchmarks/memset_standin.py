@@ -0,0 +1,474 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2018, Simon Weald <ansible@simonweald.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+'''
+A local stand-in for the Memset API, used to benchmark the memset modules
+without a real account. It speaks the same form-encoded POST / JSON
+response protocol as https://api.memset.com/v1/json/ for the dns.*,
+job.status, server.list and apikey.* methods the modules use, and keeps
+its state in memory.
+
+Latency can be added to every call (or per method), errors can be
+injected per method, and synthetic_account() builds accounts of any size
+for scale testing.
+'''
+
+from __future__ import (absolute_import, division, print_function)
+
+import json
+import random
+import ssl
+import subprocess
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+try:
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import parse_qsl
+except ImportError:
+    raise ImportError('The Memset stand-in requires Python 3.7 or later.')
+
+VALID_API_KEY = '5eb86c9196ab03919abcf03857163741'
+
+RECORDS_PER_ZONE = 20
+SERVER_TYPES = ['dedicated', 'miniserver', 'vps']
+NETWORK_ZONES = ['reading', 'dunsdon']
+
+
+class ApiError(Exception):
+
+    def __init__(self, status, error_type, error, body=None):
+        super(ApiError, self).__init__(error)
+        self.status = status
+        self.error_type = error_type
+        self.error = error
+        self.body = body
+
+
+def _new_id():
+    return(uuid.uuid4().hex)
+
+
+class MemsetAccount(object):
+    '''
+    In-memory DNS, server and job state for a single account. Domains and
+    records are also indexed by zone so that zone lookups stay cheap on
+    accounts with hundreds of thousands of records.
+    '''
+
+    def __init__(self):
+        self.zones = dict()
+        self.domains = dict()
+        self.records = dict()
+        self.servers = dict()
+        self.jobs = dict()
+        self.zone_domains = defaultdict(set)
+        self.zone_records = defaultdict(set)
+        self.job_duration = 0.0
+        self.lock = threading.Lock()
+
+    def add_zone(self, nickname, ttl=0):
+        zone = dict(id=_new_id(), nickname=nickname, ttl=ttl)
+        self.zones[zone['id']] = zone
+        return(zone)
+
+    def add_domain(self, zone_id, domain):
+        self.domains[domain] = dict(domain=domain, zone_id=zone_id)
+        self.zone_domains[zone_id].add(domain)
+        return(self.domains[domain])
+
+    def remove_domain(self, domain):
+        zone_domain = self.domains.pop(domain)
+        self.zone_domains[zone_domain['zone_id']].discard(domain)
+
+    def add_record(self, zone_id, record='', type='A', address='127.0.0.1', ttl=0, priority=0, relative=False):
+        new = dict(id=_new_id(), zone_id=zone_id, record=record, type=type, address=address,
+                   ttl=ttl, priority=priority, relative=relative)
+        self.records[new['id']] = new
+        self.zone_records[zone_id].add(new['id'])
+        return(new)
+
+    def update_record(self, zone_record):
+        old = self.records[zone_record['id']]
+        self.zone_records[old['zone_id']].discard(old['id'])
+        self.records[zone_record['id']] = zone_record
+        self.zone_records[zone_record['zone_id']].add(zone_record['id'])
+
+    def remove_record(self, record_id):
+        zone_record = self.records.pop(record_id)
+        self.zone_records[zone_record['zone_id']].discard(record_id)
+
+    def add_server(self, name, type='miniserver', status='LIVE', network_zones=None, nickname='', primary_ip='192.0.2.1'):
+        server = dict(name=name, nickname=nickname, type=type, status=status, primary_ip=primary_ip,
+                      network_zones=network_zones or ['reading'], os='debian_9_64', monitor=True,
+                      firewall_rule_group=dict(nickname='default'))
+        self.servers[name] = server
+        return(server)
+
+    def zone_info(self, zone_id):
+        if zone_id not in self.zones:
+            raise ApiError(404, 'ApiErrorDoesNotExist', 'Zone does not exist')
+        zone = dict(self.zones[zone_id])
+        zone['domains'] = [dict(self.domains[d]) for d in self.zone_domains[zone_id]]
+        zone['records'] = [dict(self.records[r]) for r in self.zone_records[zone_id]]
+        return(zone)
+
+    def new_job(self, job_type):
+        job = dict(id=_new_id(), type=job_type, status='PENDING', finished=False, error=False)
+        self.jobs[job['id']] = (job, time.time() + self.job_duration)
+        return(dict(job))
+
+    def job_status(self, job_id):
+        if job_id not in self.jobs:
+            raise ApiError(404, 'ApiErrorDoesNotExist', 'Job does not exist')
+        job, done_at = self.jobs[job_id]
+        if time.time() >= done_at:
+            job.update(status='DONE', finished=True)
+        return(dict(job))
+
+
+def synthetic_account(records, servers=0, records_per_zone=RECORDS_PER_ZONE):
+    '''
+    Build an account with the given number of records spread over zones
+    of records_per_zone records each, one domain per zone, and the given
+    number of servers. Zones are named zone<N>.example.com and records
+    host<N>, so scenarios can target them predictably.
+    '''
+    account = MemsetAccount()
+    zone_ids = []
+    for idx in range(max(1, -(-records // records_per_zone))):
+        zone = account.add_zone('zone{0}.example.com' . format(idx))
+        account.add_domain(zone['id'], 'zone{0}.example.com' . format(idx))
+        zone_ids.append(zone['id'])
+    for idx in range(records):
+        account.add_record(zone_ids[idx // records_per_zone], record='host{0}' . format(idx),
+                           address='192.0.2.{0}' . format(idx % 250 + 1))
+    for idx in range(servers):
+        account.add_server('testyaa{0}' . format(idx + 1), type=SERVER_TYPES[idx % len(SERVER_TYPES)],
+                           network_zones=[NETWORK_ZONES[idx % len(NETWORK_ZONES)]],
+                           nickname='web{0}' . format(idx + 1) if idx % 2 else 'db{0}' . format(idx + 1),
+                           primary_ip='198.51.100.{0}' . format(idx % 250 + 1))
+    return(account)
+
+
+def _int(params, key, default=0):
+    return(int(params.get(key, default)))
+
+
+def _bool(params, key, default=False):
+    value = params.get(key, default)
+    if isinstance(value, bool):
+        return(value)
+    return(str(value).lower() in ['1', 'true', 'yes'])
+
+
+def dns_zone_list(account, params):
+    return([account.zone_info(zone_id) for zone_id in list(account.zones)])
+
+
+def dns_zone_info(account, params):
+    return(account.zone_info(params.get('id')))
+
+
+def dns_zone_create(account, params):
+    zone = account.add_zone(params['nickname'], ttl=_int(params, 'ttl'))
+    return(account.zone_info(zone['id']))
+
+
+def dns_zone_update(account, params):
+    zone = account.zone_info(params.get('id'))
+    account.zones[zone['id']]['ttl'] = _int(params, 'ttl', zone['ttl'])
+    return(account.zone_info(zone['id']))
+
+
+def dns_zone_delete(account, params):
+    zone = account.zone_info(params.get('id'))
+    for domain in zone['domains']:
+        account.remove_domain(domain['domain'])
+    for record in zone['records']:
+        account.remove_record(record['id'])
+    del account.zones[zone['id']]
+    return(True)
+
+
+def dns_zone_domain_list(account, params):
+    return([dict(d) for d in account.domains.values()])
+
+
+def dns_zone_domain_info(account, params):
+    if params.get('domain') not in account.domains:
+        raise ApiError(404, 'ApiErrorDoesNotExist', 'Domain does not exist')
+    return(dict(account.domains[params['domain']]))
+
+
+def dns_zone_domain_create(account, params):
+    account.zone_info(params.get('zone_id'))
+    if params.get('domain') in account.domains:
+        raise ApiError(400, 'ApiErrorDuplicate', 'Domain already exists')
+    return(dict(account.add_domain(params['zone_id'], params['domain'])))
+
+
+def dns_zone_domain_delete(account, params):
+    domain = dns_zone_domain_info(account, params)
+    account.remove_domain(domain['domain'])
+    return(True)
+
+
+def dns_zone_record_list(account, params):
+    return([dict(r) for r in account.records.values()])
+
+
+def dns_zone_record_info(account, params):
+    if params.get('id') not in account.records:
+        raise ApiError(404, 'ApiErrorDoesNotExist', 'Record does not exist')
+    return(dict(account.records[params['id']]))
+
+
+def dns_zone_record_create(account, params):
+    account.zone_info(params.get('zone_id'))
+    # as in DNS, a CNAME can't share its name with any other record.
+    record_type = params.get('type', 'A')
+    for existing in account.records.values():
+        if (existing['zone_id'] == params['zone_id'] and existing['record'] == params.get('record', '') and
+                'CNAME' in (existing['type'], record_type)):
+            raise ApiError(400, 'ApiErrorDuplicate', 'A CNAME record cannot share its name with another record')
+    new = account.add_record(params['zone_id'], record=params.get('record', ''), type=params.get('type', 'A'),
+                             address=params.get('address', ''), ttl=_int(params, 'ttl'),
+                             priority=_int(params, 'priority'), relative=_bool(params, 'relative'))
+    return(dict(new))
+
+
+def dns_zone_record_update(account, params):
+    current = dns_zone_record_info(account, params)
+    for key in ['record', 'type', 'address', 'zone_id']:
+        if key in params:
+            current[key] = params[key]
+    for key in ['ttl', 'priority']:
+        if key in params:
+            current[key] = _int(params, key)
+    if 'relative' in params:
+        current['relative'] = _bool(params, 'relative')
+    account.update_record(current)
+    return(dict(current))
+
+
+def dns_zone_record_delete(account, params):
+    record = dns_zone_record_info(account, params)
+    account.remove_record(record['id'])
+    return(True)
+
+
+def dns_reload(account, params):
+    return(account.new_job('dns'))
+
+
+def job_status(account, params):
+    return(account.job_status(params.get('id')))
+
+
+def server_list(account, params):
+    return([dict(server) for server in account.servers.values()])
+
+
+def server_info(account, params):
+    if params.get('name') not in account.servers:
+        raise ApiError(404, 'ApiErrorDoesNotExist', 'Server does not exist')
+    return(dict(account.servers[params['name']]))
+
+
+def apikey_info(account, params):
+    return(dict(key='*' * 32, scope=dict(method='*'), expiry=None))
+
+
+API_METHODS = {
+    'apikey.info': apikey_info,
+    'dns.reload': dns_reload,
+    'dns.zone_create': dns_zone_create,
+    'dns.zone_delete': dns_zone_delete,
+    'dns.zone_domain_create': dns_zone_domain_create,
+    'dns.zone_domain_delete': dns_zone_domain_delete,
+    'dns.zone_domain_info': dns_zone_domain_info,
+    'dns.zone_domain_list': dns_zone_domain_list,
+    'dns.zone_info': dns_zone_info,
+    'dns.zone_list': dns_zone_list,
+    'dns.zone_record_create': dns_zone_record_create,
+    'dns.zone_record_delete': dns_zone_record_delete,
+    'dns.zone_record_info': dns_zone_record_info,
+    'dns.zone_record_list': dns_zone_record_list,
+    'dns.zone_record_update': dns_zone_record_update,
+    'dns.zone_update': dns_zone_update,
+    'job.status': job_status,
+    'server.info': server_info,
+    'server.list': server_list,
+}
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        standin = self.server.standin
+        length = int(self.headers.get('Content-Length', 0))
+        params = dict(parse_qsl(self.rfile.read(length).decode('utf-8'), keep_blank_values=True))
+        api_method = self.path.strip('/').split('/')[-1]
+
+        latency = standin.method_latency.get(api_method, standin.latency)
+        if latency:
+            time.sleep(latency)
+
+        status, body, headers = 200, None, dict()
+        try:
+            if params.pop('api_key', None) != standin.api_key:
+                raise ApiError(403, 'ApiErrorForbidden', 'Bad api_key')
+            if api_method not in API_METHODS:
+                raise ApiError(404, 'ApiErrorMethodNotFound', 'Method not found')
+            with standin.account.lock:
+                standin.calls[api_method] += 1
+                fault = standin.next_fault(api_method)
+                if fault is not None:
+                    headers = fault.headers
+                    raise ApiError(fault.status, fault.error_type, fault.error, body=fault.body)
+                body = API_METHODS[api_method](standin.account, params)
+        except ApiError as e:
+            status, body = e.status, dict(error_type=e.error_type, error=e.error)
+            if e.body is not None:
+                body = e.body
+
+        content = body.encode('utf-8') if isinstance(body, str) else json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        for header, value in headers.items():
+            self.send_header(header, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+class Fault(object):
+    '''
+    An error to return instead of calling an API method. A fault fires
+    for the next count calls to the method, or on each call with the
+    given probability if count is None. If body is given it is sent as
+    is in place of the API's JSON error (e.g. a proxy's error page).
+    '''
+
+    def __init__(self, status=503, count=1, rate=None, error_type='ApiErrorServiceUnavailable',
+                 error='Injected error', headers=None, body=None):
+        self.body = body
+        self.status = status
+        self.count = count
+        self.rate = rate
+        self.error_type = error_type
+        self.error = error
+        self.headers = headers or dict()
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def get_request(self):
+        sock, addr = super(_Server, self).get_request()
+        with self.standin.lock:
+            self.standin.connections += 1
+        return(sock, addr)
+
+
+def make_self_signed_cert(directory):
+    '''
+    Generate a throwaway certificate for 127.0.0.1/localhost with the
+    openssl CLI, returning the certificate and key paths.
+    '''
+    certfile = '{0}/standin.crt' . format(directory)
+    keyfile = '{0}/standin.key' . format(directory)
+    subprocess.check_call(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                           '-subj', '/CN=localhost', '-addext', 'subjectAltName=DNS:localhost,IP:127.0.0.1',
+                           '-keyout', keyfile, '-out', certfile],
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return(certfile, keyfile)
+
+
+class MemsetStandin(object):
+    '''
+    Runs the stand-in API on a random local port in a background thread.
+    Connections accepted and calls made per API method are counted so
+    that benchmarks can report handshakes and API calls per module run.
+
+    latency is added to every call unless the method has its own entry
+    in method_latency; faults are injected with inject_fault().
+    '''
+
+    def __init__(self, account=None, certfile=None, keyfile=None, latency=0.0, api_key=VALID_API_KEY,
+                 method_latency=None, seed=None):
+        self.account = account or MemsetAccount()
+        self.certfile = certfile
+        self.keyfile = keyfile
+        self.latency = latency
+        self.method_latency = method_latency or dict()
+        self.api_key = api_key
+        self.connections = 0
+        self.calls = defaultdict(int)
+        self.faults = dict()
+        self.lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        scheme = 'https' if self.certfile else 'http'
+        return('{0}://127.0.0.1:{1}/v1/json/' . format(scheme, self._server.server_address[1]))
+
+    def reset_counters(self):
+        with self.lock:
+            self.connections = 0
+            self.calls = defaultdict(int)
+
+    def inject_fault(self, api_method, **kwargs):
+        '''
+        Make calls to api_method fail; see Fault for the arguments. Use
+        '*' to inject faults into every method.
+        '''
+        self.faults[api_method] = Fault(**kwargs)
+
+    def clear_faults(self):
+        self.faults = dict()
+
+    def next_fault(self, api_method):
+        fault = self.faults.get(api_method, self.faults.get('*'))
+        if fault is None:
+            return(None)
+        if fault.count is None:
+            return(fault if self._random.random() < fault.rate else None)
+        if fault.count <= 0:
+            return(None)
+        fault.count -= 1
+        return(fault)
+
+    def start(self):
+        self._server = _Server(('127.0.0.1', 0), _RequestHandler)
+        self._server.standin = self
+        if self.certfile:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(self.certfile, self.keyfile)
+            self._server.socket = context.wrap_socket(self._server.socket, server_side=True)
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return(self)
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return(self.start())
+
+    def __exit__(self, *args):
+        self.stop()
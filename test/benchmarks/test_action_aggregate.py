@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2018, Simon Weald <ansible@simonweald.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+'''
+Cross-host aggregation in the memset_zone_record action plugin. Each
+host's worker is simulated by a thread, and the module is run in-process
+against the local stand-in.
+
+    python -m pytest test/benchmarks/test_action_aggregate.py
+'''
+
+from __future__ import (absolute_import, division, print_function)
+
+import importlib.util
+import os
+import threading
+import time
+
+import pytest
+
+from memset_standin import MemsetStandin, VALID_API_KEY
+
+from ansible import constants as C
+from ansible.module_utils import memset
+from ansible.modules.cloud.memset import memset_zone_record
+
+PLUGIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'lib', 'ansible', 'plugins', 'action',
+                      'memset_zone_record.py')
+
+
+def load_plugin():
+    spec = importlib.util.spec_from_file_location('memset_zone_record_action', PLUGIN)
+    plugin = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(plugin)
+    return(plugin)
+
+
+class FakeTask(object):
+    _uuid = 'task-uuid'
+    async_val = 0
+    check_mode = False
+    action = 'memset_zone_record'
+
+    def __init__(self, args):
+        self.args = args
+
+
+class FakeConnection(object):
+    transport = 'local'
+
+    class _shell(object):
+        tmpdir = '/nonexistent'
+
+
+def make_action(plugin, args, module_runs):
+    action = plugin.ActionModule.__new__(plugin.ActionModule)
+    action._task = FakeTask(args)
+    action._connection = FakeConnection()
+
+    def execute_module(module_name=None, module_args=None, task_vars=None):
+        module_runs.append(module_args)
+        module_args = dict(module_args, state='present', check_mode=False)
+        memset_zone_record.api_validation(args=module_args)
+        return(memset_zone_record.create_or_delete_records(module_args))
+
+    action._execute_module = execute_module
+    return(action)
+
+
+@pytest.fixture
+def standin(monkeypatch, tmpdir):
+    monkeypatch.delenv('MEMSET_CACHE_DIR', raising=False)
+    monkeypatch.setenv('MEMSET_JOURNAL_DIR', str(tmpdir.join('journal')))
+    monkeypatch.setenv('MEMSET_SINGLE_FLIGHT_DIR', str(tmpdir.join('flight')))
+    monkeypatch.setattr(C, 'DEFAULT_LOCAL_TMP', str(tmpdir))
+    monkeypatch.setattr(C, 'DEFAULT_FORKS', 50)
+    with MemsetStandin() as standin:
+        monkeypatch.setattr(memset, 'MEMSET_API_URL', standin.url)
+        yield standin
+    memset.close_connection_pools()
+
+
+def run_hosts(plugin, hosts, module_runs, forks=None):
+    results = dict()
+    # like Ansible's workers, at most forks hosts run the task at once.
+    workers = threading.Semaphore(forks or len(hosts))
+
+    def run(host, args):
+        task_vars = dict(inventory_hostname=host, ansible_play_batch=sorted(hosts))
+        with workers:
+            results[host] = make_action(plugin, args, module_runs).run(task_vars=task_vars)
+
+    threads = [threading.Thread(target=run, args=item) for item in hosts.items()]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return(results)
+
+
+def test_aggregated_records(standin):
+    zone = standin.account.add_zone('example.com')
+    standin.account.add_record(zone['id'], record='web0', address='192.0.2.1')
+    hosts = dict()
+    for idx in range(20):
+        hosts['web{0}' . format(idx)] = dict(api_key=VALID_API_KEY, zone='example.com', type='A',
+                                             record='web{0}' . format(idx), address='192.0.2.1')
+    # two hosts asking for the same record only create it once.
+    for host in ['lb0', 'lb1']:
+        hosts[host] = dict(api_key=VALID_API_KEY, zone='example.com', type='A', record='lb', address='192.0.2.2')
+
+    module_runs = []
+    results = run_hosts(load_plugin(), hosts, module_runs)
+
+    assert len(module_runs) == 1 and len(module_runs[0]['records']) == 21
+    assert dict(standin.calls) == {'dns.zone_list': 1, 'dns.zone_info': 1, 'dns.zone_record_create': 20}
+    assert not results['web0']['changed'] and results['web1']['changed']
+    assert results['lb0']['changed'] and results['lb1']['changed']
+    assert results['web5']['memset_api']['record'] == 'web5'
+    assert all([result['memset_aggregate'] == dict(hosts=22, records=21) for result in results.values()])
+    assert len(standin.account.records) == 21
+
+
+def test_missing_zone_fails_only_its_host(standin):
+    standin.account.add_zone('example.com')
+    hosts = dict(
+        good=dict(api_key=VALID_API_KEY, zone='example.com', type='A', record='good', address='192.0.2.1'),
+        bad=dict(api_key=VALID_API_KEY, zone='example.org', type='A', record='bad', address='192.0.2.1'),
+    )
+    results = run_hosts(load_plugin(), hosts, [])
+    assert results['good']['changed'] and not results['good']['failed']
+    assert results['bad']['failed'] and 'does not exist' in results['bad']['msg']
+
+
+def test_rounds_limited_by_forks(standin, monkeypatch):
+    monkeypatch.setenv('MEMSET_RECORD_AGGREGATE_WINDOW', '5')
+    monkeypatch.setattr(C, 'DEFAULT_FORKS', 5)
+    standin.account.add_zone('example.com')
+    hosts = dict([('web{0}' . format(idx), dict(api_key=VALID_API_KEY, zone='example.com', type='A',
+                                                record='web{0}' . format(idx), address='192.0.2.1'))
+                  for idx in range(10)])
+
+    module_runs = []
+    start = time.time()
+    results = run_hosts(load_plugin(), hosts, module_runs, forks=5)
+    # a round closes once every fork has arrived, rather than after the window.
+    assert time.time() - start < 5
+    assert len(module_runs) == 2 and all([len(module_run['records']) == 5 for module_run in module_runs])
+    assert all([result['changed'] for result in results.values()])
+
+
+def test_single_record_semantics(standin):
+    zone = standin.account.add_zone('example.com')
+    for address in ['192.0.2.1', '192.0.2.2']:
+        standin.account.add_record(zone['id'], record='www', address=address)
+    hosts = dict(
+        web=dict(api_key=VALID_API_KEY, zone='example.com', type='A', record='www', address='192.0.2.3'),
+        mail=dict(api_key=VALID_API_KEY, zone='example.com', type='A', record='mail', address='192.0.2.4'),
+    )
+    results = run_hosts(load_plugin(), hosts, [])
+
+    # as when the host runs the module on its own, every record with the
+    # same name is updated, rather than only one of them.
+    assert results['web']['changed'] and results['mail']['changed']
+    addresses = sorted([record['address'] for record in standin.account.records.values() if record['record'] == 'www'])
+    assert addresses == ['192.0.2.3', '192.0.2.3']
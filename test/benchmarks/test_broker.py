@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2018, Simon Weald <ansible@simonweald.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+'''
+API calls routed through the broker, which is started on demand as a
+separate process, against the local stand-in.
+
+    python -m pytest test/benchmarks/test_broker.py
+'''
+
+from __future__ import (absolute_import, division, print_function)
+
+import os
+import threading
+import time
+
+import pytest
+
+from memset_standin import MemsetStandin, VALID_API_KEY
+
+from ansible.module_utils import memset, memset_broker  # noqa: F401 registers the broker
+
+
+@pytest.fixture
+def standin(monkeypatch, tmpdir):
+    monkeypatch.delenv('MEMSET_CACHE_DIR', raising=False)
+    monkeypatch.setenv('MEMSET_SINGLE_FLIGHT_DIR', str(tmpdir.join('flight')))
+    monkeypatch.setenv('MEMSET_JOURNAL_DIR', str(tmpdir.join('journal')))
+    monkeypatch.setenv('MEMSET_BROKER_SOCKET', str(tmpdir.join('broker', 'broker.sock')))
+    monkeypatch.setenv('MEMSET_BROKER_IDLE_TIMEOUT', '1')
+    monkeypatch.setattr(memset, '_API_CALLS', [])
+    with MemsetStandin(method_latency={'dns.zone_list': 0.2}) as standin:
+        monkeypatch.setattr(memset, 'MEMSET_API_URL', standin.url)
+        yield standin
+    memset.close_connection_pools()
+
+
+def test_brokered_list_calls(standin):
+    zone = standin.account.add_zone('example.com')
+    for _ in range(3):
+        has_failed, msg, response = memset.memset_api_call(VALID_API_KEY, 'dns.zone_list')
+        assert not has_failed and [item['id'] for item in msg] == [zone['id']]
+    assert standin.calls['dns.zone_list'] == 1
+    assert [call['cached'] for call in memset._API_CALLS] == [False, True, True]
+
+    # a change made through the broker drops the account's responses.
+    has_failed, msg, response = memset.memset_api_call(VALID_API_KEY, 'dns.zone_create', payload=dict(nickname='example.org'))
+    assert not has_failed
+    has_failed, msg, response = memset.memset_api_call(VALID_API_KEY, 'dns.zone_list',
+                                                       item_filter=lambda item: item['nickname'] == 'example.org')
+    assert [item['nickname'] for item in msg] == ['example.org'] and response.item_count == 2
+    assert standin.calls['dns.zone_list'] == 2
+
+
+def test_broker_started_once(standin):
+    results = [None] * 10
+
+    def run(idx):
+        results[idx] = memset.memset_api_call(VALID_API_KEY, 'dns.zone_list')[0]
+
+    threads = [threading.Thread(target=run, args=(idx,)) for idx in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [False] * 10
+    assert standin.calls['dns.zone_list'] == 1
+
+
+def test_broker_exits_when_idle(standin):
+    memset.memset_api_call(VALID_API_KEY, 'dns.zone_list')
+    path = os.environ['MEMSET_BROKER_SOCKET']
+    assert os.path.exists(path)
+    deadline = time.time() + 10
+    while os.path.exists(path) and time.time() < deadline:
+        time.sleep(0.1)
+    assert not os.path.exists(path)
+
+    # the next call starts a new broker.
+    memset.memset_api_call(VALID_API_KEY, 'dns.zone_list')
+    assert os.path.exists(path) and standin.calls['dns.zone_list'] == 2
+
+
+def test_unusable_broker_falls_back(standin, monkeypatch):
+    monkeypatch.setenv('MEMSET_BROKER_SOCKET', '/proc/memset/broker.sock')
+    has_failed, msg, response = memset.memset_api_call(VALID_API_KEY, 'dns.zone_list')
+    assert not has_failed and standin.calls['dns.zone_list'] == 1
@@ -0,0 +1,499 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2018, Simon Weald <ansible@simonweald.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+'''
+API call budgets for the memset modules, checked against the local
+stand-in. Each test runs a module the way Ansible would and fails if it
+makes more calls (in total, or to any one method) than its budget.
+
+    python -m pytest test/benchmarks/test_call_budget.py
+'''
+
+from __future__ import (absolute_import, division, print_function)
+
+import contextlib
+import importlib
+import io
+import json
+import os
+import time
+
+import pytest
+
+from memset_standin import MemsetStandin, VALID_API_KEY, synthetic_account
+
+from ansible.module_utils import basic, memset
+
+
+@pytest.fixture
+def standin(monkeypatch, tmpdir):
+    monkeypatch.delenv('MEMSET_CACHE_DIR', raising=False)
+    monkeypatch.setenv('MEMSET_JOURNAL_DIR', str(tmpdir.join('journal')))
+    monkeypatch.setenv('MEMSET_SINGLE_FLIGHT_DIR', str(tmpdir.join('flight')))
+    monkeypatch.delenv('MEMSET_API_TRACE', raising=False)
+    monkeypatch.setattr(memset, '_API_CALLS', [])
+    monkeypatch.setattr(memset, '_RETRY_STATS', dict(retries=0, backoff_seconds=0.0))
+    monkeypatch.setattr(memset, 'RETRY_BASE_DELAY', 0.01)
+    with MemsetStandin() as standin:
+        monkeypatch.setattr(memset, 'MEMSET_API_URL', standin.url)
+        yield standin
+    memset.close_connection_pools()
+
+
+def run_module(module_name, check_mode=False, **params):
+    params.setdefault('api_key', VALID_API_KEY)
+    if check_mode:
+        params['_ansible_check_mode'] = True
+    basic._ANSIBLE_ARGS = json.dumps(dict(ANSIBLE_MODULE_ARGS=params)).encode('utf-8')
+    module = importlib.import_module('ansible.modules.cloud.memset.{0}' . format(module_name))
+
+    stdout = io.StringIO()
+    with contextlib.redirect_stdout(stdout):
+        with pytest.raises(SystemExit):
+            module.main()
+    return(json.loads(stdout.getvalue()))
+
+
+def assert_budget(standin, total, **per_method):
+    '''
+    per_method is keyed on the API method with '.' replaced by '__'.
+    '''
+    calls = dict(standin.calls)
+    assert sum(calls.values()) <= total, calls
+    for method, budget in per_method.items():
+        assert calls.get(method.replace('__', '.'), 0) <= budget, calls
+    standin.reset_counters()
+
+
+def test_zone_create(standin):
+    result = run_module('memset_zone', state='present', name='example.com', ttl=300)
+    assert result['changed'] and result['memset_api']['nickname'] == 'example.com'
+    assert_budget(standin, 2, dns__zone_list=1)
+
+
+def test_zone_unchanged(standin):
+    standin.account.add_zone('example.com', ttl=300)
+    result = run_module('memset_zone', state='present', name='example.com', ttl=300)
+    assert not result['changed'] and result['memset_api']['ttl'] == 300
+    assert_budget(standin, 1, dns__zone_list=1)
+
+
+def test_zone_ttl_update(standin):
+    standin.account.add_zone('example.com', ttl=300)
+    result = run_module('memset_zone', state='present', name='example.com', ttl=600)
+    assert result['changed'] and result['memset_api']['ttl'] == 600
+    assert_budget(standin, 2, dns__zone_list=1)
+
+
+def test_zone_delete(standin):
+    standin.account.add_zone('example.com')
+    result = run_module('memset_zone', state='absent', name='example.com')
+    assert result['changed'] and not standin.account.zones
+    assert_budget(standin, 2, dns__zone_list=1)
+
+
+def test_zone_already_absent(standin):
+    result = run_module('memset_zone', state='absent', name='example.com')
+    assert not result['changed']
+    assert_budget(standin, 1, dns__zone_list=1)
+
+
+@pytest.mark.parametrize('state', ['present', 'absent'])
+def test_zone_check_mode(standin, state):
+    result = run_module('memset_zone', check_mode=True, state=state, name='example.com')
+    assert result['changed'] == (state == 'present')
+    assert_budget(standin, 1, dns__zone_list=1)
+
+
+def age_cache(tmpdir, seconds):
+    for entry in tmpdir.join('cache').visit():
+        if entry.isfile():
+            mtime = entry.mtime() - seconds
+            os.utime(str(entry), (mtime, mtime))
+
+
+def test_zone_cache_warm(standin, monkeypatch, tmpdir):
+    monkeypatch.setenv('MEMSET_CACHE_DIR', str(tmpdir.join('cache')))
+    standin.account.add_zone('example.com', ttl=300)
+    run_module('memset_zone', state='present', name='example.com', ttl=300)
+    assert_budget(standin, 1, dns__zone_list=1)
+
+    for _ in range(3):
+        assert not run_module('memset_zone', state='present', name='example.com', ttl=300)['changed']
+    assert_budget(standin, 0)
+
+
+def test_zone_cache_invalidated_by_change(standin, monkeypatch, tmpdir):
+    monkeypatch.setenv('MEMSET_CACHE_DIR', str(tmpdir.join('cache')))
+    standin.account.add_zone('example.com', ttl=300)
+    run_module('memset_zone', state='present', name='example.com', ttl=300)
+    assert run_module('memset_zone', state='present', name='example.com', ttl=600)['changed']
+    assert standin.calls['dns.zone_list'] == 1 and standin.calls['dns.zone_update'] == 1
+    standin.reset_counters()
+
+    # the update drops the account's entries, so the list is fetched once more.
+    for _ in range(2):
+        result = run_module('memset_zone', state='present', name='example.com', ttl=600)
+        assert not result['changed'] and result['memset_api']['ttl'] == 600
+    assert standin.calls['dns.zone_list'] == 1
+    assert_budget(standin, 1, dns__zone_list=1)
+
+
+def test_zone_cache_expires(standin, monkeypatch, tmpdir):
+    monkeypatch.setenv('MEMSET_CACHE_DIR', str(tmpdir.join('cache')))
+    monkeypatch.setenv('MEMSET_CACHE_TTL', '60')
+    standin.account.add_zone('example.com', ttl=300)
+    run_module('memset_zone', state='present', name='example.com', ttl=300)
+    age_cache(tmpdir, 30)
+    run_module('memset_zone', state='present', name='example.com', ttl=300)
+    assert_budget(standin, 1, dns__zone_list=1)
+
+    age_cache(tmpdir, 61)
+    run_module('memset_zone', state='present', name='example.com', ttl=300)
+    assert standin.calls['dns.zone_list'] == 1
+    assert_budget(standin, 1, dns__zone_list=1)
+
+
+def test_zone_domain_create(standin):
+    standin.account.add_zone('example.com')
+    result = run_module('memset_zone_domain', state='present', zone='example.com', domain='example.com')
+    assert result['changed'] and result['memset_api']['domain'] == 'example.com'
+    assert_budget(standin, 3, dns__zone_list=1, dns__zone_domain_list=1, dns__zone_domain_info=0)
+
+
+def test_zone_domain_delete(standin):
+    zone = standin.account.add_zone('example.com')
+    standin.account.add_domain(zone['id'], 'example.com')
+    result = run_module('memset_zone_domain', state='absent', zone='example.com', domain='example.com')
+    assert result['changed']
+    assert_budget(standin, 3, dns__zone_list=1, dns__zone_domain_list=1)
+
+
+def test_zone_domain_unchanged(standin):
+    zone = standin.account.add_zone('example.com')
+    standin.account.add_domain(zone['id'], 'example.com')
+    result = run_module('memset_zone_domain', state='present', zone='example.com', domain='example.com')
+    assert not result['changed'] and result['memset_api'] == dict(domain='example.com', zone_id=zone['id'])
+    assert_budget(standin, 2, dns__zone_list=1, dns__zone_domain_list=1, dns__zone_domain_info=0)
+
+
+def test_zone_domain_bulk(standin):
+    zone = standin.account.add_zone('example.com')
+    other = standin.account.add_zone('example.org')
+    standin.account.add_domain(zone['id'], 'example.com')
+    standin.account.add_domain(other['id'], 'old.example.org')
+    domains = ['example.com'] + ['vanity{0}.example.com' . format(idx) for idx in range(200)]
+    domains.append(dict(domain='old.example.org', zone='example.org', state='absent'))
+    domains.append(dict(name='lost.example.net', zone='example.net'))
+
+    result = run_module('memset_zone_domain', zone='example.com', domains=domains, max_concurrency=8)
+    assert result['changed'] and result['failed'] and '1 of 203 domains' in result['msg']
+    results = result['domains']
+    assert not results[0]['changed'] and results[0]['memset_api']['zone_id'] == zone['id']
+    assert all([item['changed'] and item['memset_api']['zone_id'] == zone['id'] for item in results[1:201]])
+    assert results[201]['changed'] and 'old.example.org' not in standin.account.domains
+    assert results[202]['failed'] and 'does not exist' in results[202]['msg']
+    assert len(standin.account.domains) == 201
+    assert_budget(standin, 203, dns__zone_list=1, dns__zone_domain_list=1, dns__zone_domain_info=0,
+                  dns__zone_domain_create=200, dns__zone_domain_delete=1)
+
+
+def test_zone_record_create(standin):
+    standin.account.add_zone('example.com')
+    result = run_module('memset_zone_record', zone='example.com', type='A', record='www', address='192.0.2.1')
+    assert result['changed']
+    assert_budget(standin, 3, dns__zone_list=1, dns__zone_record_list=1)
+
+
+def test_zone_record_bulk(standin):
+    zone = standin.account.add_zone('example.com')
+    standin.account.add_record(zone['id'], record='old', address='192.0.2.1')
+    records = [dict(zone='example.com', type='A', record='host{0}' . format(idx), address='192.0.2.1')
+               for idx in range(10)]
+    records.append(dict(zone='example.com', type='A', record='old', state='absent'))
+    result = run_module('memset_zone_record', records=records)
+    assert result['changed']
+    assert_budget(standin, 13, dns__zone_list=1, dns__zone_record_list=1, dns__zone_record_create=10)
+
+
+def test_zone_record_bulk_duplicates(standin):
+    standin.account.add_zone('example.com')
+    record = dict(zone='example.com', type='A', record='www', address='192.0.2.1')
+    result = run_module('memset_zone_record', records=[record, dict(record)])
+    assert result['changed'] and all([item['changed'] for item in result['records']])
+    assert len(standin.account.records) == 1
+    assert_budget(standin, 3, dns__zone_list=1, dns__zone_record_list=1, dns__zone_record_create=1)
+
+    # running it again changes nothing.
+    result = run_module('memset_zone_record', records=[record, dict(record)])
+    assert not result['changed'] and len(standin.account.records) == 1
+
+
+def test_zone_record_bulk_match_name(standin):
+    standin.account.add_zone('example.com')
+    records = [dict(zone='example.com', type='A', record='www', address=address) for address in ['192.0.2.1', '192.0.2.2']]
+    result = run_module('memset_zone_record', records=records, record_match='name')
+    # the second item updates the record the first one created.
+    assert all([item['changed'] for item in result['records']])
+    assert [record['address'] for record in standin.account.records.values()] == ['192.0.2.2']
+    assert_budget(standin, 4, dns__zone_list=1, dns__zone_record_create=1, dns__zone_record_update=1)
+
+
+def test_zone_sync_replace_type(standin):
+    zone = standin.account.add_zone('example.com')
+    standin.account.add_record(zone['id'], record='www', address='192.0.2.1')
+    # a slow delete would let the create reach the API first if they were
+    # made together.
+    standin.method_latency['dns.zone_record_delete'] = 0.2
+    result = run_module('memset_zone_sync', zone='example.com', purge=True,
+                        records=[dict(type='CNAME', record='www', address='example.org')])
+    assert result['changed'] and not result['failed'], result
+    assert [record['type'] for record in standin.account.records.values()] == ['CNAME']
+    assert_budget(standin, 3, dns__zone_list=1, dns__zone_record_delete=1, dns__zone_record_create=1)
+
+
+def test_zone_sync_unchanged(standin):
+    zone = standin.account.add_zone('example.com')
+    standin.account.add_record(zone['id'], record='www', address='192.0.2.1')
+    result = run_module('memset_zone_sync', zone='example.com', purge=True,
+                        records=[dict(type='A', record='www', address='192.0.2.1')])
+    assert not result['changed']
+    assert_budget(standin, 1, dns__zone_list=1)
+
+
+def test_zone_retried_list(standin):
+    standin.account.add_zone('example.com', ttl=300)
+    standin.inject_fault('dns.zone_list', status=503, count=1)
+    result = run_module('memset_zone', state='present', name='example.com', ttl=300)
+    assert not result['failed'] and result['memset_api_retries']['retries'] == 1
+    assert result['memset_api_stats']['methods']['dns.zone_list']['retries'] == 1
+    assert_budget(standin, 2, dns__zone_list=2)
+
+
+def test_non_json_error(standin, monkeypatch):
+    monkeypatch.setenv('MEMSET_API_RETRIES', '1')
+    standin.inject_fault('dns.zone_list', status=502, count=2, body='<html><h1>502 Bad Gateway</h1></html>')
+    result = run_module('memset_zone', state='present', name='example.com')
+    assert result['failed'] and result['msg'] == 'Memset API returned a 502 response: <html><h1>502 Bad Gateway</h1></html>'
+    assert_budget(standin, 2, dns__zone_list=2)
+
+
+def test_dns_reload(standin):
+    result = run_module('memset_dns_reload', poll=True)
+    assert result['changed']
+    assert_budget(standin, 2, dns__reload=1, job__status=1)
+
+
+def test_dns_reload_only_if_dirty(standin):
+    standin.account.add_zone('example.com')
+    run_module('memset_zone_record', state='present', zone='example.com', type='A', record='www', address='192.0.2.1')
+    result = run_module('memset_dns_reload', only_if_dirty=True)
+    assert result['changed'] and result['dns_changes'] == 1
+    standin.reset_counters()
+
+    # an unchanged run leaves nothing to publish.
+    run_module('memset_zone_record', state='present', zone='example.com', type='A', record='www', address='192.0.2.1')
+    result = run_module('memset_dns_reload', only_if_dirty=True)
+    assert not result['changed'] and result['dns_changes'] == 0
+    assert 'dns.reload' not in standin.calls
+
+
+def test_dns_reload_coalesced(standin):
+    results = [run_module('memset_dns_reload', coalesce_window=60) for _ in range(5)]
+    assert results[0]['changed'] and not results[0]['coalesced']
+    assert all([result['coalesced'] and not result['changed'] for result in results[1:]])
+    assert results[4]['memset_api']['id'] == results[0]['memset_api']['id']
+    assert_budget(standin, 1, dns__reload=1)
+
+    # a change since the last reload needs a reload of its own.
+    run_module('memset_zone', state='present', name='example.com')
+    standin.reset_counters()
+    result = run_module('memset_dns_reload', coalesce_window=60)
+    assert result['changed'] and not result['coalesced']
+    assert_budget(standin, 1, dns__reload=1)
+
+
+def test_stats_and_trace(standin, monkeypatch, tmpdir):
+    trace = tmpdir.join('trace.jsonl')
+    monkeypatch.setenv('MEMSET_API_TRACE', str(trace))
+    standin.account.add_zone('example.com', ttl=300)
+    result = run_module('memset_zone', state='present', name='example.com', ttl=600)
+
+    stats = result['memset_api_stats']
+    assert stats['calls'] == sum(standin.calls.values())
+    assert sorted(stats['methods']) == sorted(standin.calls)
+    assert stats['latency_p95'] <= stats['latency_total']
+
+    lines = [json.loads(line) for line in trace.readlines()]
+    assert [line['method'] for line in lines] == ['dns.zone_list', 'dns.zone_update']
+    assert all([line['status'] == 200 and line['response_bytes'] > 0 for line in lines])
+    assert VALID_API_KEY not in trace.read()
+
+
+@pytest.mark.parametrize('filters, expected', [
+    (dict(), 20),
+    (dict(type=['MINISERVER']), 7),
+    (dict(type=['miniserver'], network_zone=['reading']), 3),
+    (dict(status=['live'], name='web*'), 10),
+    (dict(name='^(db1|web2)$', name_match='regex'), 2),
+])
+def test_server_facts(standin, filters, expected):
+    standin.account.servers = synthetic_account(0, servers=20).servers
+    result = run_module('memset_server_facts', fields=['name', 'type'], **filters)
+    servers = result['ansible_facts']['memset_servers']
+    assert len(servers) == expected
+    assert all([sorted(server) == ['name', 'type'] for server in servers])
+    assert_budget(standin, 1, server__list=1)
+
+
+def test_zone_plan_apply(standin, tmpdir):
+    zone = standin.account.add_zone('example.com', ttl=300)
+    plan_file = str(tmpdir.join('zone.plan'))
+    result = run_module('memset_zone', check_mode=True, state='present', name='example.com', ttl=600, plan_file=plan_file)
+    assert result['changed'] and result['plan']['actions'] == [dict(method='dns.zone_update', payload=dict(id=zone['id'], ttl=600))]
+    assert standin.account.zones[zone['id']]['ttl'] == 300
+    assert_budget(standin, 1, dns__zone_list=1)
+
+    result = run_module('memset_zone', state='present', name='example.com', ttl=600, plan_file=plan_file)
+    assert result['changed'] and result['memset_api']['ttl'] == 600
+    assert_budget(standin, 2, dns__zone_list=0, dns__zone_info=1, dns__zone_update=1)
+
+
+def test_zone_record_plan_apply(standin, tmpdir):
+    standin.account.add_zone('example.com')
+    plan_file = str(tmpdir.join('record.plan'))
+    params = dict(zone='example.com', type='A', record='www', address='192.0.2.1', plan_file=plan_file)
+    result = run_module('memset_zone_record', check_mode=True, **params)
+    assert result['changed'] and not standin.account.records
+    assert_budget(standin, 2, dns__zone_list=1, dns__zone_record_list=1)
+
+    result = run_module('memset_zone_record', **params)
+    assert result['changed'] and result['memset_api']['address'] == '192.0.2.1'
+    assert_budget(standin, 2, dns__zone_list=0, dns__zone_record_list=0, dns__zone_info=1, dns__zone_record_create=1)
+
+
+def test_zone_domain_plan_apply(standin, tmpdir):
+    standin.account.add_zone('example.com')
+    plan_file = str(tmpdir.join('domain.plan'))
+    params = dict(zone='example.com', domain='example.com', plan_file=plan_file)
+    result = run_module('memset_zone_domain', check_mode=True, **params)
+    assert result['changed'] and not standin.account.domains
+    standin.reset_counters()
+
+    result = run_module('memset_zone_domain', **params)
+    assert result['changed'] and 'example.com' in standin.account.domains
+    assert_budget(standin, 3, dns__zone_list=0, dns__zone_domain_list=0, dns__zone_domain_create=1)
+
+
+def test_stale_plan_refused(standin, tmpdir):
+    zone = standin.account.add_zone('example.com')
+    plan_file = str(tmpdir.join('record.plan'))
+    params = dict(zone='example.com', type='A', record='www', address='192.0.2.1', plan_file=plan_file)
+    run_module('memset_zone_record', check_mode=True, **params)
+
+    # a matching record created since the plan was made invalidates it.
+    standin.account.add_record(zone['id'], record='www', address='192.0.2.9')
+    standin.reset_counters()
+    result = run_module('memset_zone_record', **params)
+    assert result['failed'] and 'changed since the plan was made' in result['msg']
+    assert len(standin.account.records) == 1
+    assert_budget(standin, 1, dns__zone_info=1)
+
+    # as is applying it with different options.
+    run_module('memset_zone_record', check_mode=True, **params)
+    result = run_module('memset_zone_record', **dict(params, address='192.0.2.2'))
+    assert result['failed'] and 'different options' in result['msg']
+
+
+@pytest.mark.parametrize('strategy, expected', [
+    ('auto', dict(dns__zone_info=1, dns__zone_record_list=0)),
+    ('record_list', dict(dns__zone_info=0, dns__zone_record_list=1)),
+])
+def test_zone_record_fetch_strategy(standin, strategy, expected):
+    standin.account = synthetic_account(3000, records_per_zone=10)
+    result = run_module('memset_zone_record', zone='zone7.example.com', type='A', record='host70', address='192.0.2.71',
+                        fetch_strategy=strategy)
+    assert not result['changed']
+    assert_budget(standin, 2, dns__zone_list=1, **expected)
+
+
+@pytest.mark.parametrize('zones, expected', [
+    (4, dict(dns__zone_info=4, dns__zone_record_list=0)),
+    (40, dict(dns__zone_info=0, dns__zone_record_list=1)),
+])
+def test_zone_record_bulk_fetch_strategy(standin, zones, expected):
+    standin.account = synthetic_account(1000, records_per_zone=10)
+    records = [dict(zone='zone{0}.example.com' . format(idx), type='A', record='host{0}' . format(idx * 10),
+                    address='192.0.2.{0}' . format(idx * 10 % 250 + 1)) for idx in range(zones)]
+    result = run_module('memset_zone_record', records=records)
+    assert not result['changed']
+    assert_budget(standin, 1 + zones, dns__zone_list=1, **expected)
+
+
+@pytest.mark.parametrize('zones_touched, zone_count, strategy, expected', [
+    (1, None, 'auto', 'zone_info'),
+    (2, None, 'auto', 'record_list'),
+    (8, 300, 'auto', 'zone_info'),
+    (8, 20, 'auto', 'record_list'),
+    (40, 1000, 'auto', 'record_list'),
+    (1, 300, 'record_list', 'record_list'),
+])
+def test_choose_fetch_strategy(zones_touched, zone_count, strategy, expected):
+    assert memset.choose_fetch_strategy(zones_touched, zone_count=zone_count, strategy=strategy) == expected
+    assert memset.choose_fetch_strategy(zones_touched, zone_count=zone_count, strategy=strategy,
+                                        cached=True) == ('record_list' if strategy == 'auto' else strategy)
+
+
+def test_zone_record_warm_cache(standin, monkeypatch, tmpdir):
+    monkeypatch.setenv('MEMSET_CACHE_DIR', str(tmpdir.join('cache')))
+    zone = standin.account.add_zone('example.com')
+    standin.account.add_record(zone['id'], type='A', record='www', address='192.0.2.1')
+    params = dict(zone='example.com', type='A', record='www', address='192.0.2.1')
+    assert not run_module('memset_zone_record', **params)['changed']
+    assert_budget(standin, 2, dns__zone_list=1, dns__zone_record_list=1, dns__zone_info=0)
+
+    for _ in range(3):
+        assert not run_module('memset_zone_record', **params)['changed']
+    assert_budget(standin, 0)
+
+
+def add_job(standin, duration):
+    job = standin.account.new_job('dns')
+    standin.account.jobs[job['id']] = (standin.account.jobs[job['id']][0], time.time() + duration)
+    return(job['id'])
+
+
+def test_job_wait(standin):
+    job_ids = [add_job(standin, duration) for duration in [0.0, 0.2, 0.2, 0.6]]
+    result = run_module('memset_job_wait', job_ids=job_ids, poll_interval=0.05, poll_max_interval=0.2, timeout=10)
+    assert not result['failed'] and not result['changed']
+    assert [job['id'] for job in result['jobs']] == job_ids
+    assert all([job['finished'] and job['job']['status'] == 'DONE' for job in result['jobs']])
+    # each job is only polled until it finishes.
+    assert result['jobs'][0]['checks'] == 1 and result['jobs'][3]['checks'] > result['jobs'][1]['checks']
+    assert result['jobs'][0]['latency'] < result['jobs'][3]['latency']
+    assert_budget(standin, 16, job__status=16)
+
+
+def test_job_wait_jobs_with_keys(standin):
+    job_ids = [add_job(standin, 0.2) for _ in range(2)]
+    jobs = [dict(id=job_ids[0]), dict(id=job_ids[1], api_key=VALID_API_KEY), dict(id=job_ids[0], api_key='wrongkey')]
+    result = run_module('memset_job_wait', jobs=jobs, poll_interval=0.05, timeout=10)
+    assert [job['id'] for job in result['jobs']] == [job_ids[0], job_ids[1], job_ids[0]]
+    assert [job['finished'] for job in result['jobs']] == [True, True, False]
+    # the bad key's job fails on its own, while the other account's jobs are waited for.
+    assert result['failed'] and '403' in result['jobs'][2]['msg']
+    assert 'wrongkey' not in json.dumps(result)
+
+
+def test_job_wait_deadline(standin):
+    job_ids = [add_job(standin, 0.0), add_job(standin, 60), 'no-such-job']
+    result = run_module('memset_job_wait', job_ids=job_ids, poll_interval=0.05, poll_max_interval=0.1, timeout=0.5)
+    assert result['failed'] and '2 of 3 jobs' in result['msg']
+    finished, slow, missing = result['jobs']
+    assert finished['finished'] and not slow['finished'] and slow['job']['status'] == 'PENDING'
+    assert missing['checks'] == 1 and 'ApiErrorDoesNotExist' in missing['msg']
+    # the slow job is checked at most once per poll_max_interval, plus once at the deadline.
+    assert slow['checks'] <= 7
+
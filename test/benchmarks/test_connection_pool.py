@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2018, Simon Weald <ansible@simonweald.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+'''
+When the keep-alive connection pool sends a request again on a fresh
+connection, checked against the local stand-in.
+
+    python -m pytest test/benchmarks/test_connection_pool.py
+'''
+
+from __future__ import (absolute_import, division, print_function)
+
+import socket
+import time
+
+import pytest
+
+from memset_standin import MemsetStandin, VALID_API_KEY
+
+from ansible.module_utils import memset
+
+
+@pytest.fixture
+def standin(monkeypatch, tmpdir):
+    monkeypatch.delenv('MEMSET_CACHE_DIR', raising=False)
+    monkeypatch.delenv('MEMSET_BROKER_SOCKET', raising=False)
+    monkeypatch.setenv('MEMSET_JOURNAL_DIR', str(tmpdir.join('journal')))
+    monkeypatch.setenv('MEMSET_SINGLE_FLIGHT_DIR', str(tmpdir.join('flight')))
+    monkeypatch.setattr(memset, '_API_CALLS', [])
+    monkeypatch.setattr(memset, 'RETRY_BASE_DELAY', 0.01)
+    with MemsetStandin() as standin:
+        monkeypatch.setattr(memset, 'MEMSET_API_URL', standin.url)
+        yield standin
+    memset.close_connection_pools()
+
+
+def test_stale_connection_is_replaced(standin):
+    has_failed, _msg, _response = memset.memset_api_call(api_key=VALID_API_KEY, api_method='dns.zone_list')
+    assert not has_failed
+
+    # swap the idle connection's socket for one the server has hung up on.
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    closed = socket.create_connection(listener.getsockname())
+    listener.accept()[0].close()
+    listener.close()
+    pool = memset.get_connection_pool(standin.url)
+    pool._idle[0].sock.close()
+    pool._idle[0].sock = closed
+    has_failed, _msg, _response = memset.memset_api_call(api_key=VALID_API_KEY, api_method='dns.zone_list')
+    assert not has_failed and pool.connections_opened == 2
+
+
+def test_timed_out_change_is_not_sent_again(standin):
+    zone = standin.account.add_zone('example.com')
+    pool = memset.get_connection_pool(standin.url)
+    pool.timeout = 0.2
+    has_failed, _msg, _response = memset.memset_api_call(api_key=VALID_API_KEY, api_method='dns.zone_list')
+    assert not has_failed
+
+    standin.method_latency['dns.zone_record_create'] = 0.5
+    has_failed, msg, _response = memset.memset_api_call(api_key=VALID_API_KEY, api_method='dns.zone_record_create',
+                                                        payload=dict(zone_id=zone['id'], type='A', record='www',
+                                                                     address='192.0.2.1'))
+    assert has_failed and 'ConnectionError' in msg
+
+    # give the stand-in time to finish the call which timed out.
+    time.sleep(0.5)
+    assert standin.calls['dns.zone_record_create'] == 1
+    assert len(standin.account.records) == 1
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2018, Simon Weald <ansible@simonweald.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+'''
+The memset inventory plugin against the local stand-in.
+
+    python -m pytest test/benchmarks/test_inventory.py
+'''
+
+from __future__ import (absolute_import, division, print_function)
+
+import os
+
+import pytest
+
+from memset_standin import MemsetStandin, VALID_API_KEY, synthetic_account
+
+from ansible.inventory.manager import InventoryManager
+from ansible.module_utils import memset
+from ansible.parsing.dataloader import DataLoader
+from ansible.plugins.loader import inventory_loader
+
+PLUGIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'lib', 'ansible', 'plugins', 'inventory')
+
+CONFIG = '''
+plugin: memset
+api_key: {api_key}
+name_groups:
+  webservers: ^web
+cache: {cache}
+cache_plugin: jsonfile
+cache_connection: {cache_dir}
+cache_timeout: 300
+'''
+
+
+@pytest.fixture
+def standin(monkeypatch, tmpdir):
+    monkeypatch.delenv('MEMSET_CACHE_DIR', raising=False)
+    monkeypatch.setenv('MEMSET_SINGLE_FLIGHT_DIR', str(tmpdir.join('flight')))
+    inventory_loader.add_directory(PLUGIN_DIR)
+    with MemsetStandin(account=synthetic_account(0, servers=4)) as standin:
+        monkeypatch.setattr(memset, 'MEMSET_API_URL', standin.url)
+        yield standin
+    memset.close_connection_pools()
+
+
+def load_inventory(tmpdir, cache=False):
+    config = tmpdir.join('memset.yml')
+    config.write(CONFIG . format(api_key=VALID_API_KEY, cache=str(cache).lower(), cache_dir=tmpdir.join('cache')))
+    return(InventoryManager(loader=DataLoader(), sources=[str(config)]))
+
+
+def test_groups(standin, tmpdir):
+    inventory = load_inventory(tmpdir)
+    groups = inventory.get_groups_dict()
+
+    assert sorted(groups['all']) == ['testyaa1', 'testyaa2', 'testyaa3', 'testyaa4']
+    assert groups['memset_type_miniserver'] == ['testyaa2']
+    assert sorted(groups['memset_status_live']) == sorted(groups['all'])
+    assert sorted(groups['memset_zone_reading']) == ['testyaa1', 'testyaa3']
+    assert sorted(groups['webservers']) == ['testyaa2', 'testyaa4']
+
+    host = inventory.get_host('testyaa2')
+    assert host.vars['ansible_host'] == host.vars['memset_primary_ip']
+    assert host.vars['memset_nickname'] == 'web2'
+    assert standin.calls['server.list'] == 1
+
+
+def test_cache(standin, tmpdir):
+    for _ in range(3):
+        inventory = load_inventory(tmpdir, cache=True)
+        assert len(inventory.get_groups_dict()['all']) == 4
+    assert standin.calls['server.list'] == 1
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2018, Simon Weald <ansible@simonweald.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+'''
+Response parsing, projection, and incremental parsing and filtering of
+JSON list responses.
+
+    python -m pytest test/benchmarks/test_json_stream.py
+'''
+
+from __future__ import (absolute_import, division, print_function)
+
+import io
+import json
+
+import pytest
+
+from memset_standin import MemsetStandin, VALID_API_KEY
+
+from ansible.module_utils import memset
+
+DOCUMENTS = [
+    [],
+    [1, 22, 333, -4.5e3, True, None, "a,b]"],
+    [{"id": "x", "nested": {"list": [1, 2, {"deep": "]}"}]}}, {"id": "yé"}],
+]
+
+
+def chunked(text, size):
+    return([text[idx:idx + size] for idx in range(0, len(text), size)])
+
+
+@pytest.mark.parametrize('document', DOCUMENTS)
+@pytest.mark.parametrize('size', [1, 3, 1024])
+def test_iter_json_list(document, size):
+    text = json.dumps(document, indent=1)
+    assert list(memset.iter_json_list(chunked(text, size))) == document
+
+
+@pytest.mark.parametrize('text', ['{"id": 1}', '[1, 2', '[{"id": 1}, {"id"', ''])
+def test_iter_json_list_invalid(text):
+    with pytest.raises(ValueError):
+        list(memset.iter_json_list(chunked(text, 2)))
+
+
+def test_filter_splits_multibyte_characters(monkeypatch):
+    monkeypatch.setattr(memset, 'STREAM_CHUNK_SIZE', 1)
+    body = json.dumps([dict(id='éé'), dict(id='b')], ensure_ascii=False).encode('utf-8')
+    reader = memset.JSONListFilter(lambda item: item['id'] != 'b')
+    reader(io.BytesIO(body))
+    assert reader.items == [dict(id='éé')] and reader.bytes_read == len(body)
+
+
+@pytest.mark.parametrize('cache', [False, True])
+def test_filtered_record_list(monkeypatch, tmpdir, cache):
+    monkeypatch.setattr(memset, '_API_CALLS', [])
+    monkeypatch.setenv('MEMSET_SINGLE_FLIGHT_DIR', str(tmpdir.join('flight')))
+    if cache:
+        monkeypatch.setenv('MEMSET_CACHE_DIR', str(tmpdir.join('cache')))
+    else:
+        monkeypatch.delenv('MEMSET_CACHE_DIR', raising=False)
+
+    with MemsetStandin() as standin:
+        monkeypatch.setattr(memset, 'MEMSET_API_URL', standin.url)
+        zone = standin.account.add_zone('example.com')
+        other = standin.account.add_zone('example.org')
+        for idx in range(100):
+            standin.account.add_record(other['id'], record='host{0}' . format(idx))
+        wanted = standin.account.add_record(zone['id'], record='www')
+
+        for _ in range(2):
+            has_failed, msg, response = memset.memset_api_call(VALID_API_KEY, 'dns.zone_record_list',
+                                                               item_filter=lambda record: record['zone_id'] == zone['id'])
+            assert not has_failed and msg == [wanted] and response.json() == [wanted]
+            assert response.content is None
+        assert standin.calls['dns.zone_record_list'] == (1 if cache else 2)
+    memset.close_connection_pools()
+
+    assert memset.memset_api_stats()['response_bytes'] > 100 * len(json.dumps(wanted))
+
+
+def test_response_parses_once():
+    response = memset.Response()
+    response.content = '[{"id": 1}]'
+    assert response.json() is response.json()
+    response.content = '[{"id": 2}]'
+    assert response.json() == [dict(id=2)]
+
+
+def test_projected_zone_list(monkeypatch, tmpdir):
+    monkeypatch.delenv('MEMSET_CACHE_DIR', raising=False)
+    monkeypatch.setenv('MEMSET_SINGLE_FLIGHT_DIR', str(tmpdir))
+    with MemsetStandin() as standin:
+        monkeypatch.setattr(memset, 'MEMSET_API_URL', standin.url)
+        zone = standin.account.add_zone('example.com', ttl=300)
+        standin.account.add_record(zone['id'], record='www')
+
+        has_failed, msg, response = memset.memset_api_call(VALID_API_KEY, 'dns.zone_list', fields=['id', 'nickname'])
+        assert msg == [dict(id=zone['id'], nickname='example.com')]
+        assert response.content is None and response.json() is msg
+
+        has_failed, msg, response = memset.memset_api_call(VALID_API_KEY, 'dns.zone_list', fields=['id', 'ttl'],
+                                                           item_filter=lambda item: item['nickname'] == 'example.com')
+        assert msg == [dict(id=zone['id'], ttl=300)]
+    memset.close_connection_pools()
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2018, Simon Weald <ansible@simonweald.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+'''
+Sharing identical list calls between concurrent callers. Each fork is
+simulated by a thread, which takes its own lock like a process would.
+
+    python -m pytest test/benchmarks/test_single_flight.py
+'''
+
+from __future__ import (absolute_import, division, print_function)
+
+import threading
+import time
+
+import pytest
+
+from memset_standin import MemsetStandin, VALID_API_KEY
+
+from ansible.module_utils import memset, memset_single_flight
+
+
+@pytest.fixture
+def standin(monkeypatch, tmpdir):
+    monkeypatch.delenv('MEMSET_CACHE_DIR', raising=False)
+    monkeypatch.setenv('MEMSET_SINGLE_FLIGHT_DIR', str(tmpdir))
+    monkeypatch.setattr(memset, '_API_CALLS', [])
+    monkeypatch.setattr(memset_single_flight, '_LAST_CHANGE', dict())
+    with MemsetStandin(method_latency={'dns.zone_list': 0.3, 'dns.zone_record_list': 0.3}) as standin:
+        monkeypatch.setattr(memset, 'MEMSET_API_URL', standin.url)
+        yield standin
+    memset.close_connection_pools()
+
+
+def run_threads(count, target):
+    results = [None] * count
+
+    def run(idx):
+        results[idx] = target(idx)
+
+    threads = [threading.Thread(target=run, args=(idx,)) for idx in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return(results)
+
+
+def test_concurrent_list_calls(standin):
+    zone = standin.account.add_zone('example.com')
+    results = run_threads(20, lambda idx: memset.memset_api_call(VALID_API_KEY, 'dns.zone_list'))
+
+    assert all([not has_failed and msg[0]['id'] == zone['id'] for has_failed, msg, _response in results])
+    assert standin.calls['dns.zone_list'] == 1
+    # the calls which shared another's result are traced as cached.
+    assert len([call for call in memset._API_CALLS if call['cached']]) == 19
+
+
+def test_concurrent_filtered_list_calls(standin):
+    zones = [standin.account.add_zone('example{0}.com' . format(idx)) for idx in range(10)]
+    for zone in zones:
+        standin.account.add_record(zone['id'], record='www')
+
+    def fetch(idx):
+        return(memset.memset_api_call(VALID_API_KEY, 'dns.zone_record_list',
+                                      item_filter=lambda record: record['zone_id'] == zones[idx]['id'])[1])
+
+    # each caller filters the shared body for itself.
+    results = run_threads(10, fetch)
+    assert [[record['zone_id'] for record in records] for records in results] == [[zone['id']] for zone in zones]
+    assert standin.calls['dns.zone_record_list'] == 1
+
+
+def test_sequential_calls_are_not_shared(standin):
+    for _ in range(3):
+        memset.memset_api_call(VALID_API_KEY, 'dns.zone_list')
+    assert standin.calls['dns.zone_list'] == 3
+
+
+def test_off_unless_configured(standin, monkeypatch, tmpdir):
+    monkeypatch.delenv('MEMSET_SINGLE_FLIGHT_DIR')
+    standin.account.add_zone('example.com')
+    run_threads(5, lambda idx: memset.memset_api_call(VALID_API_KEY, 'dns.zone_list'))
+    assert standin.calls['dns.zone_list'] == 5 and tmpdir.listdir() == []
+
+
+def test_call_started_before_own_change(tmpdir):
+    flight = memset_single_flight.SingleFlight(str(tmpdir))
+    fetched = []
+
+    def fetch(body):
+        def fetch(reader):
+            fetched.append(body)
+            time.sleep(0.3)
+            return(200, body, 0)
+        return(fetch)
+
+    leader = threading.Thread(target=flight.call, args=(VALID_API_KEY, 'dns.zone_list', dict(), fetch(b'old')))
+    leader.start()
+    time.sleep(0.1)
+    # a caller which has just changed the account can't use the old list.
+    result = flight.call(VALID_API_KEY, 'dns.zone_list', dict(), fetch(b'new'), not_before=time.time())
+    leader.join()
+
+    assert result == (200, b'new', 0, False) and fetched == [b'old', b'new']